@@ -0,0 +1,114 @@
+from __future__ import print_function
+
+import numpy as np
+
+
+class BufferArena(object):
+    """ named buffers that are kept and grown across calls
+
+    The engines request their output and working arrays from an arena by name. When
+    reuse is enabled, the arena keeps one buffer per name and only allocates a new,
+    larger buffer when a request does not fit, so in a streaming loop the buffers
+    quickly reach their steady-state size and no further allocations take place.
+
+    Note that with reuse enabled the arrays returned by the engines are views on
+    these buffers, and are overwritten by the next call to the same engine.
+
+    By default buffers are numpy arrays and get() returns a view of the requested
+    length. When an allocator is passed, such as pycuda.driver.mem_alloc, buffers are
+    allocated using allocator(nbytes) and get() returns the allocation itself.
+    """
+
+    def __init__(self, reuse=True, growth=1.5, min_size=1024, allocator=None):
+        """instantiate BufferArena
+
+        :param reuse: Whether to keep buffers across calls, when False every request
+            allocates a new buffer, but the statistics are still recorded.
+        :type reuse: bool
+
+        :param growth: The factor by which a buffer grows when a request does not fit.
+        :type growth: float
+
+        :param min_size: The minimum number of elements of a buffer.
+        :type min_size: int
+
+        :param allocator: Optional function that allocates nbytes of memory.
+        :type allocator: callable
+        """
+        self.reuse = reuse
+        self.growth = growth
+        self.min_size = min_size
+        self.allocator = allocator
+        self.buffers = {}
+        self.capacity = {}
+        self.high_water = {}
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+    def _allocate(self, size, dtype):
+        nbytes = max(size, 1) * np.dtype(dtype).itemsize
+        self.allocations += 1
+        self.allocated_bytes += nbytes
+        if self.allocator is None:
+            return np.empty(size, dtype=dtype)
+        return self.allocator(nbytes)
+
+    def get(self, name, size, dtype):
+        """ return a buffer for at least size elements of type dtype
+
+        :param name: The name of the buffer.
+        :type name: string
+
+        :param size: The number of elements needed.
+        :type size: int
+
+        :param dtype: The type of the elements.
+        :type dtype: numpy.dtype
+
+        :returns: An array of exactly size elements, or an allocation of at least size
+            elements when an allocator is used. The contents are undefined.
+        :rtype: numpy ndarray or the type returned by the allocator
+        """
+        size = int(size)
+        dtype = np.dtype(dtype)
+        self.high_water[name] = max(self.high_water.get(name, 0), size*dtype.itemsize)
+        if not self.reuse:
+            return self._allocate(size, dtype)
+
+        nbytes = size*dtype.itemsize
+        if nbytes > self.capacity.get(name, -1):
+            capacity = max(nbytes, int(self.capacity.get(name, 0)*self.growth), self.min_size*dtype.itemsize)
+            self.buffers[name] = self._allocate(capacity, np.uint8)
+            self.capacity[name] = capacity
+
+        buffer = self.buffers[name]
+        if self.allocator is None:
+            return buffer[:nbytes].view(dtype)
+        return buffer
+
+    def zeros(self, name, size, dtype):
+        """ return a numpy buffer like get() with all elements set to zero """
+        buffer = self.get(name, size, dtype)
+        buffer[:] = 0
+        return buffer
+
+    @property
+    def nbytes(self):
+        """ the total size of the buffers kept by the arena in bytes """
+        return sum(self.capacity.values())
+
+    def high_water_marks(self):
+        """ return the largest request made for each buffer
+
+        :returns: The largest number of bytes requested per buffer name
+        :rtype: dict
+        """
+        return dict(self.high_water)
+
+    def clear(self):
+        """ release all buffers and reset the statistics """
+        self.buffers.clear()
+        self.capacity.clear()
+        self.high_water.clear()
+        self.allocations = 0
+        self.allocated_bytes = 0
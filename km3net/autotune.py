@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+""" autotuner for the parameters of the NumPy engines and the streaming pipeline
+
+Usage::
+
+    python -m km3net.autotune --hits 20000 --window 1500 --latency 0.5
+    python -m km3net.autotune --input notebooks/sample.txt --show
+
+The tuner benchmarks every candidate configuration on a sample of real hits read
+from a file, or on synthetic hits from km3net.detector, and picks the fastest one
+whose time per slice stays within the latency target. The result is stored as a
+profile for this host. The engines in km3net.cpu and km3net.ringbuffer.replay_files
+take every parameter that is not passed explicitly from the profile when they are
+created with use_profile=True, or when the KM3NET_TUNING_PROFILE environment
+variable names a profile.
+
+The profile is stored in the file named by the KM3NET_TUNING_PROFILE environment
+variable, or in ~/.cache/km3net/profiles/<hostname>.json. Set the variable to an
+empty string to disable loading a profile altogether.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import itertools
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+ENGINE_SPACE = OrderedDict([
+    ("chunk_size", [None, 4096, 16384, 65536]),
+    ("block_size", [1, 4, 16]),
+    ("workers", sorted(set([1, 2, 4, multiprocessing.cpu_count()]))),
+])
+
+SLICE_LENGTHS = [5000, 10000, 20000, 50000]
+
+_profiles = {}
+
+
+def profile_path(host=None):
+    """ return the file in which the tuning profile of a host is stored
+
+    :returns: The path, or None when loading profiles is disabled
+    :rtype: string
+    """
+    path = os.environ.get("KM3NET_TUNING_PROFILE")
+    if path is not None:
+        return path or None
+    host = host or socket.gethostname()
+    return os.path.join(os.path.expanduser("~"), ".cache", "km3net", "profiles", host + ".json")
+
+
+def load_profile(path=None):
+    """ return the tuning profile, or an empty profile when there is none
+
+    Profiles are read from disk only once per path and kept in memory.
+
+    :rtype: dict
+    """
+    path = path or profile_path()
+    if not path:
+        return {}
+    if path not in _profiles:
+        try:
+            with open(path) as f:
+                _profiles[path] = json.load(f)
+        except (IOError, OSError, ValueError):
+            _profiles[path] = {}
+    return _profiles[path]
+
+
+def save_profile(profile, path=None):
+    """ store a tuning profile, replacing the previous profile in the same file """
+    path = path or profile_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, path)
+    _profiles[path] = profile
+
+
+def enabled_profile(use_profile=False):
+    """ return the tuning profile when it is enabled, or an empty profile
+
+    The profile is enabled by use_profile, or by a KM3NET_TUNING_PROFILE environment
+    variable that names a profile, so that nothing is read from the home directory by default.
+
+    :param use_profile: Load the profile of this host.
+    :type use_profile: bool
+
+    :rtype: dict
+    """
+    if not use_profile and not os.environ.get("KM3NET_TUNING_PROFILE"):
+        return {}
+    return load_profile()
+
+
+def engine_settings(name, use_profile=False):
+    """ return the tuned parameters for an engine class from the profile of this host
+
+    :param name: The name of the engine class, for example QuadraticDifferenceSparse.
+    :type name: string
+
+    :param use_profile: Load the profile of this host, see enabled_profile.
+    :type use_profile: bool
+
+    :rtype: dict
+    """
+    return enabled_profile(use_profile).get("engines", {}).get(name, {})
+
+
+def pipeline_settings(use_profile=False):
+    """ return the tuned slice_length and overlap from the profile of this host
+
+    :param use_profile: Load the profile of this host, see enabled_profile.
+    :type use_profile: bool
+
+    :rtype: dict
+    """
+    return enabled_profile(use_profile).get("pipeline", {})
+
+
+def sample_hits(N, filename=None, seed=0):
+    """ return a representative sample of N hits
+
+    :param filename: A file with real hits, read using km3net.util.get_real_input_data.
+        By default synthetic hits from km3net.detector.SyntheticDetector are used.
+    :type filename: string
+
+    :returns: x,y,z,ct
+    :rtype: tuple(numpy ndarray of type numpy.float32)
+    """
+    if filename:
+        from km3net.util import get_real_input_data
+        _, x, y, z, ct = get_real_input_data(filename)
+        return x[:N], y[:N], z[:N], ct[:N]
+
+    from km3net.detector import SyntheticDetector
+    detector = SyntheticDetector(seed=seed)
+    duration = 1.2 * N / detector.rate * 1e9
+    hits = detector.chunk(duration).hits
+    #ct is made relative to the start of the chunk, as in a slice read from disk
+    return hits.x[:N], hits.y[:N], hits.z[:N], hits.ct[:N] - hits.ct[0]
+
+
+def tune_engine(correlator_class, hits, window=1500, space=None, repeat=3, min_time=0.05, latency=None, verbose=False):
+    """ benchmark the candidate parameters of a correlator and return the best
+
+    Every candidate must produce the same number of edges as the default configuration.
+    Without a latency target the fastest candidate is selected. With a target, the
+    candidate with the fewest workers that meets it is selected, the fastest of those,
+    so the engine does not occupy more threads than needed. When no candidate meets
+    the target, the fastest is selected.
+
+    :param correlator_class: A NumPy correlator, such as km3net.cpu.QuadraticDifferenceSparse.
+    :type correlator_class: type
+
+    :param hits: The sample of hits as x,y,z,ct.
+    :type hits: tuple(numpy ndarray)
+
+    :param space: The candidate values per parameter, by default ENGINE_SPACE.
+    :type space: dict
+
+    :param latency: The largest acceptable time in seconds to correlate the sample.
+    :type latency: float
+
+    :returns: The selected parameters, and the measurements of every candidate
+    :rtype: dict, list(dict)
+    """
+    from km3net.benchmark import time_function
+
+    space = space or ENGINE_SPACE
+    N = len(hits[0])
+    reference = correlator_class(N, window, chunk_size=0, block_size=1, workers=1).compute(*hits)[3]
+    results = []
+    for values in itertools.product(*space.values()):
+        config = OrderedDict(zip(space.keys(), values))
+        correlator = correlator_class(N, window, chunk_size=config["chunk_size"] or 0,
+                                      block_size=config["block_size"], workers=config["workers"])
+        edges = correlator.compute(*hits)[3]
+        if edges != reference:
+            raise ValueError("configuration %s found %d instead of %d edges" % (dict(config), edges, reference))
+        median, _ = time_function(lambda: correlator.compute(*hits), repeat, min_time)
+        correlator.close()
+        results.append(dict(config, time=median))
+        if verbose:
+            print("%s %s: %.6f s" % (correlator_class.__name__, dict(config), median))
+    meeting = [r for r in results if latency is not None and r["time"] <= latency]
+    if meeting:
+        best = min(meeting, key=lambda r: (r["workers"], r["time"]))
+    else:
+        best = min(results, key=lambda r: r["time"])
+    return OrderedDict((k, best[k]) for k in space), results
+
+
+def tune_pipeline(correlator, purger, hits, slice_lengths=None, latency=None, repeat=3, verbose=False):
+    """ benchmark correlate and purge for several slice lengths and return the best
+
+    Consecutive slices overlap by the width of the sliding window, so that hits near the
+    end of a slice are also correlated with the start of the next slice. The best slice
+    length has the highest throughput, counting each hit once, while the time per slice
+    stays within the latency target. When no slice length meets the target, the one
+    with the lowest latency is selected.
+
+    :param correlator: A correlator with N at least as large as the longest slice plus the overlap.
+    :type correlator: km3net.cpu.CorrelateSparse
+
+    :param purger: A purger with N at least as large as the longest slice plus the overlap.
+    :type purger: km3net.cpu.PurgingSparse
+
+    :param hits: The sample of hits as x,y,z,ct. Slice lengths that do not fit in the
+        sample together with the overlap are skipped.
+    :type hits: tuple(numpy ndarray)
+
+    :param latency: The largest acceptable time per slice in seconds.
+    :type latency: float
+
+    :returns: The selected slice_length and overlap, and the measurements of every candidate
+    :rtype: dict, list(dict)
+    """
+    overlap = int(correlator.sliding_window_width)
+    results = []
+    for slice_length in slice_lengths or SLICE_LENGTHS:
+        n = slice_length + overlap
+        if n > len(hits[0]):
+            if verbose:
+                print("slice_length=%d overlap=%d: skipped, the sample holds only %d hits" % (slice_length, overlap, len(hits[0])))
+            continue
+        sample = [h[:n] for h in hits]
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            col_idx, prefix_sums, degrees, _ = correlator.compute(*sample)
+            purger.compute(col_idx, prefix_sums, degrees)
+            times.append(time.perf_counter() - start)
+        latency_slice = float(np.median(times))
+        results.append({"slice_length": slice_length, "overlap": overlap, "time": latency_slice,
+                        "hits_per_s": slice_length / latency_slice})
+        if verbose:
+            print("slice_length=%d overlap=%d: %.6f s, %.4g hits/s" % (slice_length, overlap, latency_slice, results[-1]["hits_per_s"]))
+    if not results:
+        raise ValueError("no slice length fits in the sample of %d hits with an overlap of %d" % (len(hits[0]), overlap))
+
+    meeting = [r for r in results if latency is None or r["time"] <= latency]
+    if meeting:
+        best = max(meeting, key=lambda r: r["hits_per_s"])
+    else:
+        best = min(results, key=lambda r: r["time"])
+    return OrderedDict([("slice_length", best["slice_length"]), ("overlap", best["overlap"])]), results
+
+
+def tune(hits, window=1500, latency=None, engines=None, space=None, slice_lengths=None, repeat=3, verbose=False):
+    """ tune all engines and the pipeline and return a profile
+
+    :param hits: The sample of hits as x,y,z,ct.
+    :type hits: tuple(numpy ndarray)
+
+    :param latency: The largest acceptable time per slice in seconds, see tune_pipeline. The
+        engines are held to it on the whole sample, which is at least as long as a slice,
+        see tune_engine.
+    :type latency: float
+
+    :param engines: The correlator classes to tune, by default the NumPy engines in km3net.cpu.
+    :type engines: list(type)
+
+    :returns: A profile that can be stored with save_profile
+    :rtype: dict
+    """
+    from km3net import cpu
+
+    engines = engines or [cpu.QuadraticDifferenceSparse, cpu.Match3BSparse]
+    profile = OrderedDict([("host", socket.gethostname()), ("date", time.strftime("%Y-%m-%d %H:%M:%S")),
+                           ("window", window), ("latency", latency), ("engines", OrderedDict())])
+    for engine in engines:
+        profile["engines"][engine.__name__], _ = tune_engine(engine, hits, window, space, repeat=repeat,
+                                                             latency=latency, verbose=verbose)
+
+    N = len(hits[0])
+    settings = profile["engines"][engines[0].__name__]
+    correlator = engines[0](N, window, chunk_size=settings["chunk_size"] or 0,
+                            block_size=settings["block_size"], workers=settings["workers"])
+    lengths = [s for s in (slice_lengths or SLICE_LENGTHS) if s + window <= N] or [max(N - window, 1)]
+    profile["pipeline"], _ = tune_pipeline(correlator, cpu.PurgingSparse(N), hits, lengths, latency,
+                                           repeat=repeat, verbose=verbose)
+    return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Autotuner for the km3net NumPy engines")
+    parser.add_argument("--input", help="file with real hits, by default synthetic hits are used")
+    parser.add_argument("--hits", type=int, default=20000, help="number of hits in the sample")
+    parser.add_argument("--window", type=int, default=1500)
+    parser.add_argument("--latency", type=float, help="largest acceptable time per slice in seconds")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="profile file, by default the profile of this host")
+    parser.add_argument("--show", action="store_true", help="only print the current profile")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        print(json.dumps(load_profile(args.output), indent=2))
+        return 0
+
+    hits = sample_hits(args.hits, args.input)
+    profile = tune(hits, args.window, args.latency, repeat=args.repeat, verbose=True)
+    path = args.output or profile_path()
+    save_profile(profile, path)
+    print("profile written to", path)
+    print(json.dumps(profile, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
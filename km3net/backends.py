@@ -0,0 +1,58 @@
+from __future__ import print_function
+
+import importlib
+
+_backends = {
+    "cpu": "km3net.cpu",
+    "cuda": "km3net.kernels",
+}
+
+
+def register_backend(name, module_name):
+    """ register a module that implements the correlator and purger classes
+
+    A backend module provides QuadraticDifferenceSparse, Match3BSparse and
+    PurgingSparse classes with the same compute methods as those in km3net.cpu.
+    The constructors take the number of hits N first, and accept sliding_window_width
+    and threshold as keyword arguments, the GPU engines additionally take cc.
+    The module is not imported until the backend is first used.
+
+    :param name: The name of the backend.
+    :type name: string
+
+    :param module_name: The full name of the module that implements the backend.
+    :type module_name: string
+    """
+    _backends[name] = module_name
+
+
+def get_backend(name):
+    """ import a backend on first use and return its module
+
+    :param name: The name of the backend, for example "cpu" or "cuda".
+    :type name: string
+
+    :returns: The module that implements the backend
+    :rtype: module
+    """
+    if name not in _backends:
+        raise ValueError("Unknown backend " + str(name) + ", available backends are " + ", ".join(sorted(_backends)))
+    return importlib.import_module(_backends[name])
+
+
+def available_backends():
+    """ return the names of the backends that can be imported on this machine
+
+    Note that this imports all registered backends.
+
+    :returns: The names of the backends that can be used
+    :rtype: list(string)
+    """
+    available = []
+    for name in sorted(_backends):
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+""" microbenchmarks of the CPU-side hot paths with stored baselines
+
+Usage::
+
+    python -m km3net.benchmark run --save baseline.json
+    python -m km3net.benchmark run --save current.json
+    python -m km3net.benchmark compare baseline.json current.json --tolerance 0.1
+
+The compare command exits with status 1 when any benchmark got slower than the
+baseline by more than the tolerance, or when a benchmark in the baseline is missing.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from km3net import util, cpu
+
+#problem sizes and densities, a larger factor spreads the hits further apart in time
+SIZES = (1000, 10000)
+FACTORS = (2000.0, 500.0)
+WINDOW = 1500
+
+
+def _ingest(N, factor):
+    x,y,z,ct = util.generate_input_data(N, factor)
+    fd, filename = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    t = ct / 0.299792458
+    np.savetxt(filename, np.column_stack([t, x, y, z]), fmt="%.3f")
+    def run():
+        util.get_real_input_data(filename)
+    def cleanup():
+        os.remove(filename)
+    return run, cleanup
+
+def _generate(N, factor):
+    return lambda: util.generate_input_data(N, factor), None
+
+def _correlate(correlator_class):
+    def setup(N, factor):
+        hits = util.generate_input_data(N, factor)
+        correlator = correlator_class(N, WINDOW)
+        return lambda: correlator.compute(*hits), None
+    return setup
+
+def _csr(N, factor):
+    hits = util.generate_input_data(N, factor)
+    correlator = cpu.QuadraticDifferenceSparse(N, WINDOW)
+    pairs = correlator.correlated_pairs(*hits)
+    return lambda: cpu.pairs_to_csr(pairs, N), None
+
+def _purge(N, factor):
+    hits = util.generate_input_data(N, factor)
+    graph = cpu.QuadraticDifferenceSparse(N, WINDOW).compute(*hits)[:3]
+    purger = cpu.PurgingSparse(N)
+    return lambda: purger.compute(*graph), None
+
+BENCHMARKS = OrderedDict([
+    ("ingest", _ingest),
+    ("generate", _generate),
+    ("correlate_qd", _correlate(cpu.QuadraticDifferenceSparse)),
+    ("correlate_3b", _correlate(cpu.Match3BSparse)),
+    ("pairs_to_csr", _csr),
+    ("purge", _purge),
+])
+
+
+def time_function(func, repeat=5, min_time=0.05):
+    """ time a function
+
+    The function is called repeatedly in batches of one or more calls, so
+    that each batch takes at least min_time seconds.
+
+    :returns: The median and minimum time of a single call in seconds
+    :rtype: float, float
+    """
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1<<20:
+            break
+        number *= 2
+    times = [elapsed/number]
+    for _ in range(repeat-1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start)/number)
+    return float(np.median(times)), float(np.min(times))
+
+
+def run(names=None, sizes=SIZES, factors=FACTORS, repeat=5, min_time=0.05, verbose=False):
+    """ run the benchmarks
+
+    :param names: The names of the benchmarks to run, by default all of BENCHMARKS.
+    :type names: list(string)
+
+    :param sizes: The numbers of hits to benchmark.
+    :type sizes: list(int)
+
+    :param factors: The factors passed to generate_input_data to vary the density of correlated hits.
+    :type factors: list(float)
+
+    :returns: A dictionary with metadata about the machine and the results per benchmark,
+        identified as name/N/factor, this is what is stored in the JSON files.
+    :rtype: dict
+    """
+    results = OrderedDict()
+    for name in names or BENCHMARKS:
+        for N in sizes:
+            for factor in factors:
+                np.random.seed(0)
+                func, cleanup = BENCHMARKS[name](N, factor)
+                try:
+                    median, minimum = time_function(func, repeat, min_time)
+                finally:
+                    if cleanup:
+                        cleanup()
+                key = "%s/N=%d/factor=%g" % (name, N, factor)
+                results[key] = {"median": median, "min": minimum}
+                if verbose:
+                    print("%-40s %12.6f s" % (key, median))
+    meta = {"host": socket.gethostname(), "python": platform.python_version(),
+            "numpy": np.__version__, "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    return {"meta": meta, "results": results}
+
+
+def compare(baseline, current, tolerance=0.1):
+    """ compare benchmark results against a baseline
+
+    :param baseline: Results as returned by run().
+    :type baseline: dict
+
+    :param current: Results as returned by run().
+    :type current: dict
+
+    :param tolerance: The relative slowdown of the median time that is still accepted.
+    :type tolerance: float
+
+    Benchmarks that are only in the current results are new and reported without a
+    baseline. Benchmarks that are only in the baseline, for example because they were
+    renamed, are reported without a current time and count as a regression, so the
+    baseline is brought up to date.
+
+    :returns: Every benchmark in either result, with the baseline time, current time
+        and ratio, or None for what is missing, and whether it is a regression
+    :rtype: list(tuple(string, float, float, float, bool))
+    """
+    report = []
+    for key, result in current["results"].items():
+        after = result["median"]
+        if key not in baseline["results"]:
+            report.append((key, None, after, None, False))
+            continue
+        before = baseline["results"][key]["median"]
+        ratio = after / before if before > 0 else float("inf")
+        report.append((key, before, after, ratio, ratio > 1.0 + tolerance))
+    for key, result in baseline["results"].items():
+        if key not in current["results"]:
+            report.append((key, result["median"], None, None, True))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the km3net hot paths")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--save", help="store the results in this JSON file")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="only run these benchmarks")
+    run_parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    run_parser.add_argument("--factors", nargs="+", type=float, default=FACTORS)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.only, args.sizes, args.factors, args.repeat, verbose=True)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        report = compare(baseline, current, args.tolerance)
+        for key, before, after, ratio, regression in report:
+            if before is None:
+                print("%-40s %12s %12.6f %8s NEW" % (key, "-", after, "-"))
+            elif after is None:
+                print("%-40s %12.6f %12s %8s MISSING" % (key, before, "-", "-"))
+            else:
+                print("%-40s %12.6f %12.6f %7.2fx %s" % (key, before, after, ratio, "REGRESSION" if regression else ""))
+        return 1 if any(r[4] for r in report) else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+from __future__ import print_function
+
+import os
+import hashlib
+import tempfile
+import subprocess
+
+
+class NvccCompiler(object):
+    """ compiler that builds CUDA kernels with nvcc through PyCuda
+
+    A compiler has two methods: compile() turns source code into a binary and
+    load() turns a binary into callable functions. Any object with these methods
+    can be used by KernelBuildCache, for example a stub compiler for testing.
+    An optional version() method identifies the installed compiler.
+    """
+
+    name = "nvcc"
+
+    def version(self):
+        """ return the output of nvcc --version, or an empty string when nvcc cannot be run
+
+        :rtype: string
+        """
+        try:
+            return subprocess.run(["nvcc", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  check=False).stdout.decode(errors="replace")
+        except OSError:
+            return ""
+
+    def compile(self, source, options, arch, code, no_extern_c):
+        """ compile source code into a cubin
+
+        :returns: The compiled binary
+        :rtype: bytes
+        """
+        from pycuda.compiler import compile
+        return compile(source, options=options, arch=arch, code=code, no_extern_c=no_extern_c, cache_dir=False)
+
+    def load(self, binary, function_names):
+        """ load a binary and return the requested functions
+
+        :returns: The functions by name
+        :rtype: dict
+        """
+        import pycuda.driver as drv
+        module = drv.module_from_buffer(binary)
+        return {name: module.get_function(name) for name in function_names}
+
+
+def _default_directory():
+    return os.environ.get("KM3NET_KERNEL_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "km3net", "kernels"))
+
+
+class KernelBuildCache(object):
+    """ cache of compiled kernels in memory and on disk
+
+    Kernels are identified by a hash of the source code with the defines prepended,
+    the compiler options, the target architecture, and the name and version of the
+    compiler, so binaries built by another CUDA toolkit are not reused. Each
+    unique build is compiled only once, all requested functions are taken from the
+    same module, and the binary is stored on disk so other processes can skip
+    compilation altogether.
+    """
+
+    def __init__(self, directory=None, compiler=None):
+        """instantiate KernelBuildCache
+
+        :param directory: The directory in which binaries are stored, by default the directory
+            in the KM3NET_KERNEL_CACHE environment variable or ~/.cache/km3net/kernels.
+            Pass False to disable the on-disk cache.
+        :type directory: string or bool
+
+        :param compiler: The compiler to use, by default NvccCompiler.
+        :type compiler: NvccCompiler or an object with the same methods
+        """
+        self.directory = _default_directory() if directory is None else directory
+        self.compiler = compiler or NvccCompiler()
+        self.binaries = {}
+        self.compiles = 0
+        self._version = None
+
+    @property
+    def compiler_version(self):
+        """ the version of the compiler, determined once per cache """
+        if self._version is None:
+            version = getattr(self.compiler, "version", None)
+            self._version = version() if version is not None else ""
+        return self._version
+
+    @staticmethod
+    def preprocess(source, defines=None):
+        """ prepend #define statements to the source code
+
+        :param defines: The names and values to define.
+        :type defines: dict
+
+        :rtype: string
+        """
+        prefix = "".join("#define " + str(k) + " " + str(v) + "\n" for k, v in sorted((defines or {}).items()))
+        return prefix + source
+
+    def key(self, source, options, arch, code, no_extern_c):
+        """ compute the key of a build from the preprocessed source and the build settings """
+        h = hashlib.sha256()
+        for part in (self.compiler.name, self.compiler_version, source, " ".join(options), arch, code, str(no_extern_c)):
+            h.update(str(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def build(self, source, defines=None, options=None, cc="52", no_extern_c=False):
+        """ return the binary for a kernel, compiling it only if it is not cached
+
+        :param source: The kernel source code.
+        :type source: string
+
+        :param defines: Names and values to #define before the source code.
+        :type defines: dict
+
+        :param options: Options passed to the compiler.
+        :type options: list(string)
+
+        :param cc: The CUDA compute capability of the target device as a string, consisting
+                of the major and minor number concatenated without any separators.
+        :type cc: string
+
+        :param no_extern_c: Whether the source code already declares extern "C" itself.
+        :type no_extern_c: bool
+
+        :returns: The compiled binary
+        :rtype: bytes
+        """
+        source = self.preprocess(source, defines)
+        options = list(options or [])
+        arch = "compute_" + cc
+        code = "sm_" + cc
+        key = self.key(source, options, arch, code, no_extern_c)
+
+        if key in self.binaries:
+            return self.binaries[key]
+
+        binary = None
+        if self.directory:
+            try:
+                with open(self._path(key), "rb") as f:
+                    binary = f.read()
+            except (IOError, OSError):
+                pass
+
+        if binary is None:
+            binary = self.compiler.compile(source, options, arch, code, no_extern_c)
+            self.compiles += 1
+            if self.directory:
+                self._store(key, binary)
+
+        self.binaries[key] = binary
+        return binary
+
+    def _store(self, key, binary):
+        os.makedirs(self.directory, exist_ok=True)
+        #write to a temporary file first, so concurrent workers never read a partial binary
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(binary)
+        os.replace(tmp, self._path(key))
+
+    def get_functions(self, source, function_names, defines=None, options=None, cc="52", no_extern_c=False):
+        """ return functions from a kernel, compiling it only if it is not cached
+
+        See build() for a description of the arguments.
+
+        :param function_names: The names of the functions to take from the module.
+        :type function_names: list(string)
+
+        :returns: The functions in the same order as function_names
+        :rtype: list
+        """
+        binary = self.build(source, defines, options, cc, no_extern_c)
+        functions = self.compiler.load(binary, function_names)
+        return [functions[name] for name in function_names]
+
+
+_default_cache = None
+
+
+def default_build_cache():
+    """ return the build cache shared by all engines in this process
+
+    :rtype: KernelBuildCache
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = KernelBuildCache()
+    return _default_cache
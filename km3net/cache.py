@@ -0,0 +1,175 @@
+from __future__ import print_function
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+_ARRAYS = ("col_idx", "prefix_sums", "degrees")
+
+
+class GraphCache(object):
+    """ content-addressed on-disk cache of correlation graphs
+
+    Each entry is stored in its own directory, named after a hash of the input hits and
+    the parameters of the correlator, and contains the col_idx, prefix_sums and degrees
+    arrays of the sparse matrix as .npy files. Entries are returned as memory-mapped
+    arrays, so reading a cached graph only touches the parts that are actually used.
+
+    When the total size of the cache exceeds max_bytes, the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, directory, max_bytes=1<<30):
+        """instantiate GraphCache
+
+        :param directory: The directory in which the cache entries are stored, created if needed.
+        :type directory: string
+
+        :param max_bytes: The maximum total size of the cache entries in bytes.
+        :type max_bytes: int
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(x, y, z, ct, **params):
+        """ compute the cache key for a set of hits and correlator parameters
+
+        :param x,y,z,ct: The hits
+        :type x,y,z,ct: numpy ndarray
+
+        :param params: The parameters that affect the correlation, for example
+            the criterion and the sliding window width.
+
+        :returns: The hex digest of the hash of the hits and the parameters
+        :rtype: string
+        """
+        h = hashlib.sha256()
+        for column in (x, y, z, ct):
+            column = np.ascontiguousarray(column)
+            h.update(str(column.dtype).encode())
+            h.update(str(column.size).encode())
+            h.update(column.data)
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """ look up a graph in the cache
+
+        :returns: col_idx, prefix_sums, degrees as read-only memory-mapped arrays,
+            and the total number of correlated hits, or None if the key is not in the cache.
+        :rtype: tuple(numpy.memmap, int) or None
+        """
+        path = self._path(key)
+        try:
+            arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode='r') for name in _ARRAYS]
+            os.utime(path)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        col_idx, prefix_sums, degrees = arrays
+        return col_idx, prefix_sums, degrees, col_idx.size
+
+    def put(self, key, col_idx, prefix_sums, degrees):
+        """ store a graph in the cache and evict old entries if needed """
+        path = self._path(key)
+        if os.path.isdir(path):
+            return
+        #write into a temporary directory first, so other readers never see partial entries
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            for name, array in zip(_ARRAYS, (col_idx, prefix_sums, degrees)):
+                np.save(os.path.join(tmp, name + ".npy"), np.asarray(array, dtype=np.int32))
+            os.rename(tmp, path)
+        except OSError:
+            #another process stored the same entry in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """ return the entries in the cache, least recently used first
+
+        :returns: The key, last access time and size in bytes of each entry
+        :rtype: list(tuple(string, float, int))
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, name + ".npy")) for name in _ARRAYS)
+                entries.append((key, os.path.getmtime(path), size))
+            except OSError:
+                continue
+        return sorted(entries, key=lambda e: e[1])
+
+    def size(self):
+        """ the total size of all entries in bytes """
+        return sum(e[2] for e in self.entries())
+
+    def evict(self):
+        """ remove least recently used entries until the cache is smaller than max_bytes """
+        entries = self.entries()
+        total = sum(e[2] for e in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+
+class CachedCorrelator(object):
+    """ correlator that looks up the correlation graph in a GraphCache before computing it
+
+    Wraps any correlator from km3net.kernels or km3net.cpu. On a cache hit the graph is
+    returned as memory-mapped numpy arrays and the correlator is not called at all. Note
+    that graphs computed by the GPU correlators are copied back to the host to be stored.
+    """
+
+    def __init__(self, correlator, cache):
+        """instantiate CachedCorrelator
+
+        :param correlator: The correlator used on a cache miss.
+        :type correlator: km3net.kernels.CorrelateSparse or km3net.cpu.CorrelateSparse
+
+        :param cache: The cache to use.
+        :type cache: GraphCache
+        """
+        self.correlator = correlator
+        self.cache = cache
+        criterion = getattr(correlator, "criterion", None)
+        self.params = dict(correlator=type(correlator).__name__,
+                           criterion=getattr(criterion, "__name__", None),
+                           sliding_window_width=int(correlator.sliding_window_width))
+
+    def compute(self, x, y, z, ct):
+        """ return the cached sparse matrix, or compute and store it
+
+        :returns: col_idx, prefix_sums, degrees, total_correlated_hits, see the compute
+            method of the wrapped correlator.
+        :rtype: tuple( numpy ndarray, int )
+        """
+        key = self.cache.key(x, y, z, ct, **self.params)
+        graph = self.cache.get(key)
+        if graph is not None:
+            return graph
+
+        col_idx, prefix_sums, degrees, total_correlated_hits = self.correlator.compute(x, y, z, ct)
+        if not isinstance(col_idx, np.ndarray):
+            from km3net.util import memcpy_dtoh
+            col_idx = memcpy_dtoh(col_idx, total_correlated_hits, np.int32)
+            prefix_sums = memcpy_dtoh(prefix_sums, len(x), np.int32)
+            degrees = memcpy_dtoh(degrees, len(x), np.int32)
+        self.cache.put(key, col_idx, prefix_sums, degrees)
+        return col_idx, prefix_sums, degrees, total_correlated_hits
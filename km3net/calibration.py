@@ -0,0 +1,173 @@
+from __future__ import print_function
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from km3net import instrument
+from km3net.ringbuffer import HitBatch
+from km3net.timebase import encode_times
+
+_COLUMNS = ("channel", "x", "y", "z", "t0")
+
+#tables that have been opened, keyed by directory and modification time
+_tables = {}
+
+CalibratedHits = namedtuple("CalibratedHits", ["hits", "base", "channel"])
+CalibratedHits.__doc__ = """ hits after applying the calibration
+
+* hits: HitBatch with the positions of the channels and ct relative to base
+* base: the base time in nanoseconds that ct is relative to, see km3net.timebase
+* channel: the channel of every hit, in the same order as the hits
+"""
+
+
+class CalibrationTable(object):
+    """ per-channel positions and time offsets stored as memory-mapped arrays
+
+    The table is a directory with one .npy file per column: the sorted channel ids,
+    the x, y, z position of every channel in meters as float32, and the time offset t0
+    of every channel in nanoseconds as float64. The columns are memory-mapped, so
+    opening a table is cheap and only the pages of the channels that occur are read.
+    When the channel ids are 0 to the number of channels - 1, they are used directly
+    as row numbers, otherwise the rows are found by binary search.
+    """
+
+    def __init__(self, directory):
+        """instantiate CalibrationTable
+
+        Use load_calibration to obtain cached tables.
+
+        :param directory: The directory with the columns of the table, see save.
+        :type directory: string
+        """
+        self.directory = directory
+        for name in _COLUMNS:
+            setattr(self, name, np.load(os.path.join(directory, name + ".npy"), mmap_mode="r"))
+        self.dense = self.channel.size == 0 or (self.channel[0] == 0 and self.channel[-1] == self.channel.size-1)
+
+    @property
+    def num_channels(self):
+        """ the number of channels in the table """
+        return self.channel.size
+
+    @staticmethod
+    def save(directory, channel, x, y, z, t0):
+        """ store a calibration table
+
+        :param directory: The directory to store the columns in, created if needed.
+        :type directory: string
+
+        :param channel: The unique id of every channel.
+        :type channel: numpy ndarray of an integer type
+
+        :param x,y,z: The position of every channel in meters.
+        :type x,y,z: numpy ndarray
+
+        :param t0: The time offset of every channel in nanoseconds, added to the raw times.
+        :type t0: numpy ndarray
+
+        :returns: The stored table
+        :rtype: CalibrationTable
+        """
+        channel = np.asarray(channel, dtype=np.int64)
+        order = np.argsort(channel, kind="stable")
+        if np.any(np.diff(channel[order]) == 0):
+            raise ValueError("Channel ids in a calibration table have to be unique")
+        os.makedirs(directory, exist_ok=True)
+        columns = {"channel": channel, "x": np.asarray(x, dtype=np.float32), "y": np.asarray(y, dtype=np.float32),
+                   "z": np.asarray(z, dtype=np.float32), "t0": np.asarray(t0, dtype=np.float64)}
+        for name in _COLUMNS:
+            np.save(os.path.join(directory, name + ".npy"), columns[name][order])
+        _tables.pop(os.path.realpath(directory), None)
+        return load_calibration(directory)
+
+    @staticmethod
+    def from_text(filename, directory):
+        """ convert a calibration text file into a table
+
+        The text file stores one channel per row: the channel id, the x, y, z position in
+        meters and t0 in nanoseconds, separated by whitespace. The file is only parsed
+        once, ingest reads the memory-mapped table.
+
+        :param filename: The text file.
+        :type filename: string
+
+        :param directory: The directory to store the table in.
+        :type directory: string
+
+        :rtype: CalibrationTable
+        """
+        data = np.loadtxt(filename, ndmin=2)
+        return CalibrationTable.save(directory, data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3], data[:, 4])
+
+    def rows(self, channel):
+        """ return the row in the table of every channel id
+
+        :rtype: numpy ndarray of type numpy.int64
+        """
+        channel = np.asarray(channel, dtype=np.int64)
+        if self.dense:
+            rows = channel
+            unknown = (rows < 0) | (rows >= self.num_channels)
+        else:
+            rows = np.minimum(np.searchsorted(self.channel, channel), max(self.num_channels-1, 0))
+            unknown = self.channel[rows] != channel if self.num_channels else np.ones(channel.size, dtype=bool)
+        if np.any(unknown):
+            raise ValueError("Channel " + str(channel[np.argmax(unknown)]) + " is not in the calibration table")
+        return rows
+
+    def apply(self, channel, t, base=None, sort=True):
+        """ calibrate raw hits into x,y,z,ct columns
+
+        The positions and time offsets of the channels are gathered from the table, and
+        the calibrated times are encoded relative to a base time, see km3net.timebase,
+        directly into float32 columns.
+
+        :param channel: The channel id of every hit.
+        :type channel: numpy ndarray of an integer type
+
+        :param t: The raw time of every hit in nanoseconds.
+        :type t: numpy ndarray of an integer type or numpy.float64
+
+        :param base: The base time in nanoseconds, by default the smallest raw time rounded down.
+        :type base: int
+
+        :param sort: Sort the hits on their calibrated time, the offsets can change the order.
+        :type sort: bool
+
+        :rtype: CalibratedHits
+        """
+        start_time = instrument.start()
+        channel = np.asarray(channel)
+        t = np.asarray(t)
+        rows = self.rows(channel)
+        if base is None:
+            base = int(np.floor(t.min())) if t.size else 0
+        #the offsets are added in float64 relative to the base, which keeps the times exact
+        base, ct = encode_times(t, base, offset=self.t0[rows])
+        x, y, z = self.x[rows], self.y[rows], self.z[rows]
+        if sort:
+            order = np.argsort(ct, kind="stable")
+            x, y, z, ct, channel = x[order], y[order], z[order], ct[order], channel[order]
+        if start_time is not None:
+            instrument.record_arrays(x=x, y=y, z=z, ct=ct)
+            instrument.report("calibrate", start_time, hits=ct.size, channels=self.num_channels)
+        return CalibratedHits(HitBatch(x, y, z, ct), base, channel)
+
+
+def load_calibration(directory):
+    """ open a calibration table, tables are cached until their files change
+
+    :param directory: The directory with the columns of the table.
+    :type directory: string
+
+    :rtype: CalibrationTable
+    """
+    path = os.path.realpath(directory)
+    mtime = max(os.path.getmtime(os.path.join(path, name + ".npy")) for name in _COLUMNS)
+    cached = _tables.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _tables[path] = (mtime, CalibrationTable(path))
+    return cached[1]
@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+from collections import namedtuple
+
+import numpy as np
+
+from km3net import instrument
+from km3net.ringbuffer import HitBatch
+
+CoalescedHits = namedtuple("CoalescedHits", ["hits", "channel", "multiplicity", "weight"])
+CoalescedHits.__doc__ = """ hits after merging runs of hits on the same channel
+
+* hits: HitBatch with one hit per run, at the position of the channel and the ct of the first hit
+* channel: the channel of every merged hit
+* multiplicity: the number of original hits merged into each hit
+* weight: the sum of the weights of the merged hits, the multiplicity when no weights were given
+"""
+
+
+def coalesce_hits(x, y, z, ct, channel, gap=6.0, weight=None):
+    """ merge hits on the same channel that follow each other within a time gap
+
+    Afterpulses and multi-photon signals produce runs of hits on the same channel a
+    few ns apart. Each run, in which every hit is at most gap after the previous hit
+    on the same channel, is replaced by a single hit at the time of its first hit.
+    The hits must be sorted on ct, the result is sorted on ct as well. Apart from a
+    stable sort on channel, all steps are single vectorized passes over the hits.
+
+    :param channel: The channel, for example the PMT, of every hit.
+    :type channel: numpy ndarray of an integer type
+
+    :param gap: The largest time between consecutive hits in a run, in the unit of ct.
+    :type gap: float
+
+    :param weight: Optional weight of every hit, such as the time over threshold.
+    :type weight: numpy ndarray
+
+    :returns: The merged hits
+    :rtype: CoalescedHits
+    """
+    start_time = instrument.start()
+    channel = np.asarray(channel)
+    n = ct.size
+
+    #within each channel the hits stay in time order
+    order = np.argsort(channel, kind="stable")
+    sorted_channel = channel[order]
+    sorted_ct = ct[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = (sorted_channel[1:] != sorted_channel[:-1]) | (sorted_ct[1:] - sorted_ct[:-1] > gap)
+    group = np.cumsum(first) - 1
+
+    #map the runs back to the original time order, a run is represented by its first hit
+    group_of_hit = np.empty(n, dtype=np.int64)
+    group_of_hit[order] = group
+    keep = np.zeros(n, dtype=bool)
+    keep[order[first]] = True
+
+    num_groups = int(first.sum())
+    multiplicity = np.bincount(group, minlength=num_groups).astype(np.int32)
+    if weight is None:
+        total_weight = multiplicity.astype(np.float32)
+    else:
+        total_weight = np.bincount(group, weights=np.asarray(weight)[order], minlength=num_groups).astype(np.float32)
+
+    kept_groups = group_of_hit[keep]
+    hits = HitBatch(x[keep], y[keep], z[keep], ct[keep])
+    result = CoalescedHits(hits, channel[keep], multiplicity[kept_groups], total_weight[kept_groups])
+    if start_time is not None:
+        instrument.report("coalesce", start_time, hits=n, merged_hits=num_groups)
+    return result
@@ -0,0 +1,657 @@
+from __future__ import print_function
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from km3net.arena import BufferArena
+from km3net import instrument
+
+#constants needed by Match 3B criterion, these are the same as those in correlate_full.cu
+roadwidth = 90.0
+speed_of_light = 0.299792458                # m/ns
+inverse_c = 1.0/speed_of_light
+index_of_refrac = 1.3800851282              # average index of refraction of water
+D02 = roadwidth * roadwidth
+D12 = (roadwidth * 2.0)**2
+R2 = roadwidth * roadwidth
+Rs2 = 3847.2165714
+Rst = 58.9942930573
+D22 = 42228.1334918
+Rt = 85.6010699976
+
+
+def quadratic_difference(x1, y1, z1, ct1, x2, y2, z2, ct2):
+    """ vectorized quadratic difference criterion
+
+    Evaluates the quadratic difference criterion element-wise for two sets of hits.
+
+    :returns: An array that is True where the two hits are correlated
+    :rtype: numpy ndarray of type bool
+    """
+    diffct = ct1 - ct2
+    diffx = x1 - x2
+    diffy = y1 - y2
+    diffz = z1 - z2
+    return diffct * diffct < diffx * diffx + diffy * diffy + diffz * diffz
+
+
+def match3b(x1, y1, z1, t1, x2, y2, z2, t2):
+    """ vectorized Match 3B criterion
+
+    Evaluates the Match 3B criterion element-wise for two sets of hits,
+    using the same constants as the match3b function in correlate_full.cu.
+
+    :returns: An array that is True where the two hits are correlated
+    :rtype: numpy ndarray of type bool
+    """
+    difft = np.fabs(t1 - t2)
+    d2 = (x1-x2)*(x1-x2) + (y1-y2)*(y1-y2) + (z1-z2)*(z1-z2)
+
+    dmax = np.where(d2 < D02, np.sqrt(d2) * index_of_refrac,
+                    np.sqrt(np.maximum(d2 - Rs2, 0.0)) + Rst)
+    dmin = np.where(d2 > D22, np.sqrt(np.maximum(d2 - R2, 0.0)) - Rt,
+                    np.sqrt(np.maximum(d2 - D12, 0.0)))
+
+    return (difft <= dmax * inverse_c) & ((d2 <= D12) | (difft >= dmin * inverse_c))
+
+
+class CorrelateSparse(object):
+    """ Base class for NumPy engines that correlate hits and output a sparse matrix
+
+    This is the CPU counterpart of km3net.kernels.CorrelateSparse, it produces
+    the same sparse matrix in CSR notation but keeps all arrays in host memory.
+    """
+
+    def __init__(self, N, sliding_window_width, criterion, reuse_buffers=False, chunk_size=None,
+                 block_size=None, workers=None, memory_budget=None, use_profile=False):
+        """ Generic constructor, to be overridden by subclasses
+
+        Subclasses should call this constructor with the right criterion.
+
+        The tuning parameters chunk_size, block_size and workers default to the values
+        in the tuning profile, when it is enabled, see km3net.autotune, and otherwise to
+        processing all hits in one chunk, one distance at a time, in a single thread.
+
+        :param chunk_size: The number of hits processed together for all distances in the
+                window, smaller chunks keep the hits in cache. 0 means all hits.
+        :type chunk_size: int
+
+        :param block_size: The number of distances evaluated together in one vectorized step.
+        :type block_size: int
+
+        :param workers: The number of threads that process chunks concurrently.
+        :type workers: int
+
+        :param memory_budget: Optional limit in bytes on the memory used by compute. When the
+                estimate of a slice exceeds the budget, the slice is correlated in parts, see split().
+        :type memory_budget: int
+
+        :param use_profile: Load the tuning profile of this host, also done when the
+                KM3NET_TUNING_PROFILE environment variable names a profile.
+        :type use_profile: bool
+        """
+        self.N = np.int32(N)
+        self.sliding_window_width = np.int32(sliding_window_width)
+        self.criterion = criterion
+        self.arena = BufferArena(reuse=reuse_buffers)
+
+        from km3net.autotune import engine_settings
+        settings = engine_settings(type(self).__name__, use_profile)
+        self.chunk_size = chunk_size if chunk_size is not None else settings.get("chunk_size")
+        self.block_size = block_size if block_size is not None else settings.get("block_size", 1)
+        self.workers = workers if workers is not None else settings.get("workers", 1)
+        self.executor = None
+        self.memory_budget = memory_budget
+
+    def close(self):
+        """ shut down the threads that process chunks concurrently, they are started again when needed """
+        if getattr(self, "executor", None) is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __del__(self):
+        self.close()
+
+    def window(self, n, offsets=None):
+        """ return the largest distance between two hits that can be correlated """
+        max_distance = n-1
+        if offsets is not None:
+            max_distance = int(np.max(np.diff(offsets), initial=1)) - 1
+        return min(int(self.sliding_window_width), max_distance)
+
+    def correlated_pairs(self, x, y, z, ct, offsets=None, start=0, end=None):
+        """ compute all pairs of correlated hits within the sliding window
+
+        :param offsets: Optional segment boundaries, pairs of hits in different segments are skipped.
+        :type offsets: numpy ndarray
+
+        :param start: The first hit i for which pairs (i, i+d) are computed.
+        :type start: int
+
+        :param end: One beyond the last hit i for which pairs (i, i+d) are computed, by default all hits.
+        :type end: int
+
+        :returns: A list with for every distance d in the window, starting at 1, an array
+            with the indices i of the hits that are correlated with hit i+d
+        :rtype: list(numpy ndarray of type numpy.int64)
+        """
+        n = x.size
+        end = n if end is None else end
+        window = self.window(n, offsets)
+        if window < 1:
+            return []
+        segment = segment_ids(offsets) if offsets is not None else None
+
+        block_size = max(1, min(int(self.block_size), window))
+        columns = [x, y, z, ct] + ([segment] if segment is not None else [])
+        if block_size > 1:
+            #pad the columns so that every block of distances can be taken as a view
+            columns = [np.concatenate([c, np.full(block_size, -1, dtype=c.dtype)]) for c in columns]
+
+        chunk_size = int(self.chunk_size or n)
+        last = min(end, n-1)
+        chunks = [(i, min(i+chunk_size, last)) for i in range(start, last, chunk_size)] or [(start, start)]
+        args = [(columns, n, window, block_size, i, j) for i, j in chunks]
+        if self.workers > 1 and len(chunks) > 1:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(self.workers)
+            results = list(self.executor.map(lambda a: self._chunk_pairs(*a), args))
+        else:
+            results = [self._chunk_pairs(*a) for a in args]
+
+        if len(results) == 1:
+            return results[0]
+        return [np.concatenate([r[d] for r in results]) for d in range(window)]
+
+    def _chunk_pairs(self, columns, n, window, block_size, start, end):
+        """ compute the correlated pairs for all distances, for the hits from start to end """
+        x, y, z, ct = columns[:4]
+        segment = columns[4] if len(columns) > 4 else None
+        pairs = []
+        for d0 in range(1, window+1, block_size):
+            b = min(block_size, window+1-d0)
+            stop = min(end, n-d0)
+            if stop <= start:
+                pairs += [np.zeros(0, dtype=np.int64)] * b
+                continue
+            if b == 1:
+                condition = self.criterion(x[start:stop], y[start:stop], z[start:stop], ct[start:stop],
+                                           x[start+d0:stop+d0], y[start+d0:stop+d0], z[start+d0:stop+d0], ct[start+d0:stop+d0])
+                if segment is not None:
+                    condition &= segment[start:stop] == segment[start+d0:stop+d0]
+                pairs.append(np.flatnonzero(condition) + start)
+                continue
+            #row k of a block holds the hits at distance d0+k from the hits start to stop
+            length = stop-start
+            block = [sliding_window_view(c, length)[start+d0:start+d0+b] for c in columns]
+            condition = self.criterion(x[None, start:stop], y[None, start:stop], z[None, start:stop], ct[None, start:stop],
+                                       *block[:4])
+            if segment is not None:
+                condition &= segment[None, start:stop] == block[4]
+            #hits beyond the end of the padded columns do not exist
+            condition &= np.arange(start, stop)[None, :] < (n - d0 - np.arange(b))[:, None]
+            pairs += [np.flatnonzero(row) + start for row in condition]
+        return pairs
+
+    def compute(self, x, y, z, ct):
+        """ perform a computation of the correlating algorithm and produce sparse matrix
+
+        :param x: an array storing the x-coordinates of the hits
+        :type x: numpy ndarray of type numpy.float32
+
+        :param y: an array storing the y-coordinates of the hits
+        :type y: numpy ndarray of type numpy.float32
+
+        :param z: an array storing the z-coordinates of the hits
+        :type z: numpy ndarray of type numpy.float32
+
+        :param ct: an array storing the 'ct' value of the hits.
+            For the quadratic difference criterion this is the time in nano seconds multiplied with the speed of light.
+            For the match 3b criterion this is the time of the hits in nano seconds.
+        :type ct: numpy ndarray of type numpy.float32
+
+        :returns: The sparse matrix in CSR notation, and the number of correlated hits per hit (degree).
+
+            * col_idx: stores the column indices, the size equals the number of correlations (or edges in the graph).
+            * prefix_sums: stores per row, the start index of the row within the column index array. The size of prefix_sums is equal to the number of hits.
+            * degrees: The number of correlated hits per hit, stored as an array of size equal to the number of hits.
+
+        :rtype: tuple( numpy ndarray of type numpy.int32, int )
+        """
+        return self.compute_batch(x, y, z, ct, None)
+
+    def compute_batch(self, x, y, z, ct, offsets):
+        """ correlate many slices packed into one buffer in a single call
+
+        The slices are stored one after the other in x, y, z, ct. Hits are only correlated
+        with hits in the same slice, so the result is a single sparse matrix in which
+        every slice forms its own block on the diagonal. The column indices refer to
+        positions in the packed buffer.
+
+        :param offsets: The segment boundaries of the slices, an array of size number of
+            slices + 1 starting at 0 and ending at the total number of hits, see pack_slices.
+            None means that all hits belong to one slice.
+        :type offsets: numpy ndarray
+
+        :returns: col_idx, prefix_sums, degrees, total_correlated_hits, see compute.
+        :rtype: tuple( numpy ndarray of type numpy.int32, int )
+        """
+        start_time = instrument.start()
+        allocated_bytes = self.arena.allocated_bytes
+        n = x.size
+        window = self.window(n, offsets)
+        parts = self.split(x, y, z, ct, offsets) if self.memory_budget is not None else 1
+        if parts > 1:
+            col_idx, prefix_sums, degrees, total_correlated_hits, pairs_bytes = self._compute_parts(x, y, z, ct, offsets, parts)
+        else:
+            col_idx, prefix_sums, degrees, total_correlated_hits, pairs_bytes = self._compute_whole(x, y, z, ct, offsets)
+
+        if start_time is not None:
+            instrument.record_arrays(pairs=pairs_bytes, degrees=degrees, prefix_sums=prefix_sums, col_idx=col_idx)
+            instrument.report("correlate", start_time, hits=n,
+                              pairs_evaluated=max(window, 0)*n - max(window, 0)*(max(window, 0)+1)//2,
+                              edges=total_correlated_hits, parts=parts,
+                              bytes_allocated=self.arena.allocated_bytes - allocated_bytes)
+
+        return col_idx, prefix_sums, degrees, total_correlated_hits
+
+    def _compute_whole(self, x, y, z, ct, offsets):
+        """ correlate all hits at once, returns the sparse matrix and the size of the pairs in bytes """
+        pairs = self.correlated_pairs(x, y, z, ct, offsets)
+        col_idx, prefix_sums, degrees, total_correlated_hits = pairs_to_csr(pairs, x.size, self.arena)
+        return col_idx, prefix_sums, degrees, total_correlated_hits, sum(i.nbytes for i in pairs)
+
+    def _compute_parts(self, x, y, z, ct, offsets, parts):
+        """ correlate the hits in parts, returns the sparse matrix and the largest size of the pairs of a part
+
+        Each part holds the pairs (i, i+d) for a range of hits i, so every pair is found
+        in exactly one part. The first pass only counts the pairs to compute the degrees,
+        the second pass computes them again to fill the column indices. In every row the
+        entries of the earlier hits and those of the later hits are written at separate
+        cursors, which keeps the columns sorted regardless of the order of the parts.
+        """
+        n = x.size
+        bounds = np.linspace(0, n, parts+1).astype(np.int64)
+
+        earlier = self.arena.zeros("earlier", n, np.int32)
+        later = self.arena.zeros("later", n, np.int32)
+        pairs_bytes = 0
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            pairs = self.correlated_pairs(x, y, z, ct, offsets, start, end)
+            for d, i in enumerate(pairs, 1):
+                later[i] += 1
+                earlier[i+d] += 1
+            pairs_bytes = max(pairs_bytes, sum(i.nbytes for i in pairs))
+            del pairs
+
+        degrees = self.arena.get("degrees", n, np.int32)
+        np.add(earlier, later, out=degrees)
+        prefix_sums = self.arena.get("prefix_sums", n, np.int32)
+        np.cumsum(degrees, out=prefix_sums)
+        total_correlated_hits = int(prefix_sums[-1]) if n > 0 else 0
+
+        col_idx = self.arena.get("col_idx", total_correlated_hits, np.int32)
+        cursor_earlier = self.arena.get("cursor", n, np.int64)
+        np.subtract(prefix_sums, degrees, out=cursor_earlier)
+        cursor_later = self.arena.get("cursor_later", n, np.int64)
+        np.add(cursor_earlier, earlier, out=cursor_later)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            pairs = self.correlated_pairs(x, y, z, ct, offsets, start, end)
+            for d in range(len(pairs), 0, -1):
+                i = pairs[d-1]
+                col_idx[cursor_earlier[i+d]] = i
+                cursor_earlier[i+d] += 1
+            for d, i in enumerate(pairs, 1):
+                col_idx[cursor_later[i]] = i+d
+                cursor_later[i] += 1
+            del pairs
+
+        return col_idx, prefix_sums, degrees, total_correlated_hits, pairs_bytes
+
+    def estimate(self, x, y, z, ct, offsets=None, samples=16):
+        """ predict the number of edges and the memory use of compute from a sample of distances
+
+        The criterion is evaluated for all hits at only a few distances, spaced geometrically
+        over the window because the number of pairs changes fastest at short distances, and
+        the number of pairs at the other distances is interpolated.
+
+        :param samples: The number of distances to evaluate.
+        :type samples: int
+
+        :returns: A dictionary with the estimated number of edges, the bytes of the output
+            arrays, the bytes of the working memory and the estimated peak in bytes
+        :rtype: dict
+        """
+        n = x.size
+        window = self.window(n, offsets)
+        if window < 1:
+            return {"edges": 0, "output_bytes": 12*n, "working_bytes": 0, "peak_bytes": 12*n}
+        segment = segment_ids(offsets) if offsets is not None else None
+
+        distances = np.unique(np.geomspace(1, window, min(samples, window)).round().astype(np.int64))
+        counts = np.zeros(distances.size)
+        for k, d in enumerate(distances):
+            condition = self.criterion(x[:-d], y[:-d], z[:-d], ct[:-d], x[d:], y[d:], z[d:], ct[d:])
+            if segment is not None:
+                condition &= segment[:-d] == segment[d:]
+            counts[k] = np.count_nonzero(condition)
+        #trapezoidal rule over the distances, plus half of the end points to count every distance once
+        pairs = np.sum(0.5*(counts[1:] + counts[:-1]) * np.diff(distances)) + 0.5*(counts[0] + counts[-1])
+        if distances.size == 1:
+            pairs = counts[0]*window
+        edges = int(round(2*pairs))
+
+        #degrees, prefix_sums, col_idx and the cursors, and per distance about eight
+        #float32 temporaries in the criterion for every hit of a chunk in a block of distances
+        output_bytes = 4*n + 4*n + 4*edges
+        temporary_bytes = 8*4*min(n, int(self.chunk_size or n))*max(1, min(int(self.block_size), window))
+        working_bytes = 8*int(round(pairs)) + 16*n + temporary_bytes
+        return {"edges": edges, "output_bytes": output_bytes, "working_bytes": working_bytes,
+                "temporary_bytes": temporary_bytes, "peak_bytes": output_bytes + working_bytes}
+
+    def split(self, x, y, z, ct, offsets=None):
+        """ return the number of parts needed to stay within the memory budget
+
+        The output arrays do not get smaller with more parts, the pairs held in memory
+        and, unless the hits are already processed in chunks, the temporaries of the
+        criterion are divided over the parts. Every part evaluates all distances in the
+        window, so parts with fewer hits than the window would make the run many times
+        slower than correlating all hits at once. A budget that needs such small parts
+        raises a MemoryError.
+
+        :returns: The number of parts, 1 when the estimate is within the budget
+        :rtype: int
+        """
+        estimate = self.estimate(x, y, z, ct, offsets)
+        if estimate["peak_bytes"] <= self.memory_budget:
+            return 1
+        n = x.size
+        divided = 4*estimate["edges"]
+        if not self.chunk_size:
+            divided += estimate["temporary_bytes"]
+        fixed = estimate["peak_bytes"] - divided
+        available = self.memory_budget - fixed
+        if available <= 0:
+            raise MemoryError("correlating %d hits needs at least %d bytes, the memory budget is %d bytes" %
+                              (n, fixed, self.memory_budget))
+        parts = int(np.ceil(divided / float(available)))
+        max_parts = max(n // max(self.window(n, offsets), 1), 1)
+        if parts > max_parts:
+            raise MemoryError("correlating %d hits in a memory budget of %d bytes needs %d parts, at most %d parts "
+                              "with at least as many hits as the window are allowed" % (n, self.memory_budget, parts, max_parts))
+        return parts
+
+
+class QuadraticDifferenceSparse(CorrelateSparse):
+    """ NumPy engine for the Quadratic Difference criterion that outputs a sparse matrix """
+
+    def __init__(self, N, sliding_window_width=1500, reuse_buffers=False, chunk_size=None, block_size=None,
+                 workers=None, memory_budget=None, use_profile=False):
+        """instantiate QuadraticDifferenceSparse
+
+        :param N: The largest number of hits that are to be processed by one iteration
+                of the quadratic difference algorithm.
+        :type N: int
+
+        :param sliding_window_width: The width of the 'window' in which we look for correlated
+                hits. The value we currently assume is 1500.
+        :type sliding_window_width: int
+
+        :param reuse_buffers: Keep the output arrays across calls in self.arena, the arrays
+                returned by compute are then overwritten by the next call.
+        :type reuse_buffers: bool
+
+        See CorrelateSparse for the tuning parameters chunk_size, block_size and workers,
+        and for memory_budget and use_profile.
+        """
+        super().__init__(N, sliding_window_width, quadratic_difference, reuse_buffers, chunk_size, block_size, workers, memory_budget,
+                         use_profile)
+
+
+class Match3BSparse(CorrelateSparse):
+    """ NumPy engine for the Match 3B criterion that outputs a sparse matrix """
+
+    def __init__(self, N, sliding_window_width=1500, reuse_buffers=False, chunk_size=None, block_size=None,
+                 workers=None, memory_budget=None, use_profile=False):
+        """instantiate Match3BSparse
+
+        :param N: The largest number of hits that are to be processed by one iteration
+                of the match 3b algorithm.
+        :type N: int
+
+        :param sliding_window_width: The width of the 'window' in which we look for correlated
+                hits. The value we currently assume is 1500.
+        :type sliding_window_width: int
+
+        :param reuse_buffers: Keep the output arrays across calls in self.arena, the arrays
+                returned by compute are then overwritten by the next call.
+        :type reuse_buffers: bool
+
+        See CorrelateSparse for the tuning parameters chunk_size, block_size and workers,
+        and for memory_budget and use_profile.
+        """
+        super().__init__(N, sliding_window_width, match3b, reuse_buffers, chunk_size, block_size, workers, memory_budget,
+                         use_profile)
+
+
+class PurgingSparse(object):
+    """ NumPy engine for the Purging algorithm on a sparse correlation matrix
+
+    This follows the same steps as the minimum_degree and remove_nodes kernels
+    used by km3net.kernels.PurgingSparse.
+    """
+
+    def __init__(self, N, threshold=3, reuse_buffers=False):
+        """instantiate PurgingSparse
+
+        :param N: The largest number of hits that are to be processed by one iteration
+                of the purging algorithm.
+        :type N: int
+
+        :param threshold: The minimum degree of nodes that count towards the clique,
+                the GPU kernels use the same default of 3.
+        :type threshold: int
+
+        :param reuse_buffers: Keep the working arrays across calls in self.arena.
+        :type reuse_buffers: bool
+        """
+        self.N = N
+        self.threshold = threshold
+        self.arena = BufferArena(reuse=reuse_buffers)
+
+    def minimum_degree(self, degrees, row_idx, segment, num_segments):
+        """ recompute the degrees and return the minimum degree and number of nodes per segment
+
+        :returns: Per segment, the minimum degree of all nodes with a degree of at least threshold,
+            and the number of those nodes.
+        :rtype: tuple(numpy ndarray)
+        """
+        counts = np.bincount(row_idx, minlength=degrees.size)
+        degrees[:] = np.minimum(counts, degrees)
+        remaining = degrees >= self.threshold
+        num_nodes = np.bincount(segment[remaining], minlength=num_segments)
+        minimum = np.zeros(num_segments, dtype=np.int64)
+        minimum[num_nodes > 0] = np.iinfo(np.int32).max
+        np.minimum.at(minimum, segment[remaining], degrees[remaining])
+        return minimum, num_nodes
+
+    def compute(self, col_idx, prefix_sums, degrees, shift=0):
+        """ perform purging on a sparse matrix
+
+        :param col_idx: The column indices of the sparse matrix.
+            The size of col_idx equals the number of correlations.
+        :type col_idx: numpy.ndarray
+
+        :param prefix_sums: The start index of each row within the column index array.
+            The size of prefix_sums is equal to the number of hits.
+        :type prefix_sums: numpy.ndarray
+
+        :param degrees: The number of correlated hits per hit, stored as an array of size equal to the number of hits.
+        :type degrees: numpy.ndarray
+
+        :param shift: Optional parameter that can be used to shift the indices of the nodes
+            that remain after purging.
+        :type shift: int
+
+        :returns: The list of node indices of the nodes that remain after purging.
+        :rtype: list ( int )
+        """
+        found_indices = self.compute_batch(col_idx, prefix_sums, degrees, [0, len(degrees)])[0]
+        if found_indices.size > 0:
+            return found_indices + shift
+        return []
+
+    def compute_batch(self, col_idx, prefix_sums, degrees, offsets):
+        """ perform purging on many slices packed into one sparse matrix
+
+        Purges every slice independently, as if compute was called on each of them,
+        but in a single pass over the packed sparse matrix. Edges should not cross
+        slice boundaries, as produced by CorrelateSparse.compute_batch.
+
+        :param offsets: The segment boundaries of the slices, see pack_slices.
+        :type offsets: numpy ndarray
+
+        :returns: For each slice, the indices of the nodes that remain after purging,
+            relative to the start of that slice.
+        :rtype: list ( numpy ndarray )
+        """
+        start_time = instrument.start()
+        allocated_bytes = self.arena.allocated_bytes
+
+        #work on a copy of degrees, the inputs are left untouched
+        work = self.arena.get("degrees", len(degrees), np.int32)
+        work[:] = degrees
+        degrees = work
+        offsets = np.asarray(offsets)
+        segment = segment_ids(offsets)
+        num_segments = offsets.size-1
+
+        #instead of marking removed edges with -1, only the remaining edges are kept,
+        #compacted in place at the start of the row_idx and col_idx buffers
+        num_edges = len(col_idx)
+        row_idx = self.arena.get("row_idx", num_edges, np.int32)
+        row_idx[:] = np.repeat(np.arange(degrees.size), np.diff(np.asarray(prefix_sums, dtype=np.int64), prepend=0))
+        work = self.arena.get("col_idx", num_edges, np.int32)
+        work[:] = col_idx
+        col_idx = work
+        row_idx, col_idx = _compact(col_idx != -1, row_idx, col_idx)
+
+        if start_time is not None:
+            instrument.record_arrays(degrees=degrees, row_idx=row_idx, col_idx=col_idx, segment=segment)
+        current_minimum, current_num_nodes = self.minimum_degree(degrees, row_idx, segment, num_segments)
+
+        iterations = 0
+        active = current_minimum+1 < current_num_nodes
+        while active.any():
+            iterations += 1
+            #in active slices, remove nodes with degree less than or equal to minimum, and edges to those nodes
+            node_minimum = np.where(active, current_minimum, -1)[segment]
+            row_degrees = degrees[row_idx]
+            edge_minimum = node_minimum[row_idx]
+            remaining = (row_degrees > edge_minimum) & (degrees[col_idx] > edge_minimum)
+            degrees[(degrees > 0) & (degrees <= node_minimum)] = 0
+            row_idx, col_idx = _compact(remaining, row_idx, col_idx)
+
+            minimum, num_nodes = self.minimum_degree(degrees, row_idx, segment, num_segments)
+            current_minimum[active] = minimum[active]
+            current_num_nodes[active] = num_nodes[active]
+            active = current_minimum+1 < current_num_nodes
+
+        found = (degrees >= current_minimum[segment]) & (current_num_nodes[segment] > 0)
+
+        if start_time is not None:
+            instrument.report("purge", start_time, hits=degrees.size, edges=num_edges, iterations=iterations,
+                              surviving_nodes=int(np.count_nonzero(found)),
+                              bytes_allocated=self.arena.allocated_bytes - allocated_bytes)
+
+        return [np.flatnonzero(found[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def pairs_to_csr(pairs, n, arena=None):
+    """ build the sparse matrix in CSR notation from the correlated pairs
+
+    :param pairs: For every distance d, starting at 1, the indices i of the hits that
+        are correlated with hit i+d, as returned by CorrelateSparse.correlated_pairs.
+    :type pairs: list(numpy ndarray)
+
+    :param n: The number of hits.
+    :type n: int
+
+    :param arena: Optional arena from which the arrays are taken.
+    :type arena: km3net.arena.BufferArena
+
+    :returns: col_idx, prefix_sums, degrees, total_correlated_hits, see CorrelateSparse.compute
+    :rtype: tuple( numpy ndarray of type numpy.int32, int )
+    """
+    arena = arena or BufferArena(reuse=False)
+
+    degrees = arena.zeros("degrees", n, np.int32)
+    for d, i in enumerate(pairs, 1):
+        degrees[i] += 1
+        degrees[i+d] += 1
+    prefix_sums = arena.get("prefix_sums", n, np.int32)
+    np.cumsum(degrees, out=prefix_sums)
+    total_correlated_hits = int(prefix_sums[-1]) if n > 0 else 0
+
+    #fill each row in order of increasing column index, first with the earlier
+    #hits starting with the furthest, then with the later hits starting with the closest
+    col_idx = arena.get("col_idx", total_correlated_hits, np.int32)
+    cursor = arena.get("cursor", n, np.int64)
+    np.subtract(prefix_sums, degrees, out=cursor)
+    for d in range(len(pairs), 0, -1):
+        i = pairs[d-1]
+        col_idx[cursor[i+d]] = i
+        cursor[i+d] += 1
+    for d, i in enumerate(pairs, 1):
+        col_idx[cursor[i]] = i+d
+        cursor[i] += 1
+
+    return col_idx, prefix_sums, degrees, total_correlated_hits
+
+
+def _compact(mask, *arrays):
+    """ move the elements selected by mask to the front of each array and return views on them """
+    k = np.count_nonzero(mask)
+    return tuple(np.compress(mask, a, out=a[:k]) for a in arrays)
+
+
+def segment_ids(offsets):
+    """ return the index of the segment that each element belongs to
+
+    :param offsets: The segment boundaries, see pack_slices.
+    :type offsets: numpy ndarray
+
+    :returns: An array of size offsets[-1] with the segment index of each element
+    :rtype: numpy ndarray
+    """
+    return np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+
+
+def pack_slices(slices):
+    """ pack many small slices into one buffer for the compute_batch methods
+
+    :param slices: The slices to pack, each a tuple of x,y,z,ct arrays.
+    :type slices: list(tuple(numpy ndarray))
+
+    :returns: x,y,z,ct of all slices concatenated, and the segment offsets. The
+        offsets array has size number of slices + 1, slice k is stored at
+        offsets[k]:offsets[k+1].
+    :rtype: tuple(numpy ndarray)
+    """
+    lengths = [len(s[0]) for s in slices]
+    offsets = np.zeros(len(slices)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    x,y,z,ct = [np.concatenate([s[k] for s in slices]).astype(np.float32) for k in range(4)]
+    return x,y,z,ct, offsets
+
+
+def compute_batch(correlator, purger, x, y, z, ct, offsets):
+    """ correlate and purge many slices packed into one buffer in a single call
+
+    :returns: For each slice, the indices of the nodes that remain after purging,
+        relative to the start of that slice.
+    :rtype: list ( numpy ndarray )
+    """
+    col_idx, prefix_sums, degrees, _ = correlator.compute_batch(x, y, z, ct, offsets)
+    return purger.compute_batch(col_idx, prefix_sums, degrees, offsets)
@@ -0,0 +1,159 @@
+from __future__ import print_function
+
+import numpy as np
+
+from km3net import instrument
+from km3net.cpu import roadwidth, index_of_refrac, pairs_to_csr
+
+tan_cherenkov = np.sqrt(index_of_refrac**2 - 1.0)
+
+
+def sphere_directions(count, downgoing=False):
+    """ return directions spread evenly over the unit sphere
+
+    :param count: The number of directions.
+    :type count: int
+
+    :param downgoing: Only return directions in the lower hemisphere.
+    :type downgoing: bool
+
+    :returns: An array of shape (count, 3) with unit vectors
+    :rtype: numpy ndarray of type numpy.float32
+    """
+    k = np.arange(count) + 0.5
+    cos_theta = 1.0 - 2.0*k/count
+    if downgoing:
+        cos_theta = -k/count
+    sin_theta = np.sqrt(1.0 - cos_theta**2)
+    phi = np.pi * (3.0 - np.sqrt(5.0)) * k
+    return np.stack([sin_theta*np.cos(phi), sin_theta*np.sin(phi), cos_theta], axis=1).astype(np.float32)
+
+
+def projected_time(directions, diffx, diffy, diffz, diffct, max_distance=2*roadwidth, ct_window=10.0):
+    """ vectorized projected-time criterion for a batch of directions
+
+    For a track along direction u, the time difference of two hits corrected for the
+    travel along the track, diffct - u . diffr, is at most the time the light needs to
+    cover the distance R between the hits perpendicular to the track, R tan(theta_c),
+    plus ct_window. Hits further than max_distance apart perpendicular to the track
+    are not correlated.
+
+    :param directions: Unit vectors of shape (D, 3).
+    :type directions: numpy ndarray
+
+    :param diffx: The differences in position and ct of pairs of hits, second hit minus first hit.
+        All four arrays have the same shape S.
+    :type diffx: numpy ndarray
+
+    :returns: An array of shape (D,) + S that is True where the pair is correlated for the direction
+    :rtype: numpy ndarray of type bool
+    """
+    shape = (-1,) + (1,)*diffx.ndim
+    ux, uy, uz = [directions[:, k].reshape(shape) for k in range(3)]
+    along = ux*diffx + uy*diffy + uz*diffz
+    perpendicular2 = np.maximum(diffx*diffx + diffy*diffy + diffz*diffz - along*along, 0.0)
+    return (perpendicular2 <= max_distance*max_distance) & \
+           (np.fabs(diffct - along) <= tan_cherenkov*np.sqrt(perpendicular2) + ct_window)
+
+
+def projected_time_criterion(direction, max_distance=2*roadwidth, ct_window=10.0):
+    """ return the projected-time criterion for one direction, with the signature used by km3net.cpu.CorrelateSparse """
+    directions = np.asarray(direction, dtype=np.float32).reshape(1, 3)
+    def criterion(x1, y1, z1, ct1, x2, y2, z2, ct2):
+        return projected_time(directions, x2-x1, y2-y1, z2-z1, ct2-ct1, max_distance, ct_window)[0]
+    return criterion
+
+
+class MultiDirectionCorrelator(object):
+    """ NumPy engine that correlates hits for a batch of track directions in one sweep
+
+    The differences in position and time of every pair of hits in the sliding window
+    are computed once per block of hits and then evaluated for all directions at once,
+    instead of making a full pass over the hits for every direction.
+    """
+
+    def __init__(self, N, sliding_window_width, directions, max_distance=2*roadwidth, ct_window=10.0, chunk_size=4096):
+        """instantiate MultiDirectionCorrelator
+
+        :param N: The largest number of hits that are to be processed at once.
+        :type N: int
+
+        :param sliding_window_width: The width of the 'window' in which we look for correlated hits.
+        :type sliding_window_width: int
+
+        :param directions: The track directions as unit vectors of shape (D, 3), see sphere_directions.
+        :type directions: numpy ndarray
+
+        :param max_distance: The largest distance perpendicular to the track, see projected_time.
+        :type max_distance: float
+
+        :param ct_window: The allowed time difference on top of the light travel time, see projected_time.
+        :type ct_window: float
+
+        :param chunk_size: The number of hits per block, the temporaries have size D times chunk_size.
+        :type chunk_size: int
+        """
+        self.N = np.int32(N)
+        self.sliding_window_width = np.int32(sliding_window_width)
+        self.directions = np.asarray(directions, dtype=np.float32).reshape(-1, 3)
+        self.max_distance = max_distance
+        self.ct_window = ct_window
+        self.chunk_size = chunk_size
+
+    def _sweep(self, x, y, z, ct, visit):
+        """ call visit(d, start, stop, condition) for every distance and block of hits """
+        n = x.size
+        window = min(int(self.sliding_window_width), n-1)
+        for start in range(0, max(n-1, 0), self.chunk_size):
+            end = min(start + self.chunk_size, n-1)
+            for d in range(1, window+1):
+                stop = min(end, n-d)
+                if stop <= start:
+                    break
+                condition = projected_time(self.directions, x[start+d:stop+d]-x[start:stop], y[start+d:stop+d]-y[start:stop],
+                                           z[start+d:stop+d]-z[start:stop], ct[start+d:stop+d]-ct[start:stop],
+                                           self.max_distance, self.ct_window)
+                visit(d, start, stop, condition)
+        return window
+
+    def compute_degrees(self, x, y, z, ct):
+        """ compute the number of correlated hits of every hit for every direction
+
+        :returns: The degrees, an array of shape (D, number of hits)
+        :rtype: numpy ndarray of type numpy.int32
+        """
+        start_time = instrument.start()
+        degrees = np.zeros((self.directions.shape[0], x.size), dtype=np.int32)
+        def visit(d, start, stop, condition):
+            degrees[:, start:stop] += condition
+            degrees[:, start+d:stop+d] += condition
+        self._sweep(x, y, z, ct, visit)
+        if start_time is not None:
+            instrument.report("correlate_directions", start_time, hits=x.size, directions=self.directions.shape[0],
+                              edges=int(degrees.sum()))
+        return degrees
+
+    def compute(self, x, y, z, ct):
+        """ compute the sparse matrix of correlated hits for every direction
+
+        :returns: For every direction col_idx, prefix_sums, degrees, total_correlated_hits,
+            see km3net.cpu.CorrelateSparse.compute
+        :rtype: list(tuple)
+        """
+        start_time = instrument.start()
+        num_directions = self.directions.shape[0]
+        window = min(int(self.sliding_window_width), x.size-1)
+        parts = [[[] for _ in range(max(window, 0))] for _ in range(num_directions)]
+        def visit(d, start, stop, condition):
+            for k in range(num_directions):
+                parts[k][d-1].append(np.flatnonzero(condition[k]) + start)
+        self._sweep(x, y, z, ct, visit)
+
+        results = []
+        for k in range(num_directions):
+            pairs = [np.concatenate(p) if p else np.zeros(0, dtype=np.int64) for p in parts[k]]
+            results.append(pairs_to_csr(pairs, x.size))
+        if start_time is not None:
+            instrument.report("correlate_directions", start_time, hits=x.size, directions=num_directions,
+                              edges=sum(r[3] for r in results))
+        return results
@@ -0,0 +1,214 @@
+from __future__ import print_function
+
+from collections import namedtuple
+
+import numpy as np
+
+from km3net.ringbuffer import HitBatch
+from km3net.timebase import rebase
+from km3net.cpu import speed_of_light
+
+Event = namedtuple("Event", ["start", "end", "hits", "complete", "base"], defaults=(0,))
+Event.__doc__ = """ a snapshot of all hits in a time window around one or more triggers
+
+* start, end: the window in ct, the hits satisfy start <= ct <= end
+* hits: HitBatch with copies of the hits
+* complete: False when part of the window had already left the look-back buffer
+* base: the base time in nanoseconds that ct is relative to, see km3net.timebase
+"""
+
+
+class EventBuilder(object):
+    """ build events from the hits around the cliques found by purging
+
+    The builder keeps the most recent hits in a bounded look-back ring buffer. Every
+    trigger opens a window from pre_window before to post_window after the hits of
+    the clique, overlapping windows are merged, and once hits beyond the end of a
+    window have arrived the event is emitted as a snapshot of the hits in the window.
+    Hits are located by binary search on ct, so a trigger costs O(log N + event size).
+
+    Hits must be appended in order of ct. Slices with ct relative to their own base
+    time, see km3net.timebase, are appended with that base. The builder then stores ct
+    relative to a base of its own, which it moves forward to the oldest kept hit once
+    that hit is beyond max_ct, so float32 keeps its precision during long runs.
+    """
+
+    def __init__(self, capacity=1000000, pre_window=300.0, post_window=300.0, max_ct=2.0**20):
+        """instantiate EventBuilder
+
+        :param capacity: The number of most recent hits that are kept.
+        :type capacity: int
+
+        :param pre_window: The length of the window before the first hit of a trigger, in the unit of ct.
+        :type pre_window: float
+
+        :param post_window: The length of the window after the last hit of a trigger, in the unit of ct.
+        :type post_window: float
+
+        :param max_ct: The ct of the oldest kept hit above which the base time is moved forward,
+            for hits appended with a base.
+        :type max_ct: float
+        """
+        self.capacity = int(capacity)
+        self.pre_window = pre_window
+        self.post_window = post_window
+        self.columns = np.zeros((4, self.capacity), dtype=np.float32)
+        self.total = 0
+        self.pending = []
+        self.max_ct = max_ct
+        self.base = None
+
+    @property
+    def oldest(self):
+        """ the logical index of the oldest hit that is still kept """
+        return max(self.total - self.capacity, 0)
+
+    @property
+    def latest_ct(self):
+        """ the ct of the most recent hit, or -inf when no hits were appended """
+        if self.total == 0:
+            return -np.inf
+        return float(self.columns[3, (self.total-1) % self.capacity])
+
+    def _relative(self, ct, base):
+        """ return ct relative to the base of the builder """
+        if base is None:
+            return ct
+        if self.base is None:
+            self.base = np.int64(base)
+        return rebase(base, ct, self.base)
+
+    def _move_base(self):
+        """ move the base forward to the oldest kept hit once that hit is far enough beyond the base
+
+        Every rebase rounds the stored ct to float32 again. The base is only moved once the
+        oldest kept hit is beyond max_ct and beyond the time span of the kept hits, so every
+        hit is rebased at most about twice while it is in the buffer.
+        """
+        if self.base is None or self.total == 0:
+            return
+        oldest_ct = float(self.columns[3, self.oldest % self.capacity])
+        if oldest_ct < max(self.max_ct, self.latest_ct - oldest_ct):
+            return
+        shift = int(np.floor(oldest_ct / speed_of_light))
+        size = self.total - self.oldest
+        first = self.oldest % self.capacity
+        end = min(first + size, self.capacity)
+        for segment in (slice(first, end), slice(0, size - (end - first))):
+            self.columns[3, segment] = rebase(self.base, self.columns[3, segment], self.base + shift)
+        delta = shift * speed_of_light
+        self.pending = [(start - delta, end - delta) for start, end in self.pending]
+        self.base = self.base + np.int64(shift)
+
+    def append(self, x, y, z, ct, base=None):
+        """ append a batch of hits and return the events that are now complete
+
+        :param base: The base time in nanoseconds that ct is relative to, when the slices
+            are encoded with km3net.timebase.encode_times.
+        :type base: int
+
+        :returns: The events whose window ends before the last appended hit
+        :rtype: list(Event)
+        """
+        ct = self._relative(ct, base)
+        n = len(ct)
+        if n > self.capacity:
+            x, y, z, ct = x[-self.capacity:], y[-self.capacity:], z[-self.capacity:], ct[-self.capacity:]
+            self.total += n - self.capacity
+            n = self.capacity
+        pos = self.total % self.capacity
+        first = min(n, self.capacity - pos)
+        for row, column in enumerate((x, y, z, ct)):
+            self.columns[row, pos:pos+first] = column[:first]
+            self.columns[row, :n-first] = column[first:]
+        self.total += n
+        self._move_base()
+        return self.poll()
+
+    def _search(self, value, side):
+        """ return the logical index at which value would be inserted in the stored ct values """
+        size = self.total - self.oldest
+        first_pos = self.oldest % self.capacity
+        ct = self.columns[3]
+        older = ct[first_pos:min(first_pos+size, self.capacity)]
+        k = np.searchsorted(older, value, side)
+        if k < older.size:
+            return self.oldest + int(k)
+        newer = ct[:size - older.size]
+        return self.oldest + older.size + int(np.searchsorted(newer, value, side))
+
+    def query(self, start, end):
+        """ return copies of the kept hits with start <= ct <= end
+
+        :rtype: HitBatch
+        """
+        begin = self._search(start, "left")
+        stop = self._search(end, "right")
+        positions = np.arange(begin, max(begin, stop)) % self.capacity
+        if positions.size and positions[-1] >= positions[0]:
+            columns = self.columns[:, positions[0]:positions[-1]+1].copy()
+        else:
+            columns = self.columns[:, positions]
+        return HitBatch(*columns)
+
+    def trigger(self, ct_min, ct_max):
+        """ open an event window around a trigger, merged with any overlapping pending window
+
+        :param ct_min: The ct of the first hit of the trigger.
+        :type ct_min: float
+
+        :param ct_max: The ct of the last hit of the trigger.
+        :type ct_max: float
+        """
+        start = ct_min - self.pre_window
+        end = ct_max + self.post_window
+        remaining = []
+        for window in self.pending:
+            if window[0] <= end and start <= window[1]:
+                start = min(start, window[0])
+                end = max(end, window[1])
+            else:
+                remaining.append(window)
+        remaining.append((start, end))
+        self.pending = sorted(remaining)
+
+    def trigger_hits(self, ct, indices, base=None):
+        """ open an event window around a clique
+
+        :param ct: The ct values of the slice the clique was found in.
+        :type ct: numpy ndarray
+
+        :param indices: The indices of the hits in the clique, as returned by purging.
+        :type indices: numpy ndarray
+
+        :param base: The base time in nanoseconds that ct is relative to, see append.
+        :type base: int
+        """
+        if len(indices) == 0:
+            return
+        values = self._relative(np.asarray(ct)[np.asarray(indices)], base)
+        self.trigger(float(values.min()), float(values.max()))
+
+    def _emit(self, window):
+        start, end = window
+        complete = self.total == 0 or self.total <= self.capacity or \
+            float(self.columns[3, self.oldest % self.capacity]) <= start
+        return Event(start, end, self.query(start, end), complete, 0 if self.base is None else self.base)
+
+    def poll(self):
+        """ return the pending events whose window ends before the last appended hit
+
+        :rtype: list(Event)
+        """
+        latest = self.latest_ct
+        ready = [window for window in self.pending if window[1] < latest]
+        self.pending = [window for window in self.pending if window[1] >= latest]
+        return [self._emit(window) for window in ready]
+
+    def flush(self):
+        """ return all pending events, also those whose window is not complete yet
+
+        :rtype: list(Event)
+        """
+        ready, self.pending = self.pending, []
+        return [self._emit(window) for window in ready]
@@ -0,0 +1,230 @@
+from __future__ import print_function
+
+import numpy as np
+
+from km3net import instrument
+from km3net.cpu import quadratic_difference, match3b, pairs_to_csr, index_of_refrac, inverse_c, Rs2, Rst, D02
+
+
+def quadratic_difference_max_time(distance):
+    """ return the largest difference in ct for which quadratic_difference can hold at a distance
+
+    :param distance: The distance between two hits.
+    :type distance: numpy ndarray
+
+    :rtype: numpy ndarray
+    """
+    return distance
+
+
+def match3b_max_time(distance):
+    """ return the largest time difference for which match3b can hold at a distance
+
+    The largest time difference allowed by Match 3B grows with the distance, the
+    lower limit on the time difference of Match 3B is ignored.
+
+    :rtype: numpy ndarray
+    """
+    d2 = distance * distance
+    dmax = np.where(d2 < D02, distance * index_of_refrac, np.sqrt(np.maximum(d2 - Rs2, 0.0)) + Rst)
+    return dmax * inverse_c
+
+
+_max_time = {quadratic_difference: quadratic_difference_max_time, match3b: match3b_max_time}
+
+
+def super_nodes(x, y, z, ct, module, bucket_length):
+    """ collapse the hits on the same module within the same time bucket into super-nodes
+
+    :param module: The module of every hit.
+    :type module: numpy ndarray of an integer type
+
+    :param bucket_length: The length of the time buckets, in the unit of ct.
+    :type bucket_length: float
+
+    :returns: The hits ordered by super-node, the start of every super-node in that order,
+        and per super-node an array of shape (5, 2) with the smallest and largest x, y, z,
+        ct and hit index
+    :rtype: tuple(numpy ndarray)
+    """
+    bucket = np.floor((ct - ct[0]) / bucket_length).astype(np.int64) if ct.size else np.zeros(0, dtype=np.int64)
+    module = np.asarray(module).astype(np.int64)
+    key = bucket * (int(module.max()) + 1 if module.size else 1) + module
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = sorted_key[1:] != sorted_key[:-1]
+    starts = np.flatnonzero(first)
+
+    bounds = np.empty((starts.size, 5, 2))
+    for k, column in enumerate((x, y, z, ct, np.arange(ct.size))):
+        values = column[order]
+        bounds[:, k, 0] = np.minimum.reduceat(values, starts) if starts.size else []
+        bounds[:, k, 1] = np.maximum.reduceat(values, starts) if starts.size else []
+    return order, starts, bounds
+
+
+class HierarchicalCorrelator(object):
+    """ NumPy engine that correlates hits in two levels, first between modules, then between hits
+
+    The hits on the same module within a short time bucket are collapsed into a
+    super-node with the bounding box of their positions, times and indices. Pairs of
+    super-nodes are first tested with a conservative bound: the smallest possible time
+    difference between their hits against the largest time difference the criterion
+    allows at the largest possible distance, see quadratic_difference_max_time and
+    match3b_max_time. Only for the pairs of super-nodes that pass, the criterion is
+    evaluated for the pairs of their hits. Pairs of hits further apart than
+    sliding_window_width are skipped, so the result is the same sparse matrix as that
+    of the flat engines in km3net.cpu.
+
+    This pays off for dense slices, in which modules carry several hits per time
+    bucket, such as during bursts of bioluminescence or bright events. When nearly
+    every super-node holds a single hit, the bound is about as costly as the criterion.
+
+    Hits carry no module id in the input files, by default hits are assigned to modules
+    by rounding their positions to a grid of cell_size meters.
+    """
+
+    def __init__(self, N, sliding_window_width=1500, criterion=quadratic_difference, bucket_length=100.0,
+                 cell_size=2.0, max_pairs=1 << 22):
+        """instantiate HierarchicalCorrelator
+
+        :param N: The largest number of hits that are to be processed at once.
+        :type N: int
+
+        :param sliding_window_width: The width of the 'window' in which we look for correlated hits.
+        :type sliding_window_width: int
+
+        :param criterion: The criterion, quadratic_difference or match3b from km3net.cpu.
+        :type criterion: callable
+
+        :param bucket_length: The length of the time buckets of the super-nodes, in the unit of ct.
+        :type bucket_length: float
+
+        :param cell_size: The size in meters of the grid used to assign hits to modules.
+        :type cell_size: float
+
+        :param max_pairs: The largest number of pairs of super-nodes or hits evaluated in one vectorized step.
+        :type max_pairs: int
+        """
+        if criterion not in _max_time:
+            raise ValueError("No bound for criterion " + str(criterion))
+        self.N = np.int32(N)
+        self.sliding_window_width = np.int32(sliding_window_width)
+        self.criterion = criterion
+        self.max_time = _max_time[criterion]
+        self.bucket_length = bucket_length
+        self.cell_size = cell_size
+        self.max_pairs = max_pairs
+
+    def modules(self, x, y, z):
+        """ assign hits to modules by rounding their positions to the grid
+
+        :rtype: numpy ndarray of type numpy.int64
+        """
+        cells = np.round(np.stack([x, y, z], axis=1) / self.cell_size).astype(np.int64)
+        return np.unique(cells, axis=0, return_inverse=True)[1].reshape(-1)
+
+    def super_pairs(self, bounds):
+        """ generate the pairs of super-nodes that may contain correlated hits
+
+        Only super-nodes that start within the window of hits, and within the largest
+        time difference the criterion allows over the extent of all hits, are tested.
+
+        :param bounds: The bounding boxes of the super-nodes, see super_nodes.
+        :type bounds: numpy ndarray
+
+        :returns: A generator of the two super-nodes of each pair that passed, and the number of pairs tested
+        :rtype: generator of tuple(numpy ndarray, numpy ndarray, int)
+        """
+        window = int(self.sliding_window_width)
+        if bounds.shape[0] == 0:
+            return
+        extent = bounds[:, :3, 1].max(axis=0) - bounds[:, :3, 0].min(axis=0)
+        max_time = float(self.max_time(np.sqrt(np.sum(extent * extent)) + 1e-3))
+
+        #the first hit of a super-node also has its smallest ct, so both orders are the same
+        by_first = np.argsort(bounds[:, 4, 0], kind="stable")
+        columns = np.ascontiguousarray(bounds[by_first].transpose(1, 2, 0))
+        stop = np.minimum(np.searchsorted(columns[4, 0], columns[4, 1] + window, "right"),
+                          np.searchsorted(columns[3, 0], columns[3, 1] + max_time, "right"))
+        count = stop - np.arange(stop.size)
+        ends = np.cumsum(count)
+        k = 0
+        while k < count.size:
+            last = max(int(np.searchsorted(ends, (ends[k] - count[k]) + self.max_pairs, "right")), k+1)
+            c = count[k:last]
+            a = np.repeat(np.arange(k, last), c)
+            b = a + np.arange(a.size) - np.repeat(np.cumsum(c) - c, c)
+            #the largest distance between the boxes and the smallest gap in time and in index
+            distance2 = 0.0
+            for dim in range(3):
+                span = np.maximum(columns[dim, 1][b] - columns[dim, 0][a], columns[dim, 1][a] - columns[dim, 0][b])
+                distance2 = distance2 + span * span
+            #some slack for the rounding of the criterion in float32
+            max_distance = np.sqrt(distance2) * (1.0 + 1e-5) + 1e-3
+            gap_ct = np.maximum(columns[3, 0][b] - columns[3, 1][a], columns[3, 0][a] - columns[3, 1][b])
+            gap_index = np.maximum(columns[4, 0][b] - columns[4, 1][a], columns[4, 0][a] - columns[4, 1][b])
+            passed = (gap_index <= window) & (gap_ct <= self.max_time(max_distance))
+            yield by_first[a[passed]], by_first[b[passed]], a.size
+            k = last
+
+    def compute(self, x, y, z, ct, module=None):
+        """ compute the sparse matrix of correlated hits
+
+        :param module: Optional module of every hit, see modules.
+        :type module: numpy ndarray of an integer type
+
+        :returns: col_idx, prefix_sums, degrees, total_correlated_hits, see km3net.cpu.CorrelateSparse.compute
+        :rtype: tuple( numpy ndarray of type numpy.int32, int )
+        """
+        start_time = instrument.start()
+        n = x.size
+        window = int(self.sliding_window_width)
+        if module is None:
+            module = self.modules(x, y, z)
+        order, starts, bounds = super_nodes(x, y, z, ct, module, self.bucket_length)
+        sizes = np.diff(np.append(starts, n))
+
+        found_i, found_d = [], []
+        super_pairs_tested = super_pairs_passed = pairs_evaluated = 0
+        for a, b, tested in self.super_pairs(bounds):
+            super_pairs_tested += tested
+            super_pairs_passed += a.size
+            #expand the pairs of super-nodes into pairs of hits, in steps of at most max_pairs
+            counts = sizes[a] * sizes[b]
+            ends = np.cumsum(counts)
+            k = 0
+            while k < a.size:
+                last = max(int(np.searchsorted(ends, (ends[k] - counts[k]) + self.max_pairs, "right")), k+1)
+                pa, pb, pc = a[k:last], b[k:last], counts[k:last]
+                pair = np.repeat(np.arange(pa.size), pc)
+                local = np.arange(pair.size) - np.repeat(np.cumsum(pc) - pc, pc)
+                size_b = sizes[pb][pair]
+                local_a, local_b = local // size_b, local % size_b
+                i = order[starts[pa][pair] + local_a]
+                j = order[starts[pb][pair] + local_b]
+                #within a super-node every pair of hits appears twice, keep it once
+                keep = (pa[pair] != pb[pair]) | (local_a < local_b)
+                i, j = np.minimum(i[keep], j[keep]), np.maximum(i[keep], j[keep])
+                keep = j - i <= window
+                i, j = i[keep], j[keep]
+                pairs_evaluated += i.size
+                correlated = self.criterion(x[i], y[i], z[i], ct[i], x[j], y[j], z[j], ct[j])
+                found_i.append(i[correlated])
+                found_d.append(j[correlated] - i[correlated])
+                k = last
+
+        found_i = np.concatenate(found_i) if found_i else np.zeros(0, dtype=np.int64)
+        found_d = np.concatenate(found_d) if found_d else np.zeros(0, dtype=np.int64)
+        by_distance = np.argsort(found_d, kind="stable")
+        found_i, found_d = found_i[by_distance], found_d[by_distance]
+        cuts = np.searchsorted(found_d, np.arange(1, min(window, max(n-1, 0)) + 2))
+        pairs = [found_i[s:e] for s, e in zip(cuts[:-1], cuts[1:])]
+        col_idx, prefix_sums, degrees, total_correlated_hits = pairs_to_csr(pairs, n)
+
+        if start_time is not None:
+            instrument.report("correlate_hierarchical", start_time, hits=n, super_nodes=starts.size,
+                              super_pairs=super_pairs_tested, super_pairs_passed=super_pairs_passed,
+                              pairs_evaluated=pairs_evaluated, edges=total_correlated_hits)
+        return col_idx, prefix_sums, degrees, total_correlated_hits
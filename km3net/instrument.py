@@ -0,0 +1,254 @@
+from __future__ import print_function
+
+import time
+import threading
+import tracemalloc
+from collections import OrderedDict
+
+#the registered hooks, the engines only collect counters when this list is not empty
+hooks = []
+
+_context = threading.local()
+
+#the number of active track_memory(True) calls, and whether tracemalloc was started by us
+_memory_tracking = 0
+_started_tracemalloc = False
+
+
+def register_hook(hook):
+    """ register a function that receives the counters of every pipeline stage
+
+    The hook is called as hook(stage, counters) where stage is a string, such as
+    "ingest", "correlate" or "purge", and counters is a dictionary. Every stage
+    reports its time in seconds as "time", the other counters depend on the stage:
+
+        * ingest: hits, bytes_read
+        * calibrate: hits, channels
+        * read, receive: hits, for the streaming pipelines waiting on the next slice
+        * prefilter: hits, coincidences, coincident_hits, accepted
+        * coalesce: hits, merged_hits
+        * veto: hits, removed_hits, vetoed_channels
+        * merge: hits, runs, buffered, late_hits
+        * schedule: slices, in_flight, reorder_buffer, workers
+        * correlate: hits, pairs_evaluated, edges, parts, bytes_allocated
+        * correlate_directions: hits, directions, edges
+        * correlate_hierarchical: hits, super_nodes, super_pairs, super_pairs_passed, pairs_evaluated, edges
+        * purge: hits, edges, iterations, surviving_nodes, bytes_allocated
+
+    While memory is tracked, see track_memory(), every stage also reports
+    peak_traced_bytes and largest_array_bytes.
+
+    :param hook: The function to call.
+    :type hook: callable
+    """
+    hooks.append(hook)
+
+
+def unregister_hook(hook):
+    """ remove a hook registered with register_hook """
+    hooks.remove(hook)
+
+
+def start():
+    """ return the start time of a stage, or None when no hooks are registered
+
+    Stages call this on entry and only collect and report their counters when it
+    does not return None, so instrumentation costs next to nothing when disabled.
+    """
+    if hooks:
+        if _memory_tracking:
+            tracemalloc.reset_peak()
+            _context.arrays = {}
+        return time.perf_counter()
+    return None
+
+
+def report(stage, start_time, **counters):
+    """ report the counters of a stage to all registered hooks
+
+    :param stage: The name of the stage.
+    :type stage: string
+
+    :param start_time: The value returned by start() when the stage was entered.
+    :type start_time: float
+    """
+    counters["time"] = time.perf_counter() - start_time
+    if _memory_tracking:
+        arrays = getattr(_context, "arrays", {})
+        _context.last_arrays = arrays
+        _context.arrays = {}
+        counters["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        counters["largest_array_bytes"] = max(arrays.values()) if arrays else 0
+    for hook in list(hooks):
+        hook(stage, counters)
+
+
+def track_memory(enable=True):
+    """ enable or disable memory accounting of the stages
+
+    While enabled, tracemalloc traces all allocations, including those of numpy
+    and pandas, and its peak is reset whenever a stage starts, so each stage reports
+    the peak traced memory during its run as peak_traced_bytes. Stages also record
+    the sizes of their main arrays with record_arrays(). Note that the peak is
+    process-wide, so when stages run concurrently in several threads, their peaks
+    include each other's allocations. Memory on the GPU is not traced.
+
+    Calls may be nested, tracking stops when every enabling call has been matched.
+    """
+    global _memory_tracking, _started_tracemalloc
+    if enable:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracemalloc = True
+        _memory_tracking += 1
+    elif _memory_tracking > 0:
+        _memory_tracking -= 1
+        if _memory_tracking == 0 and _started_tracemalloc:
+            tracemalloc.stop()
+            _started_tracemalloc = False
+
+
+def record_arrays(**arrays):
+    """ record the sizes of the arrays used by the current stage
+
+    Does nothing unless memory is tracked. The largest size recorded for each
+    name is kept until the stage reports, after which it is available to hooks
+    through stage_arrays().
+
+    :param arrays: Arrays, or any object with an nbytes attribute, or sizes in bytes, by name.
+    """
+    if not _memory_tracking:
+        return
+    sizes = getattr(_context, "arrays", None)
+    if sizes is None:
+        sizes = _context.arrays = {}
+    for name, array in arrays.items():
+        nbytes = int(getattr(array, "nbytes", array))
+        sizes[name] = max(sizes.get(name, 0), nbytes)
+
+
+def stage_arrays():
+    """ return the array sizes recorded by the stage that reported last in this thread
+
+    :returns: The size in bytes per array name
+    :rtype: dict
+    """
+    return dict(getattr(_context, "last_arrays", {}))
+
+
+def set_slice(seq):
+    """ set the slice that the current thread is working on
+
+    Hooks can use current_slice() to attribute the counters they receive to a slice.
+
+    :param seq: The sequence number of the slice, or None.
+    :type seq: int
+    """
+    _context.slice = seq
+
+
+def current_slice():
+    """ return the slice that the current thread is working on, or None """
+    return getattr(_context, "slice", None)
+
+
+class StageCounters(object):
+    """ hook that accumulates the counters of every stage
+
+    For every stage and counter the total, the maximum and the number of
+    reports are kept. Register an instance with register_hook, or use it as
+    a context manager to register it only for the duration of a with block.
+    """
+
+    def __init__(self):
+        self.calls = OrderedDict()
+        self.totals = OrderedDict()
+        self.maximum = OrderedDict()
+
+    def __call__(self, stage, counters):
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        totals = self.totals.setdefault(stage, OrderedDict())
+        maximum = self.maximum.setdefault(stage, OrderedDict())
+        for name, value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+            maximum[name] = max(maximum.get(name, value), value)
+
+    def __enter__(self):
+        register_hook(self)
+        return self
+
+    def __exit__(self, *args):
+        unregister_hook(self)
+
+    def summary(self):
+        """ return a printable summary of the accumulated counters
+
+        :rtype: string
+        """
+        lines = []
+        for stage, calls in self.calls.items():
+            counters = ", ".join("%s=%.6g" % (k, v) for k, v in self.totals[stage].items())
+            lines.append("%s: calls=%d, %s" % (stage, calls, counters))
+        return "\n".join(lines)
+
+
+class MemoryAccounting(object):
+    """ hook that records the memory use of every stage per slice
+
+    Use as a context manager, which also enables memory tracking for the duration
+    of the with block. For every report the slice, the stage, the peak traced memory
+    and the largest arrays of the stage are kept in records.
+    """
+
+    def __init__(self, top=3):
+        """instantiate MemoryAccounting
+
+        :param top: The number of largest arrays to keep per report.
+        :type top: int
+        """
+        self.top = top
+        self.records = []
+
+    def __call__(self, stage, counters):
+        if "peak_traced_bytes" not in counters:
+            return
+        arrays = sorted(stage_arrays().items(), key=lambda item: -item[1])
+        self.records.append({"slice": current_slice(), "stage": stage,
+                             "peak_traced_bytes": counters["peak_traced_bytes"],
+                             "largest_arrays": arrays[:self.top]})
+
+    def __enter__(self):
+        track_memory(True)
+        register_hook(self)
+        return self
+
+    def __exit__(self, *args):
+        unregister_hook(self)
+        track_memory(False)
+
+    def peaks(self):
+        """ return the highest peak traced memory per stage
+
+        :returns: The peak in bytes per stage
+        :rtype: dict
+        """
+        peaks = OrderedDict()
+        for record in self.records:
+            peaks[record["stage"]] = max(peaks.get(record["stage"], 0), record["peak_traced_bytes"])
+        return peaks
+
+    def summary(self):
+        """ return a printable summary with the peak and the largest arrays per stage
+
+        :rtype: string
+        """
+        lines = []
+        for stage, peak in self.peaks().items():
+            largest = {}
+            for record in self.records:
+                if record["stage"] == stage:
+                    for name, nbytes in record["largest_arrays"]:
+                        largest[name] = max(largest.get(name, 0), nbytes)
+            arrays = ", ".join("%s=%d" % item for item in sorted(largest.items(), key=lambda item: -item[1])[:self.top])
+            lines.append("%s: peak_traced_bytes=%d, %s" % (stage, peak, arrays))
+        return "\n".join(lines)
@@ -2,14 +2,25 @@ from __future__ import print_function
 
 import numpy as np
 import pycuda.driver as drv
-from pycuda.compiler import SourceModule
 
-from km3net.util import *
+from km3net.util import get_kernel_path, ready_input
+from km3net.arena import BufferArena
+from km3net.build import default_build_cache
+from km3net import instrument
+
+
+def _ready_input(arena, name, arg):
+    """ copy numpy arrays into a device buffer from the arena, pass through device allocations """
+    if isinstance(arg, np.ndarray):
+        d_arg = arena.get(name, arg.size, arg.dtype)
+        drv.memcpy_htod(d_arg, np.ascontiguousarray(arg))
+        return d_arg
+    return ready_input(arg)
 
 class CorrelateSparse(object):
     """ Base class for kernels that correlate hits and output a sparse matrix """
 
-    def __init__(self, N, sliding_window_width, cc, kernel_name, block_size_x):
+    def __init__(self, N, sliding_window_width, cc, kernel_name, block_size_x, reuse_buffers=False, build_cache=None):
         """ Generic constructor, to be overridden by subclasses
 
         Subclasses should call this constructor with the right kernel_name
@@ -19,19 +30,23 @@ class CorrelateSparse(object):
         self.threads = (block_size_x, 1, 1)
         self.grid = (int(np.ceil(N/float(block_size_x))), 1)
 
+        #buffers in host and GPU memory, kept across calls when reuse_buffers is True
+        self.arena = BufferArena(reuse=reuse_buffers)
+        self.device_arena = BufferArena(reuse=reuse_buffers, allocator=drv.mem_alloc)
+        #the row_idx argument is not used, and col_idx and prefix_sums are not used by the first kernel
+        self.d_unused = drv.mem_alloc(np.dtype(np.int32).itemsize)
+
         with open(get_kernel_path()+'correlate_full.cu', 'r') as f:
             kernel_string = f.read()
-        prefix = "#define block_size_x " + str(block_size_x) + "\n" + "#define window_width " + str(sliding_window_width) + "\n"
-        kernel_string = prefix + kernel_string
+        defines = {"block_size_x": block_size_x, "window_width": sliding_window_width}
 
         compiler_options = ['-Xcompiler=-Wall', '--std=c++11', '-O3']
 
-        self.compute_sums = SourceModule("#define write_sums 1\n" + kernel_string, options=compiler_options,
-                    arch='compute_' + cc, code='sm_' + cc,
-                    cache_dir=False, no_extern_c=True).get_function(kernel_name)
-        self.compute_sparse_matrix = SourceModule("#define write_spm 1\n" + kernel_string, options=compiler_options,
-                    arch='compute_' + cc, code='sm_' + cc,
-                    cache_dir=False, no_extern_c=True).get_function(kernel_name)
+        build_cache = build_cache or default_build_cache()
+        self.compute_sums, = build_cache.get_functions(kernel_string, [kernel_name], dict(defines, write_sums=1),
+                    compiler_options, cc, no_extern_c=True)
+        self.compute_sparse_matrix, = build_cache.get_functions(kernel_string, [kernel_name], dict(defines, write_spm=1),
+                    compiler_options, cc, no_extern_c=True)
 
 
     def compute(self, x, y, z, ct):
@@ -64,44 +79,51 @@ class CorrelateSparse(object):
         :rtype: tuple( pycuda.driver.DeviceAllocation )
 
         """
-        d_x = ready_input(x)
-        d_y = ready_input(y)
-        d_z = ready_input(z)
-        d_ct = ready_input(ct)
-
-        #run the first kernel
-        row_idx = np.zeros(10).astype(np.int32)
-        col_idx = np.zeros(10).astype(np.int32)
-        prefix_sums = np.zeros(10).astype(np.int32)
-        degrees = np.zeros(self.N).astype(np.int32)
-
-        d_degrees = allocate_and_copy(degrees)
-        d_row_idx = allocate_and_copy(row_idx)
-        d_col_idx = allocate_and_copy(col_idx)
-        d_prefix_sums = allocate_and_copy(prefix_sums)
-
-        args_list = [d_row_idx, d_col_idx, d_prefix_sums, d_degrees, self.N, self.sliding_window_width, d_x, d_y, d_z, d_ct]
+        start_time = instrument.start()
+        allocated_bytes = self.arena.allocated_bytes + self.device_arena.allocated_bytes
+
+        d_x = _ready_input(self.device_arena, "x", x)
+        d_y = _ready_input(self.device_arena, "y", y)
+        d_z = _ready_input(self.device_arena, "z", z)
+        d_ct = _ready_input(self.device_arena, "ct", ct)
+
+        #run the first kernel, it writes the degree of every hit so no need to clear d_degrees
+        degrees = self.arena.get("degrees", self.N, np.int32)
+        d_degrees = self.device_arena.get("degrees", self.N, np.int32)
+
+        args_list = [self.d_unused, self.d_unused, self.d_unused, d_degrees, self.N, self.sliding_window_width, d_x, d_y, d_z, d_ct]
         self.compute_sums(*args_list, block=self.threads, grid=self.grid, stream=None, shared=0)
 
         #allocate space to store sparse matrix
         drv.memcpy_dtoh(degrees, d_degrees)
         total_correlated_hits = degrees.sum()
-        col_idx = np.zeros(total_correlated_hits).astype(np.int32)
-        prefix_sums = np.cumsum(degrees).astype(np.int32)
+        prefix_sums = self.arena.get("prefix_sums", self.N, np.int32)
+        np.cumsum(degrees, out=prefix_sums)
 
-        d_col_idx = allocate_and_copy(col_idx)
-        d_prefix_sums = allocate_and_copy(prefix_sums)
+        d_col_idx = self.device_arena.get("col_idx", total_correlated_hits, np.int32)
+        d_prefix_sums = self.device_arena.get("prefix_sums", self.N, np.int32)
+        drv.memcpy_htod(d_prefix_sums, prefix_sums)
 
-        args_list2 = [d_row_idx, d_col_idx, d_prefix_sums, d_degrees, self.N, self.sliding_window_width, d_x, d_y, d_z, d_ct]
+        args_list2 = [self.d_unused, d_col_idx, d_prefix_sums, d_degrees, self.N, self.sliding_window_width, d_x, d_y, d_z, d_ct]
         self.compute_sparse_matrix(*args_list2, block=self.threads, grid=self.grid, stream=None, shared=0)
 
+        if start_time is not None:
+            drv.Context.synchronize()
+            window = min(int(self.sliding_window_width), int(self.N)-1)
+            instrument.record_arrays(degrees=degrees, prefix_sums=prefix_sums,
+                                     **{"device_" + k: v for k, v in self.device_arena.high_water_marks().items()})
+            instrument.report("correlate", start_time, hits=int(self.N),
+                              pairs_evaluated=window*int(self.N) - window*(window+1)//2,
+                              edges=int(total_correlated_hits),
+                              bytes_allocated=self.arena.allocated_bytes + self.device_arena.allocated_bytes - allocated_bytes)
+
         return d_col_idx, d_prefix_sums, d_degrees, total_correlated_hits
 
 
 class QuadraticDifferenceSparse(CorrelateSparse):
     """ class that provides an interface to the Quadratic Difference GPU Kernel and maintains GPU state"""
 
-    def __init__(self, N, sliding_window_width=1500, cc='52'):
+    def __init__(self, N, sliding_window_width=1500, cc='52', reuse_buffers=False, build_cache=None):
         """instantiate QuadraticDifferenceSparse
 
         Create the object that provides an interface to the GPU kernel for performing the
@@ -109,7 +131,7 @@ class QuadraticDifferenceSparse(CorrelateSparse):
         correlation table in a sparse manner, using CSR notation.
 
         When this object is instantiated the CUDA kernel
-        code is compiled and some of the GPU memory is allocated.
+        code is compiled, or loaded from the build cache, and some of the GPU memory is allocated.
 
         :param N: The largest number of hits that are to be processed by one iteration
                 of the quadratic difference algorithm.
@@ -124,9 +146,17 @@ class QuadraticDifferenceSparse(CorrelateSparse):
                 of the major and minor number concatenated without any separators.
         :type cc: string
 
+        :param reuse_buffers: Keep the GPU and host buffers across calls, the device allocations
+                returned by compute are then overwritten by the next call.
+        :type reuse_buffers: bool
+
+        :param build_cache: The cache used to compile the kernels, by default the cache
+                shared by all engines in this process.
+        :type build_cache: km3net.build.KernelBuildCache
+
         """
         block_size_x = 256
-        super().__init__(N, sliding_window_width, cc, "quadratic_difference_full", block_size_x)
+        super().__init__(N, sliding_window_width, cc, "quadratic_difference_full", block_size_x, reuse_buffers, build_cache)
 
 
     def compute(self, x, y, z, ct):
@@ -163,7 +193,7 @@ class QuadraticDifferenceSparse(CorrelateSparse):
 class Match3BSparse(CorrelateSparse):
     """ class that provides an interface to the Match 3B GPU Kernel and maintains GPU state"""
 
-    def __init__(self, N, sliding_window_width=1500, cc='52'):
+    def __init__(self, N, sliding_window_width=1500, cc='52', reuse_buffers=False, build_cache=None):
         """instantiate Match3BSparse
 
         Create the object that provides an interface to the GPU kernel for performing the
@@ -171,7 +201,7 @@ class Match3BSparse(CorrelateSparse):
         correlation table in a sparse manner, using CSR notation.
 
         When this object is instantiated the CUDA kernel
-        code is compiled and some of the GPU memory is allocated.
+        code is compiled, or loaded from the build cache, and some of the GPU memory is allocated.
 
         :param N: The largest number of hits that are to be processed by one iteration
                 of the match 3b algorithm.
@@ -186,9 +216,17 @@ class Match3BSparse(CorrelateSparse):
                 of the major and minor number concatenated without any separators.
         :type cc: string
 
+        :param reuse_buffers: Keep the GPU and host buffers across calls, the device allocations
+                returned by compute are then overwritten by the next call.
+        :type reuse_buffers: bool
+
+        :param build_cache: The cache used to compile the kernels, by default the cache
+                shared by all engines in this process.
+        :type build_cache: km3net.build.KernelBuildCache
+
         """
         block_size_x = 512
-        super().__init__(N, sliding_window_width, cc, "match3b_full", block_size_x)
+        super().__init__(N, sliding_window_width, cc, "match3b_full", block_size_x, reuse_buffers, build_cache)
 
 
     def compute(self, x, y, z, t):
@@ -227,14 +265,14 @@ class Match3BSparse(CorrelateSparse):
 class PurgingSparse(object):
     """ class that provides an interface to the GPU Kernels used for Purging and maintains GPU state"""
 
-    def __init__(self, N, cc):
+    def __init__(self, N, cc, reuse_buffers=False, build_cache=None, threshold=3):
         """instantiate PurgingSparse
 
         Create the object that provides an interface to the GPU kernel for performing the
         Purging algorithm on a sparse correlation table. This implementation of the
         algorithm uses the correlation table in a sparse manner, produced by the
         Quadratic Difference Sparse kernel. When this object is instantiated the
-        CUDA kernel codes are compiled.
+        CUDA kernel codes are compiled, or loaded from the build cache.
 
         :param N: The largest number of hits that are to be processed by one iteration
                 of the quadratic difference algorithm.
@@ -244,6 +282,17 @@ class PurgingSparse(object):
                 of the major and minor number concatenated without any separators.
         :type cc: string
 
+        :param reuse_buffers: Keep the GPU and host buffers across calls.
+        :type reuse_buffers: bool
+
+        :param build_cache: The cache used to compile the kernels, by default the cache
+                shared by all engines in this process.
+        :type build_cache: km3net.build.KernelBuildCache
+
+        :param threshold: The minimum degree of nodes that count towards the clique, as in
+                km3net.cpu.PurgingSparse, compiled into the minimum_degree kernel.
+        :type threshold: int
+
         """
 
         self.N = N
@@ -252,21 +301,29 @@ class PurgingSparse(object):
             remove_nodes_string = f.read()
         with open(get_kernel_path()+'minimum_degree.cu', 'r') as f:
             minimum_string = f.read()
-        self.minimum_degree = SourceModule(minimum_string, options=['-Xcompiler=-Wall'],
-                    arch='compute_' + cc, code='sm_' + cc,
-                    cache_dir=False).get_function("minimum_degree")
-        self.combine_blocked_min_num = SourceModule(minimum_string, options=['-Xcompiler=-Wall'],
-                    arch='compute_' + cc, code='sm_' + cc,
-                    cache_dir=False).get_function("combine_blocked_min_num")
-        self.remove_nodes = SourceModule(remove_nodes_string, options=['-Xcompiler=-Wall'],
-                    arch='compute_' + cc, code='sm_' + cc,
-                    cache_dir=False).get_function("remove_nodes")
+
+        #both functions in minimum_degree.cu are taken from the same module
+        build_cache = build_cache or default_build_cache()
+        self.minimum_degree, self.combine_blocked_min_num = build_cache.get_functions(minimum_string,
+                    ["minimum_degree", "combine_blocked_min_num"], defines={"threshold": int(threshold)},
+                    options=['-Xcompiler=-Wall'], cc=cc)
+        self.remove_nodes, = build_cache.get_functions(remove_nodes_string, ["remove_nodes"],
+                    options=['-Xcompiler=-Wall'], cc=cc)
 
         block_size_x = 128
         self.max_blocks = (np.ceil(N / float(block_size_x))).astype(np.int32)
         self.threads = (block_size_x, 1, 1)
         self.grid = (int(self.max_blocks), 1)
 
+        #these are completely overwritten by every call, so only allocate them once
+        self.d_row_idx = drv.mem_alloc(np.dtype(np.int32).itemsize)
+        self.d_minimum = drv.mem_alloc(int(self.max_blocks) * np.dtype(np.int32).itemsize)
+        self.d_num_nodes = drv.mem_alloc(int(self.max_blocks) * np.dtype(np.int32).itemsize)
+        self.current_minimum = np.zeros(1, dtype=np.int32)
+        self.current_num_nodes = np.zeros(1, dtype=np.int32)
+
+        self.arena = BufferArena(reuse=reuse_buffers)
+        self.device_arena = BufferArena(reuse=reuse_buffers, allocator=drv.mem_alloc)
 
 
     def compute(self, col_idx, prefix_sums, degrees, shift=0):
@@ -292,17 +349,23 @@ class PurgingSparse(object):
         :rtype: list ( int )
 
         """
-        d_col_idx = ready_input(col_idx)
-        d_prefix_sums = ready_input(prefix_sums)
-        d_degrees = ready_input(degrees)
+        start_time = instrument.start()
+        allocated_bytes = self.arena.allocated_bytes + self.device_arena.allocated_bytes
 
-        minimum = np.zeros(self.max_blocks).astype(np.int32)
-        num_nodes = np.zeros(self.max_blocks).astype(np.int32)
+        d_col_idx = _ready_input(self.device_arena, "col_idx", col_idx)
+        d_prefix_sums = _ready_input(self.device_arena, "prefix_sums", prefix_sums)
+        d_degrees = _ready_input(self.device_arena, "degrees", degrees)
 
-        #setup GPU memory
-        d_row_idx = allocate_and_copy(np.zeros(10).astype(np.int32))
-        d_minimum = allocate_and_copy(minimum)
-        d_num_nodes = allocate_and_copy(num_nodes)
+        num_edges = None
+        if start_time is not None:
+            #the prefix sums are inclusive, so the last one is the number of nonzeros in the input
+            last = np.zeros(1, dtype=np.int32)
+            drv.memcpy_dtoh(last, int(d_prefix_sums) + (int(self.N)-1) * last.itemsize)
+            num_edges = int(last[0])
+
+        d_row_idx = self.d_row_idx
+        d_minimum = self.d_minimum
+        d_num_nodes = self.d_num_nodes
 
         args_minimum = [d_minimum, d_num_nodes, d_degrees, d_row_idx, d_col_idx, d_prefix_sums, self.N]
         self.minimum_degree(*args_minimum, block=self.threads, grid=self.grid)
@@ -311,8 +374,8 @@ class PurgingSparse(object):
         args_combine = [d_minimum, d_num_nodes, self.max_blocks]
         self.combine_blocked_min_num(*args_combine, block=self.threads, grid=(1,1))
 
-        current_minimum = np.array([0]).astype(np.int32)
-        current_num_nodes = np.array([0]).astype(np.int32)
+        current_minimum = self.current_minimum
+        current_num_nodes = self.current_num_nodes
         drv.memcpy_dtoh(current_minimum, d_minimum)
         drv.memcpy_dtoh(current_num_nodes, d_num_nodes)
         #print("current_minimum", current_minimum)
@@ -335,15 +398,23 @@ class PurgingSparse(object):
 
         #print("finished purging, iterations = ", counter)
 
-        degrees = np.zeros(self.N).astype(np.int32)
+        degrees = self.arena.get("degrees", self.N, np.int32)
         drv.memcpy_dtoh(degrees, d_degrees)
+        found_indices = []
         if (current_num_nodes > 0):
             #print("found clique of size=", current_num_nodes)
             indices = np.array(range(degrees.size))
             found_indices = indices[degrees >= current_minimum]
             #print(found_indices + shift)
-            return found_indices + shift
+            found_indices = found_indices + shift
+
+        if start_time is not None:
+            instrument.record_arrays(degrees=degrees,
+                                     **{"device_" + k: v for k, v in self.device_arena.high_water_marks().items()})
+            instrument.report("purge", start_time, hits=int(self.N), edges=num_edges, iterations=counter,
+                              surviving_nodes=len(found_indices),
+                              bytes_allocated=self.arena.allocated_bytes + self.device_arena.allocated_bytes - allocated_bytes)
 
-        return []
+        return found_indices
 
 
@@ -0,0 +1,120 @@
+from __future__ import print_function
+
+import numpy as np
+
+from km3net import instrument
+from km3net.cpu import index_of_refrac, speed_of_light, quadratic_difference, match3b
+
+#the criteria that take the times of the hits in ns instead of ct in meters
+_times_in_ns = (match3b,)
+
+
+def local_coincidences(x, y, z, ct, max_distance=40.0, ct_window=6.0):
+    """ find the hits that take part in a local coincidence
+
+    Two hits form a local coincidence when they are at most max_distance apart,
+    which covers hits on the same module and on neighbouring modules, and their
+    difference in ct is at most the travel time of light in water between them plus
+    ct_window. The hits must be sorted on ct, given in meters. Every hit is only compared with the
+    hits that follow it within the largest possible time difference, so the cost is
+    linear in the number of hits times the number of hits in such a time window.
+
+    :param max_distance: The largest distance between the hits in meters.
+    :type max_distance: float
+
+    :param ct_window: The time difference that is allowed on top of the travel time,
+        in the same unit as ct.
+    :type ct_window: float
+
+    :returns: A mask of the hits that are in at least one local coincidence, and the
+        number of coincident pairs
+    :rtype: tuple(numpy ndarray of type bool, int)
+    """
+    n = ct.size
+    in_coincidence = np.zeros(n, dtype=bool)
+    num_pairs = 0
+    max_ct = index_of_refrac * max_distance + ct_window
+    max_distance2 = max_distance * max_distance
+
+    #hits i that may still have a coincidence with hit i+k
+    active = np.arange(max(n-1, 0))
+    k = 1
+    while active.size > 0:
+        active = active[active + k < n]
+        j = active + k
+        diffct = ct[j] - ct[active]
+        within = diffct <= max_ct
+        active = active[within]
+        j = j[within]
+        diffct = diffct[within]
+        d2 = (x[j]-x[active])**2 + (y[j]-y[active])**2 + (z[j]-z[active])**2
+        coincident = (d2 <= max_distance2) & (diffct <= index_of_refrac * np.sqrt(d2) + ct_window)
+        in_coincidence[active[coincident]] = True
+        in_coincidence[j[coincident]] = True
+        num_pairs += int(np.count_nonzero(coincident))
+        k += 1
+
+    return in_coincidence, num_pairs
+
+
+class L1Prefilter(object):
+    """ cheap L1 trigger that decides whether a slice needs to be correlated at all
+
+    A clique that survives purging with the given threshold contains at least
+    threshold+1 hits. Slices in which fewer hits take part in a local coincidence
+    (L1) are assumed to contain background only, and skip correlation and purging.
+
+    The trigger is lossy, it is not a bound on the output of the correlators. The
+    criteria also correlate hits that are further than max_distance apart, so a
+    slice with a clique spread over distant modules is rejected and gets an empty
+    result, where the correlator and purger alone would have found the clique.
+    """
+
+    def __init__(self, threshold=3, max_distance=40.0, ct_window=6.0, min_hits=None, criterion=quadratic_difference):
+        """instantiate L1Prefilter
+
+        :param threshold: The threshold of the purging algorithm.
+        :type threshold: int
+
+        :param max_distance: The largest distance between hits in a local coincidence, see local_coincidences.
+        :type max_distance: float
+
+        :param ct_window: The allowed time difference on top of the travel time, see local_coincidences.
+        :type ct_window: float
+
+        :param min_hits: The smallest number of hits in local coincidences to accept a slice,
+            by default threshold+1.
+        :type min_hits: int
+
+        :param criterion: The criterion of the correlator that the accepted slices are passed to,
+            quadratic_difference or match3b from km3net.cpu. For match3b the slices hold the
+            times of the hits in ns, which are converted to ct in meters.
+        :type criterion: callable
+        """
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self.ct_window = ct_window
+        self.min_hits = threshold+1 if min_hits is None else min_hits
+        self.criterion = criterion
+        self.accepted = 0
+        self.rejected = 0
+
+    def accept(self, x, y, z, ct):
+        """ return whether a slice has enough hits in local coincidences to be correlated
+
+        :rtype: bool
+        """
+        start_time = instrument.start()
+        if self.criterion in _times_in_ns:
+            ct = ct * np.float32(speed_of_light)
+        in_coincidence, num_pairs = local_coincidences(x, y, z, ct, self.max_distance, self.ct_window)
+        num_hits = int(np.count_nonzero(in_coincidence))
+        accepted = num_hits >= self.min_hits
+        if accepted:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+        if start_time is not None:
+            instrument.report("prefilter", start_time, hits=ct.size, coincidences=num_pairs,
+                              coincident_hits=num_hits, accepted=int(accepted))
+        return accepted
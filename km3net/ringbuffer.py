@@ -0,0 +1,381 @@
+from __future__ import print_function
+
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker, Process
+
+import numpy as np
+
+from km3net import instrument
+
+HitBatch = namedtuple("HitBatch", ["x", "y", "z", "ct"])
+HitBatch.__doc__ = """ a batch of hits stored as x,y,z,ct columns of type numpy.float32
+
+The fields are in the same order as the arguments of the compute methods of the
+correlators, so a batch can be passed as ``correlator.compute(*batch)``.
+"""
+
+#layout of the int64 header at the start of the shared memory block
+_MAGIC = 0x6b6d336e6574
+_HEADER_SIZE = 8
+_H_MAGIC, _H_SLOTS, _H_MAX_HITS, _H_WRITE_SEQ, _H_READ_SEQ, _H_CLOSED = range(6)
+
+
+class HitRingBuffer(object):
+    """ single producer, single consumer ring buffer of hit batches in shared memory
+
+    The producer writes the x,y,z,ct columns of a batch of hits directly into one of
+    the slots of the ring buffer, the consumer obtains HitBatch views that point into
+    the shared memory, so the hits are never pickled or copied between processes.
+
+    Flow control is based on two sequence numbers stored in the shared memory. The
+    producer may only write sequence number 'seq' after the consumer has released
+    sequence number 'seq - slots', the consumer may only read 'seq' once the producer
+    has advanced the write sequence number beyond 'seq'.
+    """
+
+    def __init__(self, slots=8, max_hits=100000, name=None, create=True, poll_interval=1e-4):
+        """instantiate HitRingBuffer
+
+        Use create=True to allocate a new shared memory block, or create=False and pass
+        the name of an existing block to attach to a ring buffer created by another process.
+        When attaching, slots and max_hits are read from the shared memory.
+
+        :param slots: The number of batches that can be stored in the ring buffer.
+        :type slots: int
+
+        :param max_hits: The largest number of hits in a single batch.
+        :type max_hits: int
+
+        :param name: The name of the shared memory block, generated when None and create=True.
+        :type name: string
+
+        :param create: Whether to create a new shared memory block or attach to an existing one.
+        :type create: bool
+
+        :param poll_interval: The time in seconds to sleep while waiting on the other side.
+        :type poll_interval: float
+        """
+        self.poll_interval = poll_interval
+        self.owner = create
+        if create:
+            size = self._nbytes(slots, max_hits)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.header = np.ndarray(_HEADER_SIZE, dtype=np.int64, buffer=self.shm.buf)
+            self.header[:] = 0
+            self.header[_H_SLOTS] = slots
+            self.header[_H_MAX_HITS] = max_hits
+            self.header[_H_MAGIC] = _MAGIC
+        else:
+            self.shm = _attach_shared_memory(name)
+            self.header = np.ndarray(_HEADER_SIZE, dtype=np.int64, buffer=self.shm.buf)
+            if self.header[_H_MAGIC] != _MAGIC:
+                raise ValueError("Shared memory block " + str(name) + " is not a HitRingBuffer")
+
+        self.slots = int(self.header[_H_SLOTS])
+        self.max_hits = int(self.header[_H_MAX_HITS])
+        offset = self.header.nbytes
+        self.lengths = np.ndarray(self.slots, dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += self.lengths.nbytes
+        self.bases = np.ndarray(self.slots, dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += self.bases.nbytes
+        self.data = np.ndarray((self.slots, 4, self.max_hits), dtype=np.float32, buffer=self.shm.buf, offset=offset)
+
+    @staticmethod
+    def _nbytes(slots, max_hits):
+        return 8*_HEADER_SIZE + 2*8*slots + 4*4*slots*max_hits
+
+    @property
+    def name(self):
+        """ the name of the shared memory block, used by other processes to attach """
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        """ the sequence number of the next batch to be written """
+        return int(self.header[_H_WRITE_SEQ])
+
+    @property
+    def read_seq(self):
+        """ the sequence number of the oldest batch that has not been released """
+        return int(self.header[_H_READ_SEQ])
+
+    @property
+    def closed(self):
+        """ whether the producer has signalled the end of the stream """
+        return bool(self.header[_H_CLOSED])
+
+    def _wait(self, condition, timeout):
+        start = time.time()
+        while not condition():
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError("Timeout while waiting on the ring buffer")
+            time.sleep(self.poll_interval)
+
+    def write(self, x, y, z, ct, timeout=None, base=0):
+        """ write a batch of hits into the next free slot
+
+        Blocks while the ring buffer is full.
+
+        :param x,y,z,ct: The columns of the hits to write, all of the same size
+        :type x,y,z,ct: numpy ndarray
+
+        :param timeout: The maximum time in seconds to wait for a free slot, None waits forever.
+        :type timeout: float
+
+        :param base: The base time in nanoseconds that ct is relative to, see km3net.timebase.
+        :type base: int
+
+        :returns: The sequence number of the batch that was written
+        :rtype: int
+        """
+        n = len(x)
+        if n > self.max_hits:
+            raise ValueError("Batch of " + str(n) + " hits does not fit in slots of " + str(self.max_hits) + " hits")
+        seq = self.write_seq
+        self._wait(lambda: seq - self.read_seq < self.slots, timeout)
+
+        slot = seq % self.slots
+        for k, column in enumerate((x, y, z, ct)):
+            self.data[slot, k, :n] = column
+        self.lengths[slot] = n
+        self.bases[slot] = base
+        #publish the batch only after the data has been written
+        self.header[_H_WRITE_SEQ] = seq + 1
+        return seq
+
+    def close_writer(self):
+        """ signal the consumer that no more batches will be written """
+        self.header[_H_CLOSED] = 1
+
+    def read(self, seq=None, timeout=None):
+        """ obtain a view on a batch of hits
+
+        The returned views point directly into shared memory and remain valid until the
+        batch is released using release(seq). Blocks until the batch is available.
+
+        :param seq: The sequence number of the batch to read, by default the oldest unreleased batch.
+        :type seq: int
+
+        :param timeout: The maximum time in seconds to wait for the batch, None waits forever.
+        :type timeout: float
+
+        :returns: The sequence number and a HitBatch of views, or None when the producer has
+            closed the stream and all batches have been read.
+        :rtype: tuple(int, HitBatch) or None
+        """
+        if seq is None:
+            seq = self.read_seq
+        self._wait(lambda: seq < self.write_seq or self.closed, timeout)
+        if seq >= self.write_seq:
+            return None
+        slot = seq % self.slots
+        n = int(self.lengths[slot])
+        return seq, HitBatch(*self.data[slot, :, :n])
+
+    def base(self, seq):
+        """ return the base time in nanoseconds of a batch that has not been released
+
+        :rtype: numpy.int64
+        """
+        return self.bases[seq % self.slots]
+
+    def release(self, seq):
+        """ release a batch so that its slot can be reused by the producer
+
+        Batches have to be released in order.
+
+        :param seq: The sequence number of the batch to release.
+        :type seq: int
+        """
+        if seq != self.read_seq:
+            raise ValueError("Batches have to be released in order, expected " + str(self.read_seq) + " got " + str(seq))
+        self.header[_H_READ_SEQ] = seq + 1
+
+    def __iter__(self):
+        """ iterate over all batches until the producer closes the stream
+
+        Each batch is released when the next batch is requested.
+        """
+        while True:
+            item = self.read()
+            if item is None:
+                return
+            yield item
+            self.release(item[0])
+
+    def close(self):
+        """ detach from the shared memory, and remove it when this object created it """
+        self.header = self.lengths = self.bases = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _attach_shared_memory(name):
+    """ attach to an existing shared memory block without taking ownership
+
+    Before Python 3.13, attaching registers the block with the resource tracker,
+    which would remove the block when the attaching process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def replay_files(ring, filenames, slice_size=None, timeout=None, overlap=0, relative=False, use_profile=False):
+    """ local stand-in for the DAQ that replays hits from files into a ring buffer
+
+    Reads each file using km3net.util.get_real_input_data and writes the hits
+    into the ring buffer in slices of slice_size hits. The stream is closed
+    after the last file.
+
+    :param ring: The ring buffer to write into, or the name of its shared memory block.
+    :type ring: HitRingBuffer or string
+
+    :param filenames: The files to replay.
+    :type filenames: list(string)
+
+    :param slice_size: The number of hits per batch, by default the tuned slice length
+        plus overlap when the profile is enabled, see km3net.autotune, and otherwise
+        max_hits, limited to max_hits of the ring buffer.
+    :type slice_size: int
+
+    :param timeout: The maximum time in seconds to wait for a free slot.
+    :type timeout: float
+
+    :param overlap: The number of hits that consecutive batches have in common, so that
+        hits near the end of a batch are also correlated with those at the start of the next.
+        Replaced by the tuned overlap when slice_size is taken from the profile.
+    :type overlap: int
+
+    :param relative: Write ct relative to the first hit of each batch and store the base
+        time of the batch in the ring buffer, see HitRingBuffer.base, so that long runs
+        keep their precision in float32.
+    :type relative: bool
+
+    :param use_profile: Load the tuning profile of this host, also done when the
+        KM3NET_TUNING_PROFILE environment variable names a profile.
+    :type use_profile: bool
+
+    :returns: The number of batches written
+    :rtype: int
+    """
+    from km3net.util import get_real_input_data, get_relative_slice
+    from km3net.autotune import pipeline_settings
+
+    attached = not isinstance(ring, HitRingBuffer)
+    if attached:
+        ring = HitRingBuffer(name=ring, create=False)
+    if not slice_size:
+        settings = pipeline_settings(use_profile)
+        slice_size = ring.max_hits
+        if "slice_length" in settings:
+            #the profile sets the size of the batches including their overlap
+            overlap = settings.get("overlap", 0)
+            slice_size = settings["slice_length"] + overlap
+    slice_size = min(slice_size, ring.max_hits)
+    step = max(slice_size - overlap, 1)
+    batches = 0
+    try:
+        for filename in filenames:
+            N,x,y,z,ct = get_real_input_data(filename, raw_times=relative)
+            #the last batch ends at N, any further batch would only hold overlapping hits
+            for shift in range(0, N - overlap if N > overlap else min(N, 1), step):
+                if relative:
+                    xs,ys,zs,cts,base = get_relative_slice(x, y, z, ct, slice_size, shift)
+                    ring.write(xs, ys, zs, cts, timeout=timeout, base=base)
+                else:
+                    ring.write(x[shift:shift+slice_size], y[shift:shift+slice_size],
+                               z[shift:shift+slice_size], ct[shift:shift+slice_size], timeout=timeout)
+                batches += 1
+        ring.close_writer()
+    finally:
+        if attached:
+            ring.close()
+    return batches
+
+
+def start_replay_producer(ring, filenames, slice_size=None, overlap=0, relative=False, use_profile=False):
+    """ start replay_files in a separate producer process
+
+    :param ring: The ring buffer the producer should write into.
+    :type ring: HitRingBuffer
+
+    :returns: The started producer process
+    :rtype: multiprocessing.Process
+    """
+    producer = Process(target=replay_files, args=(ring.name, filenames, slice_size, None, overlap, relative, use_profile))
+    producer.start()
+    return producer
+
+
+def consume(ring, correlator, purger, timeout=None, prefilter=None, times=False):
+    """ run the correlator and purger on all batches in the ring buffer
+
+    The correlator reads the hits directly from shared memory. Each slot is
+    released as soon as the correlator is done with it, before purging, so
+    the producer can refill it while the purger is running.
+
+    Note that the GPU engines in km3net.kernels expect exactly N hits per
+    batch, so the producer should write batches of that size.
+
+    :param ring: The ring buffer to read from.
+    :type ring: HitRingBuffer
+
+    :param correlator: An object with a compute(x, y, z, ct) method that returns
+        col_idx, prefix_sums, degrees, total_correlated_hits.
+    :type correlator: km3net.kernels.CorrelateSparse or km3net.cpu.CorrelateSparse
+
+    :param purger: An object with a compute(col_idx, prefix_sums, degrees) method.
+    :type purger: km3net.kernels.PurgingSparse or km3net.cpu.PurgingSparse
+
+    :param timeout: The maximum time in seconds to wait for each batch.
+    :type timeout: float
+
+    :param prefilter: Optional object with an accept(x, y, z, ct) method, batches that
+        are not accepted skip correlation and purging and yield no clique.
+    :type prefilter: km3net.prefilter.L1Prefilter
+
+    :param times: Also yield the absolute times in nanoseconds of the hits in each clique,
+        decoded from ct and the base time of the batch, see km3net.timebase.decode_times.
+    :type times: bool
+
+    :returns: A generator of the sequence number and the clique indices per batch,
+        followed by the times of the clique hits when times is True.
+    :rtype: generator of tuple(int, list(int))
+    """
+    from km3net.timebase import decode_times
+
+    while True:
+        start = instrument.start()
+        item = ring.read(timeout=timeout)
+        if item is None:
+            return
+        seq, batch = item
+        instrument.set_slice(seq)
+        if start is not None:
+            instrument.report("read", start, hits=len(batch.ct))
+        if prefilter is not None and not prefilter.accept(*batch):
+            ring.release(seq)
+            yield (seq, [], np.zeros(0, dtype=np.int64)) if times else (seq, [])
+            continue
+        col_idx, prefix_sums, degrees, _ = correlator.compute(*batch)
+        if times:
+            #the slot is reused once released, keep what is needed to decode the times
+            base, ct = ring.base(seq), batch.ct.copy()
+        ring.release(seq)
+        cliques = purger.compute(col_idx, prefix_sums, degrees)
+        if times:
+            yield seq, cliques, decode_times(base, ct[np.asarray(cliques, dtype=np.int64)])
+        else:
+            yield seq, cliques
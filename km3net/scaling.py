@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+""" scaling and throughput study of the correlate and purge pipeline
+
+Usage::
+
+    python -m km3net.scaling --sizes 10000 50000 --windows 1500 --factors 2000 500 \\
+        --criteria qd 3b --workers 1 2 4 8 --output scaling.csv
+
+Every grid point runs the end-to-end pipeline of the NumPy engines on synthetic
+slices in a pool of worker processes, and records throughput, peak memory and
+per-slice latency. The slices are generated before the workers start, so the
+measurements do not include generating the input. The peak memory is the largest
+memory allocated while correlating and purging a single slice, traced with
+tracemalloc in a second, untimed pass over the slices, so it excludes the input
+slices and whatever else the worker process holds. In strong scaling mode the total number of slices is fixed,
+in weak scaling mode the number of slices per worker is fixed.
+"""
+from __future__ import print_function
+
+import sys
+import csv
+import time
+import tracemalloc
+import argparse
+import itertools
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+from km3net import util, cpu
+
+CRITERIA = OrderedDict([("qd", cpu.QuadraticDifferenceSparse), ("3b", cpu.Match3BSparse)])
+
+FIELDS = ["mode", "N", "window", "factor", "criterion", "workers", "slices", "wall_time",
+          "hits_per_s", "pairs_per_s", "edges", "peak_memory_mb", "latency_p50", "latency_p99"]
+
+_engines = {}
+
+
+def _init_worker(N, window, criterion, slices):
+    _engines["correlator"] = CRITERIA[criterion](N, window)
+    _engines["purger"] = cpu.PurgingSparse(N)
+    _engines["slices"] = slices
+
+
+def generate_slices(N, factor, slices, seed=0):
+    """ generate the synthetic slices of one grid point, slice i is generated with seed + i
+
+    :rtype: list(tuple(numpy ndarray))
+    """
+    hits = []
+    for i in range(slices):
+        np.random.seed(seed + i)
+        hits.append(util.generate_input_data(N, factor))
+    return hits
+
+
+def _process_slice(index):
+    """ run correlate and purge on one of the slices passed to the worker """
+    hits = _engines["slices"][index]
+    start = time.perf_counter()
+    col_idx, prefix_sums, degrees, total_correlated_hits = _engines["correlator"].compute(*hits)
+    _engines["purger"].compute(col_idx, prefix_sums, degrees)
+    latency = time.perf_counter() - start
+    return latency, int(total_correlated_hits)
+
+
+def _trace_slice(index):
+    """ run correlate and purge on a slice again under tracemalloc and return the peak in MB """
+    hits = _engines["slices"][index]
+    tracemalloc.start()
+    try:
+        col_idx, prefix_sums, degrees, _ = _engines["correlator"].compute(*hits)
+        _engines["purger"].compute(col_idx, prefix_sums, degrees)
+        return tracemalloc.get_traced_memory()[1] / 2.0**20
+    finally:
+        tracemalloc.stop()
+
+
+def pairs_evaluated(N, window):
+    """ the number of hit pairs evaluated by the correlator for a slice of N hits """
+    d = np.arange(1, min(window, N-1)+1)
+    return int(np.sum(N - d))
+
+
+def run_point(N, window, factor, criterion, workers, slices, mode="strong", seed=0):
+    """ run the pipeline for one point in the parameter grid
+
+    :returns: One row with the measurements, with the keys in FIELDS
+    :rtype: dict
+    """
+    #the slices are generated up front and handed to the workers, so the clock only covers the pipeline
+    hits = generate_slices(N, factor, slices, seed)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(N, window, criterion, hits))
+    try:
+        #make sure all workers are up before starting the clock
+        pool.map(time.sleep, [0.01]*workers)
+        start = time.perf_counter()
+        results = pool.map(_process_slice, range(slices), chunksize=1)
+        wall_time = time.perf_counter() - start
+        #memory is traced in a separate pass, so tracing does not slow down the timed pass
+        peak_memory = pool.map(_trace_slice, range(slices), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    latencies = np.array([r[0] for r in results])
+    return OrderedDict([
+        ("mode", mode), ("N", N), ("window", window), ("factor", factor), ("criterion", criterion),
+        ("workers", workers), ("slices", slices), ("wall_time", wall_time),
+        ("hits_per_s", N*slices / wall_time),
+        ("pairs_per_s", pairs_evaluated(N, window)*slices / wall_time),
+        ("edges", sum(r[1] for r in results)),
+        ("peak_memory_mb", max(peak_memory)),
+        ("latency_p50", float(np.percentile(latencies, 50))),
+        ("latency_p99", float(np.percentile(latencies, 99))),
+    ])
+
+
+def sweep(sizes, windows, factors, criteria, workers, slices=16, slices_per_worker=4, modes=("strong", "weak"), verbose=False):
+    """ run the pipeline for every point in the parameter grid
+
+    :param slices: The total number of slices in strong scaling mode.
+    :type slices: int
+
+    :param slices_per_worker: The number of slices per worker in weak scaling mode.
+    :type slices_per_worker: int
+
+    :returns: The rows of measurements, see run_point
+    :rtype: list(dict)
+    """
+    rows = []
+    for mode, N, window, factor, criterion, w in itertools.product(modes, sizes, windows, factors, criteria, workers):
+        n_slices = slices if mode == "strong" else slices_per_worker*w
+        row = run_point(N, window, factor, criterion, w, n_slices, mode)
+        if verbose:
+            print(", ".join("%s=%s" % (k, ("%.4g" % v) if isinstance(v, float) else v) for k, v in row.items()))
+        rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    """ compute strong and weak scaling summaries relative to the smallest worker count
+
+    Strong scaling speedup is the ratio of throughput, the efficiency is the speedup
+    divided by the ratio of workers. Weak scaling efficiency is the ratio of throughput
+    per worker.
+
+    :returns: One row per grid point with the keys mode, N, window, factor, criterion,
+        workers, speedup and efficiency
+    :rtype: list(dict)
+    """
+    summary = []
+    key = lambda r: (r["mode"], r["N"], r["window"], r["factor"], r["criterion"])
+    for group_key, group in itertools.groupby(sorted(rows, key=lambda r: key(r) + (r["workers"],)), key=key):
+        group = list(group)
+        base = group[0]
+        for row in group:
+            speedup = row["hits_per_s"] / base["hits_per_s"]
+            scale = row["workers"] / float(base["workers"])
+            summary.append(OrderedDict(zip(["mode", "N", "window", "factor", "criterion"], group_key),
+                                       workers=row["workers"], speedup=speedup, efficiency=speedup/scale))
+    return summary
+
+
+def write_csv(rows, filename):
+    """ write rows of measurements or summaries to a CSV file """
+    with open(filename, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling study of the correlate and purge pipeline")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000])
+    parser.add_argument("--windows", nargs="+", type=int, default=[1500])
+    parser.add_argument("--factors", nargs="+", type=float, default=[2000.0])
+    parser.add_argument("--criteria", nargs="+", choices=list(CRITERIA), default=["qd"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--slices", type=int, default=16, help="total number of slices for strong scaling")
+    parser.add_argument("--slices-per-worker", type=int, default=4, help="number of slices per worker for weak scaling")
+    parser.add_argument("--modes", nargs="+", choices=["strong", "weak"], default=["strong", "weak"])
+    parser.add_argument("--output", default="scaling.csv")
+    args = parser.parse_args(argv)
+
+    rows = sweep(args.sizes, args.windows, args.factors, args.criteria, args.workers,
+                 args.slices, args.slices_per_worker, args.modes, verbose=True)
+    write_csv(rows, args.output)
+    summary = summarize(rows)
+    write_csv(summary, args.output.replace(".csv", "") + "_summary.csv")
+    for row in summary:
+        print(", ".join("%s=%s" % (k, ("%.3f" % v) if isinstance(v, float) else v) for k, v in row.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
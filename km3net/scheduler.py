@@ -0,0 +1,363 @@
+from __future__ import print_function
+
+import os
+import time
+import queue
+import socket
+import threading
+from collections import deque
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client, deliver_challenge, answer_challenge
+
+import numpy as np
+
+from km3net import instrument
+
+
+class _Worker(object):
+    """ the scheduler side of a connection to a worker """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.last_seen = time.monotonic()
+        self.in_flight = set()
+        self.alive = True
+
+
+def _shutdown(conn):
+    """ shut down and close a connection, closing alone does not wake a thread blocked in recv on it """
+    try:
+        sock = socket.socket(fileno=os.dup(conn.fileno()))
+        sock.shutdown(socket.SHUT_RDWR)
+        sock.close()
+    except OSError:
+        pass
+    try:
+        conn.close()
+    except OSError:
+        pass
+
+
+class SliceScheduler(object):
+    """ farms timeslices out to worker processes and returns the results in time order
+
+    Workers connect to the scheduler over a socket, either a TCP port, so they can
+    run on other hosts, or a Unix socket, and run run_worker(). Every worker gets up
+    to max_in_flight slices at a time. Workers send a heartbeat while they are alive.
+    When the connection to a worker breaks, or no message arrived from it for more than
+    heartbeat_timeout seconds, the worker is dropped and its slices are sent to another
+    worker. Each slice is retried at most max_retries times.
+
+    Results are kept in a reorder buffer until all earlier slices are done, so they
+    come out in the order of the input, every slice exactly once.
+
+    Messages are pickled tuples sent with multiprocessing.connection. Use an authkey
+    when the scheduler listens on a network interface. The authkey handshake runs in
+    the thread of each connection, a client that fails it is disconnected without
+    affecting the other workers.
+    """
+
+    def __init__(self, address=("127.0.0.1", 0), authkey=None, max_in_flight=2, heartbeat_timeout=10.0, max_retries=3):
+        """instantiate SliceScheduler
+
+        :param address: The address to listen on, a (host, port) tuple for TCP or a path for a Unix socket.
+        :type address: tuple or string
+
+        :param authkey: The key that workers need to connect.
+        :type authkey: bytes
+
+        :param max_in_flight: The largest number of slices sent to a worker at the same time.
+        :type max_in_flight: int
+
+        :param heartbeat_timeout: The time in seconds after which a silent worker is dropped.
+        :type heartbeat_timeout: float
+
+        :param max_retries: The number of times a slice is sent again after its worker was lost or failed.
+        :type max_retries: int
+        """
+        #the handshake is done per connection in _receive, so a bad client cannot stop the accept loop
+        self.listener = Listener(address)
+        self.authkey = authkey
+        self.max_in_flight = max_in_flight
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_retries = max_retries
+        self.events = queue.Queue()
+        self.workers = []
+        self.retries = 0
+        self.closed = False
+        self.accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self.accept_thread.start()
+
+    @property
+    def address(self):
+        """ the address workers should connect to """
+        return self.listener.address
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                if self.closed:
+                    return
+                continue
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _receive(self, conn):
+        worker = None
+        try:
+            if self.authkey:
+                deliver_challenge(conn, self.authkey)
+                answer_challenge(conn, self.authkey)
+            while True:
+                message = conn.recv()
+                if worker is None:
+                    if message[0] != "ready":
+                        break
+                    worker = _Worker(conn, message[1])
+                self.events.put((worker, message))
+        except Exception:
+            #a failed handshake, a broken connection or a message that cannot be unpickled ends this connection only
+            pass
+        if worker is not None:
+            self.events.put((worker, None))
+        else:
+            conn.close()
+
+    def _drop(self, worker, pending, attempts):
+        """ forget a worker and requeue its slices at the front of the pending queue """
+        if not worker.alive:
+            return
+        worker.alive = False
+        if worker in self.workers:
+            self.workers.remove(worker)
+        _shutdown(worker.conn)
+        for seq in sorted(worker.in_flight, reverse=True):
+            self._retry(seq, pending, attempts)
+        worker.in_flight.clear()
+
+    def _retry(self, seq, pending, attempts):
+        attempts[seq] += 1
+        if attempts[seq] > self.max_retries:
+            raise RuntimeError("slice %d failed %d times" % (seq, attempts[seq]))
+        self.retries += 1
+        pending.appendleft(seq)
+
+    def run(self, slices):
+        """ process the slices on the connected workers
+
+        Slices are taken from the iterable as workers have room for them, so the
+        input can be a generator of unbounded length.
+
+        :param slices: The slices, each a tuple of x,y,z,ct arrays.
+        :type slices: iterable
+
+        :returns: A generator of the sequence number and the clique indices per slice, in input order
+        :rtype: generator of tuple(int, numpy ndarray)
+        """
+        slices = iter(slices)
+        exhausted = False
+        data = {}
+        attempts = {}
+        pending = deque()
+        done = {}
+        next_seq = 0
+        next_out = 0
+
+        while True:
+            #handle all messages that have arrived
+            events = []
+            try:
+                events.append(self.events.get(timeout=min(self.heartbeat_timeout / 4.0, 0.1)))
+                while True:
+                    events.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+            for worker, message in events:
+                if message is None:
+                    self._drop(worker, pending, attempts)
+                    continue
+                #the slices of a dropped worker are already pending again, ignore what it still sends
+                if not worker.alive:
+                    continue
+                worker.last_seen = time.monotonic()
+                kind = message[0]
+                if kind == "ready":
+                    self.workers.append(worker)
+                elif kind == "result":
+                    seq = message[1]
+                    worker.in_flight.discard(seq)
+                    if seq in data:
+                        done[seq] = message[2]
+                        del data[seq]
+                elif kind == "error":
+                    seq = message[1]
+                    if seq in worker.in_flight:
+                        worker.in_flight.discard(seq)
+                        self._retry(seq, pending, attempts)
+
+            #drop workers that stopped sending heartbeats
+            now = time.monotonic()
+            for worker in list(self.workers):
+                if now - worker.last_seen > self.heartbeat_timeout:
+                    self._drop(worker, pending, attempts)
+
+            #send slices to workers with room for more
+            for worker in sorted(self.workers, key=lambda w: len(w.in_flight)):
+                while worker.alive and len(worker.in_flight) < self.max_in_flight:
+                    if not pending and not exhausted:
+                        try:
+                            data[next_seq] = tuple(np.asarray(c, dtype=np.float32) for c in next(slices))
+                            attempts[next_seq] = 0
+                            pending.append(next_seq)
+                            next_seq += 1
+                        except StopIteration:
+                            exhausted = True
+                    if not pending:
+                        break
+                    seq = pending.popleft()
+                    worker.in_flight.add(seq)
+                    try:
+                        worker.conn.send(("slice", seq) + data[seq])
+                    except (OSError, EOFError):
+                        self._drop(worker, pending, attempts)
+
+            #emit the results in order
+            while next_out in done:
+                start_time = instrument.start()
+                result = done.pop(next_out)
+                if start_time is not None:
+                    instrument.report("schedule", start_time, slices=1, in_flight=len(data), reorder_buffer=len(done),
+                                      workers=len(self.workers))
+                yield next_out, result
+                next_out += 1
+
+            if exhausted and not data and not done:
+                return
+
+    def close(self):
+        """ stop all workers and close the listening socket """
+        self.closed = True
+        for worker in self.workers:
+            try:
+                worker.conn.send(("stop",))
+                worker.conn.close()
+            except (OSError, EOFError):
+                pass
+        self.workers = []
+        self.listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def run_worker(address, authkey=None, backend="cpu", criterion="QuadraticDifferenceSparse", window=1500, threshold=3,
+               heartbeat_interval=1.0, name=None, cc=None):
+    """ connect to a SliceScheduler and correlate and purge the slices it sends
+
+    The engines are taken from the backend, see km3net.backends, and created once for
+    every slice size, since the GPU engines are built for a fixed number of hits.
+    The "cuda" backend creates a PyCuda context on the first device of the worker.
+    Returns when the scheduler sends a stop message or closes the connection.
+
+    :param address: The address of the scheduler.
+    :type address: tuple or string
+
+    :param backend: The name of the backend.
+    :type backend: string
+
+    :param criterion: The name of the correlator class in the backend.
+    :type criterion: string
+
+    :param threshold: The minimum degree of nodes that count towards the clique, see PurgingSparse.
+    :type threshold: int
+
+    :param heartbeat_interval: The time in seconds between heartbeats.
+    :type heartbeat_interval: float
+
+    :param cc: The compute capability the "cuda" engines are built for, by default that of the device.
+    :type cc: string
+    """
+    from km3net.backends import get_backend
+
+    module = get_backend(backend)
+    engines = {}
+    #the backends differ in their other positional arguments, so everything else is passed by keyword
+    device_args = {}
+    context = None
+    if backend == "cuda":
+        from km3net.util import init_pycuda
+        context, device_cc = init_pycuda()
+        device_args["cc"] = cc or device_cc
+    conn = Client(address, authkey=authkey)
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def send(message):
+        with lock:
+            conn.send(message)
+
+    def heartbeat():
+        while not stop.wait(heartbeat_interval):
+            try:
+                send(("heartbeat",))
+            except (OSError, EOFError):
+                return
+
+    send(("ready", name or "%s:%d" % (socket.gethostname(), os.getpid())))
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            if message[0] == "stop":
+                break
+            seq, x, y, z, ct = message[1:]
+            try:
+                n = len(ct)
+                if n not in engines:
+                    engines[n] = (getattr(module, criterion)(n, sliding_window_width=window, **device_args),
+                                  module.PurgingSparse(n, threshold=threshold, **device_args))
+                correlator, purger = engines[n]
+                col_idx, prefix_sums, degrees, _ = correlator.compute(x, y, z, ct)
+                result = np.asarray(purger.compute(col_idx, prefix_sums, degrees), dtype=np.int32)
+                send(("result", seq, result))
+            except (OSError, EOFError):
+                break
+            except Exception as error:
+                send(("error", seq, repr(error)))
+    finally:
+        stop.set()
+        conn.close()
+        if context is not None:
+            context.pop()
+
+
+def start_local_workers(scheduler, count, **kwargs):
+    """ start workers in local processes for a scheduler
+
+    :param scheduler: The scheduler the workers connect to.
+    :type scheduler: SliceScheduler
+
+    :param count: The number of worker processes.
+    :type count: int
+
+    :param kwargs: Passed on to run_worker, the authkey of the scheduler is used by default.
+
+    :returns: The started processes
+    :rtype: list(multiprocessing.Process)
+    """
+    kwargs.setdefault("authkey", scheduler.authkey)
+    processes = []
+    for _ in range(count):
+        process = Process(target=run_worker, args=(scheduler.address,), kwargs=kwargs, daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
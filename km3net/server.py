@@ -0,0 +1,260 @@
+from __future__ import print_function
+
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from km3net import instrument
+from km3net.ringbuffer import HitBatch
+
+#every frame starts with the sequence number, the number of elements that follow and the base time of the batch
+_FRAME_HEADER = struct.Struct("<QIq")
+
+
+def pack_hits(seq, x, y, z, ct, base=0):
+    """ pack a batch of hits into a binary frame
+
+    The frame consists of a little-endian uint64 sequence number, a uint32 number
+    of hits n, an int64 base time in nanoseconds that ct is relative to, see
+    km3net.timebase, followed by n float32 values for x, y, z and ct respectively.
+
+    :returns: The frame
+    :rtype: bytes
+    """
+    columns = np.array([x, y, z, ct], dtype='<f4')
+    return _FRAME_HEADER.pack(seq, columns.shape[1], base) + columns.tobytes()
+
+
+def pack_result(seq, indices, base=0):
+    """ pack the clique indices found for a batch into a binary frame
+
+    The frame consists of a little-endian uint64 sequence number, a uint32 number
+    of indices n, the int64 base time of the batch, followed by n int32 indices.
+
+    :returns: The frame
+    :rtype: bytes
+    """
+    indices = np.asarray(indices, dtype='<i4')
+    return _FRAME_HEADER.pack(seq, indices.size, base) + indices.tobytes()
+
+
+async def read_hits(reader, max_hits=None):
+    """ read a frame packed by pack_hits from a stream
+
+    :param max_hits: The largest number of hits accepted in a frame, by default any number.
+        The payload of a larger frame is not read.
+    :type max_hits: int
+
+    :returns: The sequence number, a HitBatch and the base time, or None at the end of the stream
+    :rtype: tuple(int, HitBatch, int) or None
+    """
+    try:
+        seq, n, base = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    except asyncio.IncompleteReadError:
+        return None
+    if max_hits is not None and n > max_hits:
+        raise ValueError("Frame %d holds %d hits, at most %d are accepted" % (seq, n, max_hits))
+    payload = await reader.readexactly(16*n)
+    columns = np.frombuffer(payload, dtype='<f4').reshape(4, n).astype(np.float32, copy=False)
+    return seq, HitBatch(*columns), base
+
+
+async def read_result(reader):
+    """ read a frame packed by pack_result from a stream
+
+    :returns: The sequence number, an array of indices and the base time of the batch,
+        or None at the end of the stream
+    :rtype: tuple(int, numpy ndarray, int) or None
+    """
+    try:
+        seq, n, base = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    except asyncio.IncompleteReadError:
+        return None
+    payload = await reader.readexactly(4*n)
+    return seq, np.frombuffer(payload, dtype='<i4').astype(np.int32), base
+
+
+class CorrelationServer(object):
+    """ asyncio service that runs the correlation pipeline on hits received over a socket
+
+    Each connection is handled by a pipeline of stages connected by bounded queues:
+    receiving frames, correlating, purging and sending the results back on the same
+    connection. Correlating and purging each run in their own worker thread so both
+    can be busy at the same time. The base time of each batch is passed along and
+    returned with its result, so the client can recover the absolute times of the hits. When a queue is full the stage in front of it waits,
+    which eventually stops the server from reading the socket and pushes the backpressure
+    through to the client. A frame with more than max_hits hits is rejected and its
+    connection is closed.
+    """
+
+    def __init__(self, correlator, purger, max_queue=4, prefilter=None, max_hits=None):
+        """instantiate CorrelationServer
+
+        :param correlator: An object with a compute(x, y, z, ct) method that returns
+            col_idx, prefix_sums, degrees, total_correlated_hits.
+        :type correlator: km3net.kernels.CorrelateSparse or km3net.cpu.CorrelateSparse
+
+        :param purger: An object with a compute(col_idx, prefix_sums, degrees) method.
+        :type purger: km3net.kernels.PurgingSparse or km3net.cpu.PurgingSparse
+
+        :param max_queue: The maximum number of batches waiting in front of each stage.
+        :type max_queue: int
+
+        :param prefilter: Optional object with an accept(x, y, z, ct) method, batches that
+            are not accepted skip correlation and purging and get an empty result.
+        :type prefilter: km3net.prefilter.L1Prefilter
+
+        :param max_hits: The largest number of hits accepted in a frame, by default N of the correlator.
+        :type max_hits: int
+        """
+        self.correlator = correlator
+        self.purger = purger
+        self.prefilter = prefilter
+        self.max_queue = max_queue
+        self.max_hits = int(correlator.N) if max_hits is None else max_hits
+        self.correlate_executor = ThreadPoolExecutor(max_workers=1)
+        self.purge_executor = ThreadPoolExecutor(max_workers=1)
+
+    def correlate(self, batch):
+        if self.prefilter is not None and not self.prefilter.accept(*batch):
+            return None
+        col_idx, prefix_sums, degrees, _ = self.correlator.compute(*batch)
+        return col_idx, prefix_sums, degrees
+
+    def purge(self, graph):
+        if graph is None:
+            return []
+        return self.purger.compute(*graph)
+
+    @staticmethod
+    def _run(func, seq, data):
+        #runs in the executor thread, so the slice is set for the engines' instrumentation
+        instrument.set_slice(seq)
+        try:
+            return func(data)
+        finally:
+            instrument.set_slice(None)
+
+    async def handle(self, reader, writer):
+        """ handle a single connection until the client closes its side of the stream """
+        loop = asyncio.get_running_loop()
+        correlate_queue = asyncio.Queue(self.max_queue)
+        purge_queue = asyncio.Queue(self.max_queue)
+        send_queue = asyncio.Queue(self.max_queue)
+
+        async def receive():
+            while True:
+                start = instrument.start()
+                try:
+                    item = await read_hits(reader, self.max_hits)
+                except ValueError:
+                    #stop reading, the connection is closed once the earlier batches are answered
+                    item = None
+                if item is not None and start is not None:
+                    instrument.report("receive", start, hits=len(item[1].ct))
+                await correlate_queue.put(item)
+                if item is None:
+                    return
+
+        async def stage(executor, func, queue_in, queue_out):
+            while True:
+                item = await queue_in.get()
+                if item is not None:
+                    seq, data, base = item
+                    item = seq, await loop.run_in_executor(executor, self._run, func, seq, data), base
+                await queue_out.put(item)
+                if item is None:
+                    return
+
+        async def send():
+            while True:
+                item = await send_queue.get()
+                if item is None:
+                    return
+                writer.write(pack_result(*item))
+                await writer.drain()
+
+        try:
+            await asyncio.gather(receive(),
+                                 stage(self.correlate_executor, self.correlate, correlate_queue, purge_queue),
+                                 stage(self.purge_executor, self.purge, purge_queue, send_queue),
+                                 send())
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """ start listening on a TCP port, or on a Unix socket when path is given
+
+        :returns: The asyncio server
+        :rtype: asyncio.Server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path=path)
+        return await asyncio.start_server(self.handle, host=host, port=port)
+
+    def serve_forever(self, host="127.0.0.1", port=0, path=None):
+        """ run the server until interrupted """
+        async def main():
+            server = await self.start(host, port, path)
+            async with server:
+                await server.serve_forever()
+        asyncio.run(main())
+
+
+async def replay_client(filenames, slice_size, host="127.0.0.1", port=None, path=None, relative=False):
+    """ local client that replays hits from files to a CorrelationServer
+
+    Reads each file using km3net.util.get_real_input_data and sends the hits to
+    the server in slices of slice_size hits, while concurrently receiving the results.
+
+    :param filenames: The files to replay.
+    :type filenames: list(string)
+
+    :param slice_size: The number of hits per batch.
+    :type slice_size: int
+
+    :param relative: Send ct relative to the first hit of each batch, together with the
+        base time of the batch, see km3net.timebase. The server only uses differences in ct,
+        so the results do not change, but long runs keep their precision in float32.
+    :type relative: bool
+
+    :returns: The sequence number, clique indices and base time for each batch, the
+        absolute times of the clique hits are decode_times(base, ct[indices])
+    :rtype: list(tuple(int, numpy ndarray, int))
+    """
+    from km3net.util import get_real_input_data, get_relative_slice
+
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    async def send():
+        seq = 0
+        for filename in filenames:
+            N,x,y,z,ct = get_real_input_data(filename, raw_times=relative)
+            for shift in range(0, N, slice_size):
+                if relative:
+                    writer.write(pack_hits(seq, *get_relative_slice(x, y, z, ct, slice_size, shift)))
+                else:
+                    writer.write(pack_hits(seq, x[shift:shift+slice_size], y[shift:shift+slice_size],
+                                           z[shift:shift+slice_size], ct[shift:shift+slice_size]))
+                await writer.drain()
+                seq += 1
+        writer.write_eof()
+
+    async def receive():
+        results = []
+        while True:
+            item = await read_result(reader)
+            if item is None:
+                return results
+            results.append(item)
+
+    try:
+        _, results = await asyncio.gather(send(), receive())
+    finally:
+        writer.close()
+    return results
@@ -0,0 +1,122 @@
+from __future__ import print_function
+
+import numpy as np
+
+from km3net import instrument
+from km3net.ringbuffer import HitBatch
+
+
+class StreamMerger(object):
+    """ merge the time-sorted hit streams of many modules into one time-sorted stream
+
+    Every module delivers frames of hits sorted on ct, in order per module, but the
+    frames of different modules arrive in any order. The merger buffers the frames and
+    releases hits up to a watermark: the earliest ct up to which every module has
+    delivered its hits, minus an allowed lateness. Releasing a block takes one cut per
+    module by binary search and one stable sort of the concatenated runs, which merges
+    the k sorted runs in O(n log k), instead of one heap operation per hit.
+
+    The buffer is bounded: when it holds more than max_buffered hits, the watermark is
+    taken over the modules that have buffered hits only, so a silent module cannot
+    stall the stream. Hits that arrive below the released watermark can no longer be
+    placed in order and are dropped, they are counted in late_hits.
+    """
+
+    def __init__(self, modules, lateness=0.0, max_buffered=1000000):
+        """instantiate StreamMerger
+
+        :param modules: The ids of all modules that deliver frames.
+        :type modules: list(int)
+
+        :param lateness: How far behind the watermark, in the unit of ct, hits are held
+            back to give late frames of other modules a chance to arrive.
+        :type lateness: float
+
+        :param max_buffered: The largest number of hits kept in the buffer.
+        :type max_buffered: int
+        """
+        self.modules = list(modules)
+        self.lateness = lateness
+        self.max_buffered = max_buffered
+        self.frames = {m: [] for m in self.modules}
+        self.latest = {m: -np.inf for m in self.modules}
+        self.buffered = 0
+        self.released = -np.inf
+        self.late_hits = 0
+
+    def push(self, module, x, y, z, ct):
+        """ add a frame of hits from a module and return the hits that can be released
+
+        :param module: The id of the module.
+        :type module: int
+
+        :returns: The released hits sorted on ct, and the module of every hit
+        :rtype: tuple(HitBatch, numpy ndarray)
+        """
+        ct = np.asarray(ct)
+        columns = [np.asarray(x), np.asarray(y), np.asarray(z), ct]
+        #hits below the released watermark can no longer be merged in order
+        first = int(np.searchsorted(ct, self.released, "right"))
+        if first > 0:
+            self.late_hits += first
+            columns = [c[first:] for c in columns]
+        if columns[3].size > 0:
+            self.frames[module].append(columns)
+            self.buffered += columns[3].size
+            self.latest[module] = max(self.latest[module], float(columns[3][-1]))
+        return self.pop()
+
+    def watermark(self):
+        """ return the ct up to which hits can be released """
+        latest = [self.latest[m] for m in self.modules]
+        if self.buffered > self.max_buffered:
+            latest = [self.latest[m] for m in self.modules if self.frames[m]]
+        return min(latest) - self.lateness if latest else -np.inf
+
+    def pop(self, until=None):
+        """ release the buffered hits up to the watermark, or up to until when given
+
+        :rtype: tuple(HitBatch, numpy ndarray)
+        """
+        start_time = instrument.start()
+        until = self.watermark() if until is None else until
+        blocks = []
+        for module in self.modules:
+            frames = self.frames[module]
+            if not frames or frames[0][3][0] > until:
+                continue
+            #the frames of a module are in order, whole frames are taken up to the one that holds the cut
+            count = 0
+            while count < len(frames) and frames[count][3][-1] <= until:
+                count += 1
+            taken = frames[:count]
+            if count < len(frames):
+                cut = int(np.searchsorted(frames[count][3], until, "right"))
+                if cut > 0:
+                    taken.append([c[:cut] for c in frames[count]])
+                    frames[count] = [c[cut:] for c in frames[count]]
+            del frames[:count]
+            columns = [np.concatenate([f[k] for f in taken]) if len(taken) > 1 else taken[0][k] for k in range(4)]
+            blocks.append((module, columns))
+            self.buffered -= columns[3].size
+
+        if not blocks:
+            empty = np.zeros(0, dtype=np.float32)
+            return HitBatch(empty, empty, empty, empty), np.zeros(0, dtype=np.int64)
+
+        self.released = max(self.released, until)
+        columns = [np.concatenate([b[1][k] for b in blocks]) for k in range(4)]
+        module = np.repeat([b[0] for b in blocks], [b[1][3].size for b in blocks])
+        #the blocks are sorted runs, which a stable sort merges in O(n log k)
+        order = np.argsort(columns[3], kind="stable")
+        if start_time is not None:
+            instrument.report("merge", start_time, hits=order.size, runs=len(blocks), buffered=self.buffered,
+                              late_hits=self.late_hits)
+        return HitBatch(*[c[order] for c in columns]), module[order]
+
+    def flush(self):
+        """ release all buffered hits
+
+        :rtype: tuple(HitBatch, numpy ndarray)
+        """
+        return self.pop(np.inf)
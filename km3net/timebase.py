@@ -0,0 +1,75 @@
+from __future__ import print_function
+
+import numpy as np
+
+from km3net.cpu import speed_of_light
+
+
+def encode_times(t, base=None, offset=None):
+    """ encode absolute hit times as an exact int64 base plus float32 ct relative to the base
+
+    Absolute times in nanoseconds quickly grow beyond the range in which float32 can
+    resolve a fraction of a meter in ct, 2**24 ns is only 17 ms. The criteria only
+    use differences in ct within a slice, so each slice can instead keep its own base
+    time as an exact integer and the compact float32 ct of its hits relative to it.
+    The offsets are computed in float64 before they are rounded to float32.
+
+    :param t: The times of the hits in nanoseconds, sorted in ascending order.
+    :type t: numpy ndarray of an integer type or numpy.float64
+
+    :param base: The base time in nanoseconds, by default the time of the first hit rounded down.
+    :type base: int
+
+    :param offset: Optional correction of every hit in nanoseconds, such as the time
+        calibration, added to the times before they are rounded to float32.
+    :type offset: numpy ndarray
+
+    :returns: The base time in nanoseconds and ct relative to it in meters
+    :rtype: tuple(numpy.int64, numpy ndarray of type numpy.float32)
+    """
+    t = np.asarray(t)
+    if base is None:
+        base = int(np.floor(t[0])) if t.size else 0
+    base = np.int64(base)
+    if np.issubdtype(t.dtype, np.integer):
+        offsets = (t - base).astype(np.float64)
+    else:
+        offsets = t.astype(np.float64) - float(base)
+    if offset is not None:
+        offsets += offset
+    return base, (offsets * speed_of_light).astype(np.float32)
+
+
+def decode_times(base, ct):
+    """ return the absolute times in nanoseconds of hits encoded by encode_times
+
+    :param base: The base time in nanoseconds.
+    :type base: int
+
+    :param ct: The ct values relative to the base in meters.
+    :type ct: numpy ndarray
+
+    :returns: The times in nanoseconds, rounded to whole nanoseconds
+    :rtype: numpy ndarray of type numpy.int64
+    """
+    offsets = np.asarray(ct, dtype=np.float64) / speed_of_light
+    return np.int64(base) + np.rint(offsets).astype(np.int64)
+
+
+def rebase(base, ct, new_base):
+    """ express ct values relative to another base time
+
+    :param base: The current base time in nanoseconds.
+    :type base: int
+
+    :param ct: The ct values relative to base in meters.
+    :type ct: numpy ndarray
+
+    :param new_base: The new base time in nanoseconds.
+    :type new_base: int
+
+    :returns: The ct values relative to new_base
+    :rtype: numpy ndarray of type numpy.float32
+    """
+    shift = float(np.int64(base) - np.int64(new_base)) * speed_of_light
+    return (np.asarray(ct, dtype=np.float64) + shift).astype(np.float32)
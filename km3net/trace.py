@@ -0,0 +1,83 @@
+from __future__ import print_function
+
+import os
+import json
+import time
+import threading
+
+from km3net import instrument
+
+
+class Tracer(object):
+    """ hook that records the pipeline stages as a timeline in Chrome trace-event format
+
+    Every report from a stage becomes a complete ("X") event on the timeline of the
+    process and thread it ran in, with the counters of the stage and the slice set
+    by instrument.set_slice as arguments. The resulting JSON file can be loaded in
+    chrome://tracing or https://ui.perfetto.dev to see where the stages overlap and
+    where they wait on each other.
+
+    Register an instance with km3net.instrument.register_hook, or use it as a
+    context manager to trace only a with block.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self.threads = {}
+
+    def _tid(self):
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads[thread.ident] = thread.name
+        return thread.ident
+
+    def __call__(self, stage, counters):
+        end = time.perf_counter()
+        args = dict(counters)
+        seq = instrument.current_slice()
+        if seq is not None:
+            args["slice"] = seq
+        self.events.append({"name": stage, "cat": "km3net", "ph": "X",
+                            "ts": (end - counters["time"]) * 1e6, "dur": counters["time"] * 1e6,
+                            "pid": self.pid, "tid": self._tid(), "args": args})
+
+    def __enter__(self):
+        instrument.register_hook(self)
+        return self
+
+    def __exit__(self, *args):
+        instrument.unregister_hook(self)
+
+    def trace_events(self):
+        """ return the recorded events, including metadata events that name the threads
+
+        :rtype: list(dict)
+        """
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                     "args": {"name": "km3net " + str(self.pid)}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in self.threads.items()]
+        return metadata + list(self.events)
+
+    def write(self, filename):
+        """ write the timeline to a JSON file in Chrome trace-event format """
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+
+
+def merge(filenames, output):
+    """ merge the trace files written by several processes into a single timeline
+
+    :param filenames: The trace files to merge.
+    :type filenames: list(string)
+
+    :param output: The file to write the merged timeline to.
+    :type output: string
+    """
+    events = []
+    for filename in filenames:
+        with open(filename) as f:
+            events += json.load(f)["traceEvents"]
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -1,12 +1,11 @@
 from __future__ import print_function
 import os
-import pandas
 import numpy as np
-from scipy.sparse import csr_matrix
-import scipy.constants
-from kernel_tuner import run_kernel
 
-import pycuda.driver as drv
+from km3net import instrument
+
+#pandas, scipy, kernel_tuner and pycuda are only imported by the functions
+#that need them, so that the pure NumPy helpers can be used without them
 
 def get_kernel_path():
     """ function that returns the location of the CUDA kernels on disk
@@ -47,12 +46,35 @@ def get_slice(x_all, y_all, z_all, ct_all, N, shift):
     ct  = ct_all[shift:shift+N]
     return x,y,z,ct
 
+def get_relative_slice(x_all, y_all, z_all, t_all, N, shift):
+    """ return a smaller slice of the whole timeslice with ct relative to the first hit
+
+    :param t_all: The times of the hits in nanoseconds for the whole timeslice,
+        as returned by get_real_input_data with raw_times=True
+    :type t_all: numpy ndarray of an integer type or numpy.float64
+
+    :param N: The number of hits that this smaller slice should contain
+    :type N: int
+
+    :param shift: The offset into the whole timeslice where this slice should start
+    :type shift: int
+
+    :returns: x,y,z,ct for the smaller slice, with ct relative to the base time, and the
+        base time of the slice in nanoseconds, see km3net.timebase.encode_times
+    :rtype: tuple(numpy ndarray of type numpy.float32, numpy.int64)
+    """
+    from km3net.timebase import encode_times
+    x,y,z,t = get_slice(x_all, y_all, z_all, t_all, N, shift)
+    base, ct = encode_times(t)
+    return x,y,z,ct,base
+
 def init_pycuda():
     """ helper func to init PyCuda
 
     :returns: The PyCuda context and a string containing the major and minor compute capability for the device
     :rtype: pycuda.driver.Context, string
     """
+    import pycuda.driver as drv
     drv.init()
     context = drv.Device(0).make_context()
     devprops = { str(k): v for (k, v) in context.get_device().get_attributes().items() }
@@ -70,6 +92,7 @@ def allocate_and_copy(arg):
     :returns: A PyCuda device allocation that represents the GPU memory allocation
     :rtype: pycuda.driver.DeviceAllocation
     """
+    import pycuda.driver as drv
     gpu_arg = drv.mem_alloc(arg.nbytes)
     drv.memcpy_htod(gpu_arg, arg)
     return gpu_arg
@@ -131,6 +154,8 @@ def generate_large_correlations_table(N, sliding_window_width):
     :rtype: numpy ndarray of type numpy.uint8, a numpy array of type numpy.int32
 
     """
+    from kernel_tuner import run_kernel
+
     #generating a very large correlations table takes hours on the CPU
     #reconstruct input data on the GPU
     x,y,z,ct = generate_input_data(N)
@@ -177,6 +202,8 @@ def create_sparse_matrix(correlations, sums):
 
     :rtype: numpy ndarray of type numpy.int32
     """
+    from kernel_tuner import run_kernel
+
     N = np.int32(correlations.shape[0])
     prefix_sums = np.cumsum(sums).astype(np.int32)
     total_correlated_hits = np.sum(sums.sum())
@@ -230,6 +257,7 @@ def memcpy_dtoh(d_x, N, dtype):
     :rtype: numpy.ndarray
 
     """
+    import pycuda.driver as drv
     temp = np.zeros(N, dtype=dtype)
     drv.memcpy_dtoh(temp, d_x)
     return temp
@@ -266,9 +294,9 @@ def sparse_to_dense(prefix_sums, col_idx, N=None, hits=None):
     :returns: A full densely stored correlation matrix of size N by N.
     :rtype: numpy ndarray
     """
-    if isinstance(prefix_sums, drv.DeviceAllocation):
+    if not isinstance(prefix_sums, np.ndarray):
         prefix_sums = memcpy_dtoh(prefix_sums, N, np.int32)
-    if isinstance(col_idx, drv.DeviceAllocation):
+    if not isinstance(col_idx, np.ndarray):
         col_idx = memcpy_dtoh(col_idx, hits, np.int32)
 
     N = np.int32(prefix_sums.size)
@@ -298,7 +326,7 @@ def dense_to_sparse(dense_matrix):
     """
     degrees = np.sum(dense_matrix, axis=1)
     prefix_sum = np.cumsum(degrees)
-    col_idx = csr_matrix(dense_matrix).nonzero()[1]
+    col_idx = np.nonzero(dense_matrix)[1]
     return col_idx, prefix_sum, degrees
 
 def generate_input_data(N, factor=2000.0):
@@ -328,7 +356,7 @@ def generate_input_data(N, factor=2000.0):
     return x,y,z,ct
 
 
-def get_real_input_data(filename):
+def get_real_input_data(filename, raw_times=False):
     """ Read input data from disk
 
     Read a timeslice of input data from a file stored on disk.
@@ -343,19 +371,32 @@ def get_real_input_data(filename):
     This routine also multiplies the time values with the speed of light.
     These values are therefore called ct and are stored in meters.
 
+    Absolute times lose precision in float32, use raw_times=True to obtain the
+    times as they are stored, and encode each slice relative to its own base time,
+    see get_relative_slice and km3net.timebase.
+
     :param filename: The path and the filename of the file that contains the input data.
     :type filename: string
 
+    :param raw_times: Return the times in nanoseconds, as int64 or float64, instead of ct.
+    :type raw_times: bool
+
     :returns: N,x,y,z,ct. N is the number of hits that were retrieved from the file.
             x,y,z are the coordinates of the hit in meters and ct the time multiplied
             by the speed of light, also in meters.
     :rtype: tuple(int, numpy ndarray of type numpy.float32)
     """
+    import pandas
+    from km3net.timebase import encode_times
+
+    start_time = instrument.start()
     data = pandas.read_csv(filename, sep=' ', header=None)
 
-    t = np.array(data[0]).astype(np.float32)
-    t = t / 1e9 # convert from nano seconds to seconds
-    ct = t * scipy.constants.c
+    #keep the times in int64 or float64 until they are converted to ct
+    t = np.array(data[0])
+    if not np.issubdtype(t.dtype, np.integer):
+        t = t.astype(np.float64)
+    ct = t if raw_times else encode_times(t, base=0)[1]
 
     #x,y,z positions of the hits, assuming these are in meters
     x = np.array(data[1]).astype(np.float32)
@@ -363,6 +404,9 @@ def get_real_input_data(filename):
     z = np.array(data[3]).astype(np.float32)
 
     N = np.int32(x.size)
+    if start_time is not None:
+        instrument.record_arrays(dataframe=int(data.memory_usage(deep=True).sum()), x=x, y=y, z=z, ct=ct)
+        instrument.report("ingest", start_time, hits=int(N), bytes_read=os.path.getsize(filename))
     return N,x,y,z,ct
 
 
@@ -516,7 +560,7 @@ def insert_clique(dense_matrix, sliding_window_width=1500, clique_size=10):
     :rtype: tuple(numpy.ndarray, list, int)
     """
     #generate clique indices at most sliding_window_width apart
-    clique_indices = sorted((np.random.rand(clique_size) * float(sliding_window_width)).astype(np.int))
+    clique_indices = np.sort((np.random.rand(clique_size) * float(sliding_window_width)).astype(int))
     #shift it to somewhere in the middle
     clique_indices += sliding_window_width
     clique_indices = np.unique(clique_indices)
@@ -539,6 +583,7 @@ def ready_input(arg):
     :returns: The array in GPU memory
     :rtype: pycuda.driver.DeviceAllocation
     """
+    import pycuda.driver as drv
     if isinstance(arg, np.ndarray):
         return allocate_and_copy(arg)
     elif isinstance(arg, drv.DeviceAllocation):
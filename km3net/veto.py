@@ -0,0 +1,123 @@
+from __future__ import print_function
+
+import numpy as np
+
+from km3net import instrument
+from km3net.cpu import speed_of_light
+from km3net.ringbuffer import HitBatch
+
+
+class ChannelRateMonitor(object):
+    """ streaming per-channel hit rates with a veto on noisy channels
+
+    The rate of every channel is an exponentially decaying average over the batches
+    of hits, updated with a single bincount per batch. A channel is vetoed once its
+    rate exceeds max_rate, and released again when its rate drops below release_rate.
+    In "veto" mode all hits on vetoed channels are removed, in "downsample" mode the
+    hits of a vetoed channel are kept with probability max_rate over its rate, so the
+    channel contributes about max_rate hits per second.
+
+    A few channels far above the normal rate add pairs with every hit in the sliding
+    window, removing them before correlation keeps the number of pairs in check.
+    """
+
+    def __init__(self, num_channels, max_rate=20e3, release_rate=None, time_constant=0.1, mode="veto", seed=None):
+        """instantiate ChannelRateMonitor
+
+        :param num_channels: The number of channels, channel ids run from 0 to num_channels-1.
+        :type num_channels: int
+
+        :param max_rate: The rate in Hz above which a channel is vetoed.
+        :type max_rate: float
+
+        :param release_rate: The rate in Hz below which a vetoed channel is released, by default 0.8*max_rate.
+        :type release_rate: float
+
+        :param time_constant: The time in seconds over which the rates are averaged.
+        :type time_constant: float
+
+        :param mode: Either "veto" to remove the hits on vetoed channels, or "downsample".
+        :type mode: string
+
+        :param seed: The seed of the random generator used for downsampling.
+        :type seed: int
+        """
+        if mode not in ("veto", "downsample"):
+            raise ValueError("Unknown mode " + str(mode) + ", use veto or downsample")
+        self.num_channels = num_channels
+        self.max_rate = max_rate
+        self.release_rate = 0.8*max_rate if release_rate is None else release_rate
+        self.time_constant = time_constant
+        self.mode = mode
+        self.random = np.random.RandomState(seed)
+        self.rates = np.zeros(num_channels, dtype=np.float64)
+        self.vetoed = np.zeros(num_channels, dtype=bool)
+        self.elapsed = 0.0
+
+    @property
+    def veto_list(self):
+        """ the ids of the channels that are currently vetoed """
+        return np.flatnonzero(self.vetoed)
+
+    def update(self, channel, duration):
+        """ update the rates and the veto with a batch of hits
+
+        :param channel: The channel of every hit in the batch.
+        :type channel: numpy ndarray of an integer type
+
+        :param duration: The time covered by the batch in seconds.
+        :type duration: float
+        """
+        channel = np.asarray(channel)
+        unknown = (channel < 0) | (channel >= self.num_channels)
+        if np.any(unknown):
+            raise ValueError("Channel " + str(channel[np.argmax(unknown)]) + " is not monitored, channel ids run from 0 to "
+                             + str(self.num_channels-1))
+        counts = np.bincount(channel, minlength=self.num_channels)
+        if duration <= 0:
+            return
+        batch_rates = counts / duration
+        if self.elapsed == 0.0:
+            self.rates[:] = batch_rates
+        else:
+            decay = np.exp(-duration / self.time_constant)
+            self.rates *= decay
+            self.rates += (1.0 - decay) * batch_rates
+        self.elapsed += duration
+        self.vetoed = np.where(self.vetoed, self.rates >= self.release_rate, self.rates > self.max_rate)
+
+    def mask(self, channel):
+        """ return which hits pass the veto
+
+        :rtype: numpy ndarray of type bool
+        """
+        if self.mode == "veto":
+            return ~self.vetoed[channel]
+        keep = np.ones(self.num_channels, dtype=np.float64)
+        keep[self.vetoed] = self.max_rate / self.rates[self.vetoed]
+        return self.random.random_sample(channel.size) < keep[channel]
+
+    def filter(self, x, y, z, ct, channel, duration=None):
+        """ update the rates with a batch of hits and remove the hits on vetoed channels
+
+        :param channel: The channel of every hit.
+        :type channel: numpy ndarray of an integer type
+
+        :param duration: The time covered by the batch in seconds, by default the time
+            between the first and last hit, computed from ct.
+        :type duration: float
+
+        :returns: The hits that pass the veto, and their channels
+        :rtype: tuple(HitBatch, numpy ndarray)
+        """
+        start_time = instrument.start()
+        channel = np.asarray(channel)
+        if duration is None:
+            duration = float(ct[-1] - ct[0]) / speed_of_light * 1e-9 if ct.size > 1 else 0.0
+        self.update(channel, duration)
+        keep = self.mask(channel)
+        result = HitBatch(x[keep], y[keep], z[keep], ct[keep]), channel[keep]
+        if start_time is not None:
+            instrument.report("veto", start_time, hits=ct.size, removed_hits=int(ct.size - keep.sum()),
+                              vetoed_channels=int(self.vetoed.sum()))
+        return result
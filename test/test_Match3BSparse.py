@@ -1,14 +1,14 @@
-import pycuda.driver as drv
 import numpy as np
 
 from scipy.sparse import csr_matrix
-from km3net.kernels import Match3BSparse
 import km3net.util as util
 
 from .context import create_plot, skip_if_no_cuda_device
 
 def test_Match3BSparse():
     skip_if_no_cuda_device()
+    import pycuda.driver as drv
+    from km3net.kernels import Match3BSparse
 
     N = 500
     window_width = 150
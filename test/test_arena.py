@@ -0,0 +1,71 @@
+import numpy as np
+
+from km3net.arena import BufferArena
+from km3net.cpu import QuadraticDifferenceSparse, PurgingSparse
+import km3net.util as util
+
+def test_get_grows_buffers():
+    arena = BufferArena(growth=2.0, min_size=4)
+
+    a = arena.get("a", 3, np.int32)
+    assert a.size == 3 and a.dtype == np.int32
+    assert arena.allocations == 1
+    assert arena.nbytes == 16
+
+    b = arena.get("a", 4, np.int32)
+    assert arena.allocations == 1
+    assert np.shares_memory(a, b)
+
+    c = arena.get("a", 5, np.int32)
+    assert c.size == 5
+    assert arena.allocations == 2
+    assert arena.nbytes == 32
+
+    arena.get("a", 2, np.float64)
+    assert arena.allocations == 2
+    assert arena.high_water_marks() == {"a": 20}
+
+    assert all(arena.zeros("b", 10, np.int64) == 0)
+
+def test_no_reuse():
+    arena = BufferArena(reuse=False)
+    a = arena.get("a", 10, np.int32)
+    b = arena.get("a", 5, np.int32)
+    assert not np.shares_memory(a, b)
+    assert arena.allocations == 2
+    assert arena.nbytes == 0
+    assert arena.high_water_marks() == {"a": 40}
+
+def test_allocator():
+    sizes = []
+    def allocator(nbytes):
+        sizes.append(nbytes)
+        return bytearray(nbytes)
+
+    arena = BufferArena(min_size=1, allocator=allocator)
+    d_a = arena.get("a", 10, np.float32)
+    assert arena.get("a", 8, np.float32) is d_a
+    assert sizes == [40]
+
+def test_steady_state_engines():
+    N = 400
+    correlator = QuadraticDifferenceSparse(N, 150, reuse_buffers=True)
+    purger = PurgingSparse(N, reuse_buffers=True)
+    reference_correlator = QuadraticDifferenceSparse(N, 150)
+    reference_purger = PurgingSparse(N)
+
+    for i in range(5):
+        x,y,z,ct = util.generate_input_data(N - 10*(i % 2))
+        col_idx, prefix_sums, degrees, total_hits = correlator.compute(x, y, z, ct)
+        reference = reference_correlator.compute(x, y, z, ct)
+        assert total_hits == reference[3]
+        for a, b in zip((col_idx, prefix_sums, degrees), reference):
+            assert all(a == b)
+        assert np.array_equal(purger.compute(col_idx, prefix_sums, degrees), reference_purger.compute(*reference[:3]))
+        if i == 0:
+            allocations = correlator.arena.allocations, purger.arena.allocations
+
+    #every buffer is allocated on the first call, or when a later slice is larger
+    assert correlator.arena.allocations <= allocations[0] + 1
+    assert purger.arena.allocations <= allocations[1] + 2
+    assert correlator.arena.high_water_marks()["degrees"] == 4*N
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import numpy as np
+
+from km3net import autotune
+from km3net.cpu import QuadraticDifferenceSparse, Match3BSparse, PurgingSparse
+import km3net.util as util
+
+def test_tuning_parameters_agree():
+    np.random.seed(0)
+    N = 3000
+    x,y,z,ct = util.generate_input_data(N, 500.0)
+    offsets = np.array([0, 1000, 1700, N])
+    for engine in (QuadraticDifferenceSparse, Match3BSparse):
+        reference = engine(N, 150, chunk_size=0, block_size=1, workers=1)
+        for chunk_size, block_size, workers in [(0, 7, 1), (512, 1, 1), (700, 16, 2), (100, 150, 3)]:
+            correlator = engine(N, 150, chunk_size=chunk_size, block_size=block_size, workers=workers)
+            for o in (None, offsets):
+                expected = reference.compute_batch(x, y, z, ct, o)
+                result = correlator.compute_batch(x, y, z, ct, o)
+                for a, b in zip(expected[:3], result[:3]):
+                    assert np.array_equal(a, b)
+                assert expected[3] == result[3]
+            correlator.close()
+            assert correlator.executor is None
+
+def test_profile():
+    saved = os.environ.get("KM3NET_TUNING_PROFILE")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile.json")
+            os.environ["KM3NET_TUNING_PROFILE"] = path
+            assert autotune.load_profile() == {}
+            autotune._profiles.clear()
+
+            profile = {"engines": {"QuadraticDifferenceSparse": {"chunk_size": 256, "block_size": 8, "workers": 2}},
+                       "pipeline": {"slice_length": 1000, "overlap": 150}}
+            autotune.save_profile(profile)
+            autotune._profiles.clear()
+            assert autotune.load_profile() == profile
+
+            correlator = QuadraticDifferenceSparse(1000, 150)
+            assert (correlator.chunk_size, correlator.block_size, correlator.workers) == (256, 8, 2)
+            assert QuadraticDifferenceSparse(1000, 150, block_size=1).block_size == 1
+            assert Match3BSparse(1000, 150).block_size == 1
+            assert autotune.pipeline_settings()["overlap"] == 150
+
+            os.environ["KM3NET_TUNING_PROFILE"] = ""
+            assert autotune.load_profile() == {}
+            assert QuadraticDifferenceSparse(1000, 150, use_profile=True).block_size == 1
+
+            #without the variable the profile of this host is only used on request
+            del os.environ["KM3NET_TUNING_PROFILE"]
+            autotune._profiles[autotune.profile_path()] = profile
+            assert QuadraticDifferenceSparse(1000, 150).block_size == 1
+            assert autotune.pipeline_settings() == {}
+            assert QuadraticDifferenceSparse(1000, 150, use_profile=True).block_size == 8
+            assert autotune.pipeline_settings(use_profile=True)["overlap"] == 150
+    finally:
+        autotune._profiles.clear()
+        if saved is None:
+            os.environ.pop("KM3NET_TUNING_PROFILE", None)
+        else:
+            os.environ["KM3NET_TUNING_PROFILE"] = saved
+
+def test_tune():
+    hits = autotune.sample_hits(2000)
+    assert len(hits[0]) == 2000
+    assert np.all(np.diff(hits[3]) >= 0)
+    space = {"chunk_size": [None, 500], "block_size": [1, 8], "workers": [1]}
+    profile = autotune.tune(hits, window=100, space=space, slice_lengths=[500, 1000],
+                            engines=[QuadraticDifferenceSparse], repeat=1)
+    settings = profile["engines"]["QuadraticDifferenceSparse"]
+    assert settings["chunk_size"] in space["chunk_size"]
+    assert settings["block_size"] in space["block_size"]
+    assert profile["pipeline"]["overlap"] == 100
+    assert profile["pipeline"]["slice_length"] in [500, 1000]
+
+def test_engine_latency():
+    hits = autotune.sample_hits(2000)
+    space = {"chunk_size": [None, 500], "block_size": [1, 8], "workers": [1, 2]}
+    best, results = autotune.tune_engine(QuadraticDifferenceSparse, hits, window=100, space=space, repeat=1, min_time=0.0)
+    assert best["block_size"] == min(results, key=lambda r: r["time"])["block_size"]
+    #a target every candidate meets selects the fewest workers
+    best, results = autotune.tune_engine(QuadraticDifferenceSparse, hits, window=100, space=space, repeat=1,
+                                         min_time=0.0, latency=1e3)
+    assert best["workers"] == 1
+    assert best["block_size"] == min((r for r in results if r["workers"] == 1), key=lambda r: r["time"])["block_size"]
+
+def test_pipeline_latency():
+    hits = autotune.sample_hits(3000)
+    correlator = QuadraticDifferenceSparse(3000, 100, chunk_size=0, block_size=1, workers=1)
+    purger = PurgingSparse(3000)
+    best, results = autotune.tune_pipeline(correlator, purger, hits, [500, 2500], repeat=1)
+    assert best["slice_length"] == max(results, key=lambda r: r["hits_per_s"])["slice_length"]
+    #an unreachable target selects the lowest latency
+    best, results = autotune.tune_pipeline(correlator, purger, hits, [500, 2500], latency=1e-9, repeat=1)
+    assert best["slice_length"] == min(results, key=lambda r: r["time"])["slice_length"]
+    #slice lengths that do not fit in the sample with the overlap are skipped
+    best, results = autotune.tune_pipeline(correlator, purger, hits, [500, 2950], repeat=1)
+    assert [r["slice_length"] for r in results] == [500]
+    try:
+        autotune.tune_pipeline(correlator, purger, hits, [2950], repeat=1)
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,25 @@
+import sys
+import subprocess
+
+from km3net.backends import get_backend, register_backend, available_backends
+import km3net.cpu
+
+def test_get_backend():
+    assert get_backend("cpu") is km3net.cpu
+    try:
+        get_backend("fpga")
+        assert False
+    except ValueError:
+        pass
+
+def test_register_backend():
+    register_backend("numpy", "km3net.cpu")
+    assert get_backend("numpy").PurgingSparse is km3net.cpu.PurgingSparse
+    assert "numpy" in available_backends()
+
+def test_lazy_imports():
+    #importing the pure NumPy parts of the package should not import any of the heavy dependencies
+    code = "import sys, km3net.util, km3net.cpu, km3net.backends, km3net.ringbuffer, km3net.server, km3net.cache; " \
+           "print(sorted(m for m in ['pycuda', 'pandas', 'scipy', 'kernel_tuner'] if m in sys.modules))"
+    output = subprocess.check_output([sys.executable, "-c", code]).decode().strip()
+    assert output == "[]"
@@ -0,0 +1,35 @@
+import json
+import tempfile
+import copy
+
+from km3net import benchmark
+
+def test_run_and_compare():
+    results = benchmark.run(sizes=[200], factors=[2000.0], repeat=2, min_time=0.0)
+    assert set(results["results"]) == set("%s/N=200/factor=2000" % name for name in benchmark.BENCHMARKS)
+    assert all(r["median"] > 0 for r in results["results"].values())
+
+    report = benchmark.compare(results, results)
+    assert len(report) == len(benchmark.BENCHMARKS)
+    assert not any(r[4] for r in report)
+
+    faster = copy.deepcopy(results)
+    faster["results"]["purge/N=200/factor=2000"]["median"] /= 2.0
+    regressions = [r[0] for r in benchmark.compare(faster, results, tolerance=0.1) if r[4]]
+    assert regressions == ["purge/N=200/factor=2000"]
+
+    #renamed benchmarks are reported as missing from the current results and as new
+    renamed = copy.deepcopy(results)
+    renamed["results"]["purge_v2/N=200/factor=2000"] = renamed["results"].pop("purge/N=200/factor=2000")
+    report = {r[0]: r for r in benchmark.compare(results, renamed)}
+    assert len(report) == len(benchmark.BENCHMARKS) + 1
+    assert report["purge_v2/N=200/factor=2000"][1] is None and not report["purge_v2/N=200/factor=2000"][4]
+    assert report["purge/N=200/factor=2000"][2] is None and report["purge/N=200/factor=2000"][4]
+
+def test_main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = tmpdir + "/baseline.json"
+        assert benchmark.main(["run", "--only", "generate", "--sizes", "100", "--factors", "2000", "--repeat", "1", "--save", filename]) == 0
+        with open(filename) as f:
+            assert "generate/N=100/factor=2000" in json.load(f)["results"]
+        assert benchmark.main(["compare", filename, filename]) == 0
@@ -0,0 +1,59 @@
+import tempfile
+
+from km3net.build import KernelBuildCache
+
+class StubCompiler(object):
+    name = "stub"
+
+    def __init__(self):
+        self.compiled = []
+
+    def compile(self, source, options, arch, code, no_extern_c):
+        self.compiled.append(source)
+        return (arch + "\n" + source).encode()
+
+    def load(self, binary, function_names):
+        return {name: (name, binary) for name in function_names}
+
+def test_compile_once():
+    compiler = StubCompiler()
+    cache = KernelBuildCache(directory=False, compiler=compiler)
+
+    f1, f2 = cache.get_functions("kernel", ["f1", "f2"], {"block_size_x": 128}, cc="52")
+    assert f1[0] == "f1" and f2[0] == "f2"
+    assert f1[1] == b"compute_52\n#define block_size_x 128\nkernel"
+
+    cache.get_functions("kernel", ["f1"], {"block_size_x": 128}, cc="52")
+    assert len(compiler.compiled) == 1
+
+    #different defines, options, or architecture require a new build
+    cache.get_functions("kernel", ["f1"], {"block_size_x": 256}, cc="52")
+    cache.get_functions("kernel", ["f1"], {"block_size_x": 128}, options=["-O3"], cc="52")
+    cache.get_functions("kernel", ["f1"], {"block_size_x": 128}, cc="60")
+    assert len(compiler.compiled) == 4
+    assert cache.compiles == 4
+
+def test_disk_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        compiler = StubCompiler()
+        binary = KernelBuildCache(tmpdir, compiler).build("kernel", {"write_sums": 1})
+
+        #a new cache, for example in another worker process, loads the binary from disk
+        other = KernelBuildCache(tmpdir, compiler)
+        assert other.build("kernel", {"write_sums": 1}) == binary
+        assert other.compiles == 0
+        assert len(compiler.compiled) == 1
+
+def test_compiler_version():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        compiler = StubCompiler()
+        compiler.version = lambda: "release 11.8"
+        binary = KernelBuildCache(tmpdir, compiler).build("kernel")
+
+        #a binary built by another version of the compiler is not reused
+        compiler.version = lambda: "release 12.4"
+        other = KernelBuildCache(tmpdir, compiler)
+        assert other.compiler_version == "release 12.4"
+        assert other.build("kernel") == binary
+        assert other.compiles == 1
+        assert len(compiler.compiled) == 2
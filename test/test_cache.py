@@ -0,0 +1,62 @@
+import os
+import time
+import tempfile
+import numpy as np
+
+from km3net.cache import GraphCache, CachedCorrelator
+from km3net.cpu import QuadraticDifferenceSparse, Match3BSparse
+import km3net.util as util
+
+class CountingCorrelator(QuadraticDifferenceSparse):
+    calls = 0
+    def compute(self, x, y, z, ct):
+        self.calls += 1
+        return super().compute(x, y, z, ct)
+
+def test_key():
+    x,y,z,ct = util.generate_input_data(100)
+    key = GraphCache.key(x, y, z, ct, sliding_window_width=150)
+    assert key == GraphCache.key(x.copy(), y, z, ct, sliding_window_width=150)
+    assert key != GraphCache.key(x, y, z, ct, sliding_window_width=151)
+    ct[0] += 1.0
+    assert key != GraphCache.key(x, y, z, ct, sliding_window_width=150)
+
+def test_cached_correlator():
+    N = 300
+    x,y,z,ct = util.generate_input_data(N)
+    correlator = CountingCorrelator(N, 150)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cached = CachedCorrelator(correlator, GraphCache(tmpdir))
+        reference = cached.compute(x, y, z, ct)
+        answer = cached.compute(x, y, z, ct)
+
+        assert correlator.calls == 1
+        assert cached.cache.hits == 1
+        assert isinstance(answer[0], np.memmap)
+        for a, b in zip(reference, answer):
+            assert np.all(a == b)
+
+        #a different criterion does not share entries
+        CachedCorrelator(Match3BSparse(N, 150), cached.cache).compute(x, y, z, ct)
+        assert len(cached.cache.entries()) == 2
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = GraphCache(tmpdir)
+        graph = np.arange(1000, dtype=np.int32), np.arange(10, dtype=np.int32), np.ones(10, dtype=np.int32)
+        cache.put("a", *graph)
+        cache.max_bytes = 2*cache.size()
+        for key in ["b", "c"]:
+            time.sleep(0.01)
+            cache.put(key, *graph)
+
+        assert [e[0] for e in cache.entries()] == ["b", "c"]
+
+        #reading an entry makes it the most recently used
+        time.sleep(0.01)
+        assert cache.get("b") is not None
+        time.sleep(0.01)
+        cache.put("d", *graph)
+        assert [e[0] for e in cache.entries()] == ["b", "d"]
+        assert cache.get("c") is None
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import numpy as np
+
+from km3net.calibration import CalibrationTable, load_calibration
+from km3net.timebase import decode_times
+from km3net.cpu import speed_of_light
+
+def test_apply():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        channel = np.arange(4)
+        position = np.arange(4, dtype=np.float32) * 10
+        t0 = np.array([0.0, 5.0, -3.0, 100.25])
+        table = CalibrationTable.save(tmpdir, channel, position, position + 1, position + 2, t0)
+        assert table.dense and table.num_channels == 4
+
+        t = np.int64(10**18) + np.array([0, 1, 2, 3, 4], dtype=np.int64)
+        result = table.apply([3, 1, 2, 0, 1], t)
+        assert result.base == 10**18
+        #calibrated times 100.25, 6, -1, 3, 9 are sorted
+        assert list(result.channel) == [2, 0, 1, 1, 3]
+        assert np.allclose(result.hits.ct, np.array([-1, 3, 6, 9, 100.25]) * speed_of_light)
+        assert list(result.hits.x) == [20, 0, 10, 10, 30]
+        assert list(result.hits.z) == [22, 2, 12, 12, 32]
+        for column in result.hits:
+            assert column.dtype == np.float32
+        assert list(decode_times(result.base, result.hits.ct)) == [10**18 - 1, 10**18 + 3, 10**18 + 6, 10**18 + 9, 10**18 + 100]
+
+        try:
+            table.apply([4], [0])
+            assert False
+        except ValueError:
+            pass
+
+def test_sparse_ids_and_text():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "calibration.txt")
+        with open(filename, "w") as f:
+            f.write("808950076 1.0 2.0 3.0 10\n")
+            f.write("808447031 4.0 5.0 6.0 20\n")
+        table = CalibrationTable.from_text(filename, os.path.join(tmpdir, "table"))
+        assert not table.dense
+        assert list(table.channel) == [808447031, 808950076]
+        assert isinstance(table.x, np.memmap)
+
+        result = table.apply([808950076, 808447031], [1000, 1000], sort=False)
+        assert list(result.hits.x) == [1, 4]
+        assert np.allclose(result.hits.ct, np.array([10, 20]) * speed_of_light)
+
+        try:
+            table.apply([808950077], [0])
+            assert False
+        except ValueError:
+            pass
+
+        #tables are cached until their files change
+        assert load_calibration(os.path.join(tmpdir, "table")) is table
@@ -0,0 +1,28 @@
+import numpy as np
+
+from km3net.coalesce import coalesce_hits
+from km3net.detector import DetectorLayout, SyntheticDetector
+
+def test_coalesce():
+    ct = np.array([0, 1, 2, 3, 4, 10, 11, 30, 31, 40], dtype=np.float32)
+    channel = np.array([5, 5, 7, 5, 7, 5, 7, 5, 5, 7])
+    x = channel.astype(np.float32)
+    weight = np.arange(10, dtype=np.float32)
+    merged = coalesce_hits(x, x, x, ct, channel, gap=3.0, weight=weight)
+
+    #channel 5: runs [0,1,3], [10], [30,31], channel 7: runs [2,4], [11], [40]
+    assert list(merged.hits.ct) == [0, 2, 10, 11, 30, 40]
+    assert list(merged.channel) == [5, 7, 5, 7, 5, 7]
+    assert list(merged.multiplicity) == [3, 2, 1, 1, 2, 1]
+    assert list(merged.weight) == [0+1+3, 2+4, 5, 6, 7+8, 9]
+    assert list(merged.hits.x) == list(merged.channel)
+
+def test_coalesce_no_merge():
+    detector = SyntheticDetector(DetectorLayout(strings=2, doms_per_string=2, pmts_per_dom=4), seed=0)
+    chunk = detector.chunk(1e6)
+    merged = coalesce_hits(*chunk.hits, channel=chunk.pmt, gap=0.0)
+    assert len(merged.hits.ct) <= len(chunk.t)
+    assert merged.multiplicity.sum() == len(chunk.t)
+    assert np.all(np.diff(merged.hits.ct) >= 0)
+    #without a gap, only hits at exactly the same time on the same channel are merged
+    assert np.array_equal(merged.weight, merged.multiplicity.astype(np.float32))
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from km3net.cpu import QuadraticDifferenceSparse, Match3BSparse, PurgingSparse, pack_slices, compute_batch
+import km3net.util as util
+
+def test_QuadraticDifferenceSparse_cpu():
+    N = 500
+    window_width = 150
+    x,y,z,ct = util.generate_input_data(N)
+
+    col_idx, prefix_sums, degrees, total_hits = QuadraticDifferenceSparse(N, window_width).compute(x, y, z, ct)
+
+    correlations = np.zeros((window_width, N), dtype=np.uint8)
+    correlations = util.correlations_cpu(correlations, x, y, z, ct)
+
+    reference = csr_matrix(util.get_full_matrix(correlations), shape=(N,N))
+    answer = csr_matrix(util.sparse_to_dense(prefix_sums, col_idx), shape=(N,N))
+
+    print(total_hits)
+    print(reference.sum())
+
+    assert total_hits == reference.sum()
+    assert all(degrees == np.asarray(reference.sum(axis=1)).flatten())
+    assert (reference - answer).nnz == 0
+
+def test_Match3BSparse_cpu():
+    N = 500
+    window_width = 150
+    x,y,z,ct = util.generate_input_data(N)
+
+    col_idx, prefix_sums, degrees, total_hits = Match3BSparse(N, window_width).compute(x, y, z, ct)
+
+    correlations = np.zeros((window_width, N), dtype=np.uint8)
+    correlations = util.correlations_cpu_3B(correlations, x, y, z, ct)
+
+    reference = csr_matrix(util.get_full_matrix(correlations), shape=(N,N))
+    answer = csr_matrix(util.sparse_to_dense(prefix_sums, col_idx), shape=(N,N))
+
+    diff = reference - answer
+    print(list(zip(diff.nonzero()[0], diff.nonzero()[1])))
+
+    assert diff.nnz == 0
+
+def test_PurgingSparse_cpu():
+    N = 300
+    sliding_window_width = 150
+
+    correlations = util.generate_correlations_table(N, sliding_window_width, cutoff=2.87)
+    dense_matrix = util.get_full_matrix(correlations)
+    dense_matrix, clique_indices, clique_size = util.insert_clique(dense_matrix, sliding_window_width, 12)
+
+    col_idx, prefix_sums, degrees = util.dense_to_sparse(dense_matrix)
+    col_idx = col_idx.astype(np.int32)
+    degrees_before = degrees.copy()
+
+    found_indices = PurgingSparse(N).compute(col_idx, prefix_sums, degrees)
+
+    print(clique_indices)
+    print(found_indices)
+
+    assert all(degrees == degrees_before)
+    assert all(found_indices == clique_indices)
+
+    found_indices = PurgingSparse(N).compute(col_idx, prefix_sums, degrees, shift=1000)
+    assert all(found_indices == clique_indices + 1000)
+
+def test_PurgingSparse_cpu_empty():
+    N = 10
+    dense_matrix = np.zeros((N,N), dtype=np.uint8)
+    col_idx, prefix_sums, degrees = util.dense_to_sparse(dense_matrix)
+
+    assert len(PurgingSparse(N).compute(col_idx, prefix_sums, degrees)) == 0
+
+def test_compute_batch_cpu():
+    window_width = 150
+    N,x,y,z,ct = util.get_real_input_data(os.path.dirname(os.path.realpath(__file__)) + "/../notebooks/sample1.txt")
+    lengths = [300, 0, 50, 1, 400, 250, 1000]
+    shifts = np.cumsum([0] + lengths[:-1])
+    slices = [util.get_slice(x, y, z, ct, n, shift) for n, shift in zip(lengths, shifts)]
+
+    correlator = QuadraticDifferenceSparse(max(lengths), window_width)
+    purger = PurgingSparse(max(lengths))
+
+    bx, by, bz, bct, offsets = pack_slices(slices)
+    col_idx, prefix_sums, degrees, total_hits = correlator.compute_batch(bx, by, bz, bct, offsets)
+    results = compute_batch(correlator, purger, bx, by, bz, bct, offsets)
+
+    assert len(results) == len(slices)
+    assert total_hits == sum(correlator.compute(*s)[3] for s in slices)
+    for k, s in enumerate(slices):
+        #no correlations cross the slice boundaries
+        start = prefix_sums[offsets[k]-1] if offsets[k] > 0 else 0
+        row_cols = col_idx[start:prefix_sums[offsets[k+1]-1]] if lengths[k] > 0 else []
+        assert all((row_cols >= offsets[k]) & (row_cols < offsets[k+1]))
+
+        reference = purger.compute(*correlator.compute(*s)[:3])
+        print(k, results[k], reference)
+        assert all(results[k] == np.asarray(reference, dtype=int))
+
+def test_estimate():
+    np.random.seed(0)
+    N = 5000
+    x,y,z,ct = util.generate_input_data(N, 200.0)
+    correlator = QuadraticDifferenceSparse(N, 500)
+    total = correlator.compute(x, y, z, ct)[3]
+    estimate = correlator.estimate(x, y, z, ct, samples=16)
+    assert abs(estimate["edges"] - total) <= 0.1*total
+    assert estimate["peak_bytes"] == estimate["output_bytes"] + estimate["working_bytes"]
+    assert correlator.estimate(x, y, z, ct, samples=1000)["edges"] == total
+
+def test_memory_budget():
+    np.random.seed(0)
+    N = 4000
+    x,y,z,ct = util.generate_input_data(N, 200.0)
+    offsets = np.array([0, 1500, N])
+    for engine in (QuadraticDifferenceSparse, Match3BSparse):
+        reference = engine(N, 500, memory_budget=None)
+        estimate = reference.estimate(x, y, z, ct)
+        budget = estimate["peak_bytes"] - estimate["edges"]*3
+        budgeted = engine(N, 500, memory_budget=budget)
+        assert budgeted.split(x, y, z, ct) > 1
+        for o in (None, offsets):
+            expected = reference.compute_batch(x, y, z, ct, o)
+            result = budgeted.compute_batch(x, y, z, ct, o)
+            for a, b in zip(expected[:3], result[:3]):
+                assert np.array_equal(a, b)
+            assert expected[3] == result[3]
+
+    try:
+        QuadraticDifferenceSparse(N, 500, memory_budget=1000).compute(x, y, z, ct)
+        assert False
+    except MemoryError:
+        pass
+
+    #a budget that only fits parts with fewer hits than the window is rejected before correlating
+    estimate = QuadraticDifferenceSparse(N, 500).estimate(x, y, z, ct)
+    budget = estimate["peak_bytes"] - 4*estimate["edges"] - estimate["temporary_bytes"] + 1000
+    try:
+        QuadraticDifferenceSparse(N, 500, memory_budget=budget).split(x, y, z, ct)
+        assert False
+    except MemoryError as e:
+        assert "parts" in str(e)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from km3net.detector import DetectorLayout, SyntheticDetector, speed_of_light
+
+def test_layout():
+    layout = DetectorLayout(strings=4, doms_per_string=3, pmts_per_dom=5, string_spacing=100.0, dom_spacing=10.0)
+    assert layout.num_doms == 12
+    assert layout.num_pmts == 60
+    assert layout.x.dtype == np.float32 and layout.x.size == 60
+    #PMTs of a DOM are close together, DOMs are not
+    dom = np.arange(60) // 5
+    assert np.all(np.abs(layout.z - layout.dom_z[dom]) <= 0.2 + 1e-6)
+    assert len(np.unique(np.round(layout.dom_x))) == 2
+    assert abs(layout.height - 20.0) < 1.0
+
+def test_background_rate():
+    detector = SyntheticDetector(DetectorLayout(strings=4, doms_per_string=4, pmts_per_dom=10),
+                                 muon_rate=0.0, seed=0)
+    duration = 1e7
+    chunk = detector.chunk(duration)
+    expected = detector.rate * duration * 1e-9
+    assert abs(len(chunk.t) - expected) < 5*np.sqrt(expected)
+    assert np.all(chunk.label == 0)
+    assert np.all(np.diff(chunk.t) >= 0)
+    assert np.all((chunk.t >= 0) & (chunk.t < duration))
+
+def test_coincidences():
+    layout = DetectorLayout(strings=1, doms_per_string=2, pmts_per_dom=31)
+    detector = SyntheticDetector(layout, k40_rate=0.0, coincidence_rate=1e4, muon_rate=0.0, seed=0)
+    t, pmt = detector.coincidences(0.0, 1e7)
+    assert t.size > 0
+    #group hits that are close in time, each group is on a single DOM and distinct PMTs
+    order = np.argsort(t)
+    t, pmt = t[order], pmt[order]
+    groups = np.cumsum(np.diff(t, prepend=-np.inf) > 20.0)
+    for g in np.unique(groups)[:50]:
+        members = pmt[groups == g]
+        if members.size >= 2:
+            assert len(np.unique(members // 31)) == 1
+            assert len(np.unique(members)) == members.size
+
+def test_muon_labels():
+    detector = SyntheticDetector(k40_rate=0.0, coincidence_rate=0.0, seed=1)
+    chunk = detector.chunk(1e5, muons=2)
+    assert list(chunk.tracks["id"]) == [1, 2]
+    assert set(np.unique(chunk.label)) <= {1, 2}
+    assert np.count_nonzero(chunk.label) > 10
+    assert np.allclose(chunk.hits.ct, (chunk.t * speed_of_light).astype(np.float32))
+    #muon hits are causally connected, so they are correlated by the quadratic difference criterion
+    hits = chunk.label == 1
+    ct = chunk.hits.ct[hits][:50]
+    x, y, z = chunk.hits.x[hits][:50], chunk.hits.y[hits][:50], chunk.hits.z[hits][:50]
+    d2 = (x[:, None]-x)**2 + (y[:, None]-y)**2 + (z[:, None]-z)**2
+    assert np.mean((ct[:, None]-ct)**2 < d2 + 1e2) > 0.5
+
+def test_stream():
+    detector = SyntheticDetector(DetectorLayout(strings=2, doms_per_string=2, pmts_per_dom=4), seed=0)
+    chunks = list(detector.stream(1e6, chunks=3))
+    assert len(chunks) == 3
+    assert chunks[1].t[0] >= 1e6 and chunks[2].t[-1] < 3e6
+    ids = np.concatenate([c.tracks["id"] for c in chunks])
+    assert len(np.unique(ids)) == len(ids)
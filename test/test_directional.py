@@ -0,0 +1,40 @@
+import numpy as np
+
+from km3net.directional import sphere_directions, projected_time_criterion, MultiDirectionCorrelator
+from km3net.cpu import CorrelateSparse
+from km3net.detector import DetectorLayout, SyntheticDetector
+
+def test_sphere_directions():
+    directions = sphere_directions(50)
+    assert directions.shape == (50, 3)
+    assert np.allclose(np.linalg.norm(directions, axis=1), 1.0, atol=1e-6)
+    assert abs(directions[:, 2].mean()) < 0.05
+    assert np.all(sphere_directions(20, downgoing=True)[:, 2] < 0)
+
+def test_multi_direction():
+    detector = SyntheticDetector(DetectorLayout(strings=9, doms_per_string=6, pmts_per_dom=10), seed=2)
+    hits = detector.chunk(2e4, muons=1).hits
+    N = len(hits.ct)
+    window = 100
+    directions = sphere_directions(6)
+    correlator = MultiDirectionCorrelator(N, window, directions, chunk_size=97)
+    results = correlator.compute(*hits)
+    degrees = correlator.compute_degrees(*hits)
+    assert degrees.shape == (6, N)
+
+    for k, direction in enumerate(directions):
+        reference = CorrelateSparse(N, window, projected_time_criterion(direction), block_size=1, workers=1,
+                                    chunk_size=0).compute(*hits)
+        for a, b in zip(reference[:3], results[k][:3]):
+            assert np.array_equal(a, b)
+        assert np.array_equal(degrees[k], reference[2])
+
+def test_track_direction():
+    #the true direction of a track correlates more of its hits than the opposite direction
+    detector = SyntheticDetector(DetectorLayout(strings=16, doms_per_string=10), k40_rate=0.0,
+                                 coincidence_rate=0.0, seed=3)
+    chunk = detector.chunk(1e5, muons=1)
+    track = chunk.tracks[0]
+    u = np.array([track["dx"], track["dy"], track["dz"]], dtype=np.float32)
+    degrees = MultiDirectionCorrelator(len(chunk.t), 200, np.stack([u, -u]), ct_window=5.0).compute_degrees(*chunk.hits)
+    assert degrees[0].sum() > degrees[1].sum()
@@ -0,0 +1,91 @@
+import numpy as np
+
+from km3net.events import EventBuilder
+
+def _hits(ct):
+    ct = np.asarray(ct, dtype=np.float32)
+    return ct + 1, ct + 2, ct + 3, ct
+
+def test_query_wraparound():
+    builder = EventBuilder(capacity=10, pre_window=0.0, post_window=0.0)
+    builder.append(*_hits(np.arange(7)))
+    builder.append(*_hits(np.arange(7, 15)))
+    assert builder.oldest == 5
+    hits = builder.query(6, 12)
+    assert list(hits.ct) == list(range(6, 13))
+    assert list(hits.x) == list(range(7, 14))
+    #hits that have left the look-back buffer are not returned
+    assert list(builder.query(0, 6).ct) == [5, 6]
+    assert builder.query(20, 30).ct.size == 0
+
+def test_large_append():
+    builder = EventBuilder(capacity=10)
+    builder.append(*_hits(np.arange(25)))
+    assert builder.oldest == 15
+    assert list(builder.query(0, 100).ct) == list(range(15, 25))
+
+def test_trigger_merge_and_emit():
+    builder = EventBuilder(capacity=1000, pre_window=5.0, post_window=5.0)
+    ct = np.arange(0, 100, dtype=np.float32)
+    assert builder.append(*_hits(ct[:50])) == []
+    builder.trigger_hits(ct, [20, 22, 25])
+    builder.trigger_hits(ct, [33, 34, 35])
+    builder.trigger_hits(ct, [45, 46])
+    builder.trigger_hits(ct, [])
+    assert builder.pending == [(15.0, 51.0)]
+    assert builder.poll() == []
+
+    events = builder.append(*_hits(ct[50:]))
+    assert len(events) == 1
+    event = events[0]
+    assert (event.start, event.end) == (15.0, 51.0)
+    assert list(event.hits.ct) == list(range(15, 52))
+    assert event.complete
+
+    builder.trigger(90, 98)
+    events = builder.flush()
+    assert list(events[0].hits.ct) == list(range(85, 100))
+    assert builder.pending == []
+
+def test_incomplete_event():
+    builder = EventBuilder(capacity=10, pre_window=5.0, post_window=1.0)
+    builder.append(*_hits(np.arange(30)))
+    builder.trigger(22, 24)
+    event = builder.flush()[0]
+    assert not event.complete
+    assert list(event.hits.ct) == list(range(20, 26))
+
+def test_relative_slices():
+    from km3net.timebase import encode_times, decode_times
+    builder = EventBuilder(capacity=50, pre_window=1.0, post_window=1.0, max_ct=100.0)
+    t = 10**17 + np.arange(0, 2000, 10, dtype=np.int64)
+    events = []
+    for start in range(0, t.size, 20):
+        base, ct = encode_times(t[start:start+20])
+        if start == 100:
+            builder.trigger_hits(ct, [5, 6], base=base)
+        events += builder.append(*_hits(ct), base=base)
+    assert builder.base > t[0]
+    #the kept hits span about 150, the stored ct stay within twice that
+    assert builder.columns[3].max() < 400.0
+    assert len(events) == 1
+    event = events[0]
+    assert np.array_equal(decode_times(event.base, event.hits.ct), t[105:107])
+
+def test_long_run_precision():
+    from km3net.timebase import encode_times, decode_times
+    from km3net.cpu import speed_of_light
+    builder = EventBuilder()
+    rng = np.random.RandomState(0)
+    #hits about 33 ns apart, a few times through the full look-back buffer
+    t = 10**17 + np.cumsum(rng.randint(1, 66, 3000000)).astype(np.int64)
+    for start in range(0, t.size, 1000):
+        base, ct = encode_times(t[start:start+1000])
+        builder.append(*_hits(ct), base=base)
+    assert builder.base > t[0]
+    kept = t[builder.oldest:]
+    hits = builder.query(-np.inf, np.inf)
+    assert hits.ct.size == kept.size
+    #rounding errors do not accumulate, the error stays within the float32 spacing of the stored ct
+    spacing = np.spacing(hits.ct.max()) / speed_of_light
+    assert np.max(np.abs(decode_times(builder.base, hits.ct) - kept)) <= spacing
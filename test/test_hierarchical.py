@@ -0,0 +1,56 @@
+import os
+import numpy as np
+
+from km3net.hierarchical import HierarchicalCorrelator, super_nodes, quadratic_difference_max_time, match3b_max_time
+from km3net.cpu import QuadraticDifferenceSparse, Match3BSparse, match3b
+from km3net.detector import DetectorLayout, SyntheticDetector
+from km3net import instrument
+import km3net.util as util
+
+sample_file = os.path.dirname(os.path.realpath(__file__)) + "/../notebooks/sample.txt"
+
+def assert_same_graph(result, reference):
+    assert result[3] == reference[3]
+    for a, b in zip(result[:3], reference[:3]):
+        assert np.array_equal(a, b)
+
+def test_super_nodes():
+    ct = np.array([0, 1, 2, 50, 51, 120], dtype=np.float32)
+    x = np.arange(6, dtype=np.float32)
+    module = np.array([0, 1, 0, 0, 1, 0])
+    order, starts, bounds = super_nodes(x, x, x, ct, module, bucket_length=100.0)
+    #bucket 0: module 0 has hits 0, 2, 3, module 1 has hits 1, 4, bucket 1: hit 5
+    assert list(order) == [0, 2, 3, 1, 4, 5]
+    assert list(starts) == [0, 3, 5]
+    assert list(bounds[0, 3]) == [0, 50]
+    assert list(bounds[1, 4]) == [1, 4]
+    assert list(bounds[2, 0]) == [5, 5]
+
+def test_max_time():
+    distance = np.array([0.0, 10.0, 100.0, 500.0])
+    assert np.array_equal(quadratic_difference_max_time(distance), distance)
+    #the bound grows with the distance
+    assert np.all(np.diff(match3b_max_time(distance)) > 0)
+
+def test_sample_file():
+    N,x,y,z,ct = util.get_real_input_data(sample_file)
+    for engine, kwargs in ((QuadraticDifferenceSparse, {}), (Match3BSparse, {"criterion": match3b})):
+        reference = engine(N, 150).compute(x, y, z, ct)
+        result = HierarchicalCorrelator(N, 150, **kwargs).compute(x, y, z, ct)
+        assert_same_graph(result, reference)
+
+def test_fewer_evaluations():
+    detector = SyntheticDetector(DetectorLayout(strings=10), seed=1)
+    chunk = detector.chunk(1e5)
+    n = len(chunk.t)
+    counters = {}
+    hook = lambda stage, c: counters.setdefault(stage, c)
+    instrument.register_hook(hook)
+    try:
+        reference = QuadraticDifferenceSparse(n, 1500).compute(*chunk.hits)
+        correlator = HierarchicalCorrelator(n, 1500, max_pairs=100000)
+        result = correlator.compute(*chunk.hits, module=chunk.pmt // detector.layout.pmts_per_dom)
+    finally:
+        instrument.unregister_hook(hook)
+    assert_same_graph(result, reference)
+    assert counters["correlate_hierarchical"]["pairs_evaluated"] * 4 < counters["correlate"]["pairs_evaluated"]
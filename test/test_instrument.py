@@ -0,0 +1,76 @@
+import os
+import numpy as np
+
+from km3net import instrument
+from km3net.instrument import StageCounters, register_hook, unregister_hook
+from km3net.cpu import QuadraticDifferenceSparse, PurgingSparse
+import km3net.util as util
+
+sample_file = os.path.dirname(os.path.realpath(__file__)) + "/../notebooks/sample.txt"
+
+def test_disabled():
+    assert instrument.hooks == []
+    assert instrument.start() is None
+
+def test_hooks():
+    events = []
+    hook = lambda stage, counters: events.append((stage, counters))
+    register_hook(hook)
+    try:
+        assert instrument.start() is not None
+        instrument.report("stage", instrument.start(), things=3)
+    finally:
+        unregister_hook(hook)
+    instrument.report("stage", 0.0, things=4)
+
+    assert len(events) == 1
+    assert events[0][0] == "stage"
+    assert events[0][1]["things"] == 3
+    assert events[0][1]["time"] >= 0
+
+def test_stage_counters():
+    N = 1000
+    window = 150
+    with StageCounters() as counters:
+        N,x,y,z,ct = util.get_real_input_data(sample_file)
+        x,y,z,ct = util.get_slice(x, y, z, ct, 1000, 0)
+        col_idx, prefix_sums, degrees, total_hits = QuadraticDifferenceSparse(1000, window).compute(x, y, z, ct)
+        found = PurgingSparse(1000).compute(col_idx, prefix_sums, degrees)
+    assert instrument.hooks == []
+
+    print(counters.summary())
+    assert list(counters.calls) == ["ingest", "correlate", "purge"]
+    assert counters.totals["ingest"]["hits"] == 5000
+    assert counters.totals["correlate"]["pairs_evaluated"] == sum(1000-d for d in range(1, window+1))
+    assert counters.totals["correlate"]["edges"] == total_hits
+    assert counters.totals["correlate"]["bytes_allocated"] > 0
+    assert counters.totals["purge"]["surviving_nodes"] == len(found)
+    assert counters.totals["purge"]["iterations"] > 0
+
+def test_memory_accounting():
+    import tracemalloc
+    np.random.seed(0)
+    N = 1000
+    x,y,z,ct = util.generate_input_data(N, 2000.0)
+    with instrument.MemoryAccounting(top=10) as memory:
+        instrument.set_slice(7)
+        col_idx, prefix_sums, degrees, total_hits = QuadraticDifferenceSparse(N, 150).compute(x, y, z, ct)
+        PurgingSparse(N).compute(col_idx, prefix_sums, degrees)
+        instrument.set_slice(None)
+    assert instrument.hooks == []
+    assert not tracemalloc.is_tracing()
+
+    assert [r["stage"] for r in memory.records] == ["correlate", "purge"]
+    assert all(r["slice"] == 7 for r in memory.records)
+    correlate = memory.records[0]
+    names = dict(correlate["largest_arrays"])
+    assert names["col_idx"] == total_hits*4
+    assert correlate["peak_traced_bytes"] >= max(names.values())
+    assert set(memory.peaks()) == {"correlate", "purge"}
+    assert "col_idx" in memory.summary()
+
+def test_memory_disabled():
+    instrument.record_arrays(a=np.zeros(10))
+    with StageCounters() as counters:
+        instrument.report("stage", instrument.start())
+    assert "peak_traced_bytes" not in counters.totals["stage"]
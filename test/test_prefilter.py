@@ -0,0 +1,61 @@
+import numpy as np
+
+from km3net.prefilter import local_coincidences, L1Prefilter
+from km3net.cpu import index_of_refrac, speed_of_light, match3b, QuadraticDifferenceSparse, PurgingSparse
+from km3net.ringbuffer import HitRingBuffer, consume
+from km3net.detector import DetectorLayout, SyntheticDetector
+
+def test_local_coincidences():
+    np.random.seed(0)
+    N = 400
+    x = np.random.uniform(0, 100, N).astype(np.float32)
+    y = np.random.uniform(0, 100, N).astype(np.float32)
+    z = np.random.uniform(0, 100, N).astype(np.float32)
+    ct = np.sort(np.random.uniform(0, 5000, N)).astype(np.float32)
+    mask, num_pairs = local_coincidences(x, y, z, ct, max_distance=30.0, ct_window=5.0)
+
+    d = np.sqrt((x[:, None]-x)**2 + (y[:, None]-y)**2 + (z[:, None]-z)**2)
+    diffct = np.abs(ct[:, None]-ct)
+    pairs = np.triu((d <= 30.0) & (diffct <= index_of_refrac*d + 5.0), 1)
+    assert num_pairs == np.count_nonzero(pairs)
+    assert np.array_equal(mask, pairs.any(axis=0) | pairs.any(axis=1))
+
+def test_accept():
+    layout = DetectorLayout(strings=4, doms_per_string=4, pmts_per_dom=31)
+    background = SyntheticDetector(layout, coincidence_rate=0.0, muon_rate=0.0, seed=0).chunk(5e3)
+    muon = SyntheticDetector(layout, k40_rate=0.0, coincidence_rate=0.0, seed=0).chunk(2e4, muons=1)
+    prefilter = L1Prefilter(threshold=3)
+    assert not prefilter.accept(*background.hits)
+    assert prefilter.accept(*muon.hits)
+    assert (prefilter.accepted, prefilter.rejected) == (1, 1)
+
+def test_accept_times_in_ns():
+    layout = DetectorLayout(strings=4, doms_per_string=4, pmts_per_dom=31)
+    for chunk in (SyntheticDetector(layout, coincidence_rate=0.0, muon_rate=0.0, seed=0).chunk(5e3),
+                  SyntheticDetector(layout, k40_rate=0.0, coincidence_rate=0.0, seed=0).chunk(2e4, muons=1)):
+        x, y, z, ct = chunk.hits
+        t = (ct / speed_of_light).astype(np.float32)
+        assert L1Prefilter(criterion=match3b).accept(x, y, z, t) == L1Prefilter().accept(x, y, z, ct)
+
+def test_lossy():
+    #five hits on modules 100 m apart at nearly the same time form a clique, but no local coincidence
+    x = np.arange(5, dtype=np.float32) * 100.0
+    y = z = np.zeros(5, dtype=np.float32)
+    ct = np.arange(5, dtype=np.float32)
+    graph = QuadraticDifferenceSparse(5, 4).compute(x, y, z, ct)
+    assert len(PurgingSparse(5).compute(*graph[:3])) == 5
+    assert not L1Prefilter(threshold=3).accept(x, y, z, ct)
+
+def test_consume_prefilter():
+    layout = DetectorLayout(strings=4, doms_per_string=4, pmts_per_dom=31)
+    detector = SyntheticDetector(layout, coincidence_rate=0.0, muon_rate=0.0, seed=0)
+    N = 200
+    prefilter = L1Prefilter(threshold=3, min_hits=N+1)
+    with HitRingBuffer(slots=4, max_hits=N) as ring:
+        for _ in range(3):
+            ring.write(*[c[:N] for c in detector.chunk(1e5).hits])
+        ring.close_writer()
+        results = list(consume(ring, QuadraticDifferenceSparse(N, 50), PurgingSparse(N), timeout=1.0, prefilter=prefilter))
+    assert [seq for seq, _ in results] == [0, 1, 2]
+    assert all(len(found) == 0 for _, found in results)
+    assert prefilter.rejected == 3
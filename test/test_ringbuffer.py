@@ -0,0 +1,127 @@
+import os
+import json
+import tempfile
+import numpy as np
+
+from km3net.ringbuffer import HitRingBuffer, HitBatch, replay_files, start_replay_producer, consume
+from km3net.cpu import QuadraticDifferenceSparse, PurgingSparse
+from km3net import autotune
+import km3net.util as util
+
+sample_file = os.path.dirname(os.path.realpath(__file__)) + "/../notebooks/sample.txt"
+
+def test_write_read_release():
+    with HitRingBuffer(slots=2, max_hits=10) as ring:
+        x,y,z,ct = [np.arange(5, dtype=np.float32) + i for i in range(4)]
+
+        assert ring.write(x, y, z, ct) == 0
+        assert ring.write(x[:3], y[:3], z[:3], ct[:3]) == 1
+
+        #ring buffer is full until the first batch is released
+        try:
+            ring.write(x, y, z, ct, timeout=0.01)
+            assert False
+        except TimeoutError:
+            pass
+
+        seq, batch = ring.read()
+        assert seq == 0
+        assert isinstance(batch, HitBatch)
+        assert all(batch.ct == ct)
+        #batches are views on the shared memory
+        assert batch.x.base is not None
+        ring.release(seq)
+
+        assert ring.write(x, y, z, ct, timeout=0.01) == 2
+
+        seq, batch = ring.read()
+        assert seq == 1
+        assert batch.x.size == 3
+        ring.release(seq)
+
+        ring.close_writer()
+        seq, batch = ring.read()
+        assert seq == 2
+        ring.release(seq)
+        assert ring.read() is None
+
+def test_attach():
+    with HitRingBuffer(slots=4, max_hits=100) as ring:
+        other = HitRingBuffer(name=ring.name, create=False)
+        assert other.slots == 4
+        assert other.max_hits == 100
+        other.write(*[np.ones(10, dtype=np.float32)]*4)
+        other.close()
+
+        seq, batch = ring.read(timeout=1.0)
+        assert batch.x.size == 10
+
+def test_replay_and_consume():
+    N,x,y,z,ct = util.get_real_input_data(sample_file)
+    slice_size = 1000
+    correlator = QuadraticDifferenceSparse(slice_size, 150)
+    purger = PurgingSparse(slice_size)
+
+    with HitRingBuffer(slots=2, max_hits=slice_size) as ring:
+        producer = start_replay_producer(ring, [sample_file])
+        results = list(consume(ring, correlator, purger, timeout=30.0))
+        producer.join()
+
+    assert producer.exitcode == 0
+    assert [seq for seq, _ in results] == list(range(int(np.ceil(N/float(slice_size)))))
+
+    for seq, found in results:
+        shift = seq*slice_size
+        reference = purger.compute(*correlator.compute(*util.get_slice(x, y, z, ct, slice_size, shift))[:3])
+        assert all(np.asarray(found) == np.asarray(reference))
+
+def test_replay_overlap():
+    N,x,y,z,ct = util.get_real_input_data(sample_file)
+    with HitRingBuffer(slots=64, max_hits=1000) as ring:
+        batches = replay_files(ring, [sample_file], slice_size=1000, overlap=200)
+        starts = []
+        for seq, batch in ring:
+            starts.append(seq*800)
+            assert np.array_equal(batch.ct, ct[seq*800:seq*800+1000])
+    assert batches == len(starts)
+    assert starts[-1] + 1000 >= N
+
+def test_replay_profile_overlap():
+    N,x,y,z,ct = util.get_real_input_data(sample_file)
+    saved = os.environ.get("KM3NET_TUNING_PROFILE")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profile.json")
+        with open(path, "w") as f:
+            json.dump({"pipeline": {"slice_length": 800, "overlap": 200}}, f)
+        os.environ["KM3NET_TUNING_PROFILE"] = path
+        try:
+            with HitRingBuffer(slots=64, max_hits=1000) as ring:
+                batches = replay_files(ring, [sample_file])
+                for seq, batch in ring:
+                    assert np.array_equal(batch.ct, ct[seq*800:seq*800+1000])
+        finally:
+            autotune._profiles.pop(path, None)
+            if saved is None:
+                del os.environ["KM3NET_TUNING_PROFILE"]
+            else:
+                os.environ["KM3NET_TUNING_PROFILE"] = saved
+    assert (batches-1)*800 + 1000 >= N > (batches-2)*800 + 1000
+
+def test_replay_relative():
+    N,x,y,z,t = util.get_real_input_data(sample_file, raw_times=True)
+    slice_size = 1000
+    correlator = QuadraticDifferenceSparse(slice_size, 150)
+    purger = PurgingSparse(slice_size)
+
+    with HitRingBuffer(slots=2, max_hits=slice_size) as ring:
+        producer = start_replay_producer(ring, [sample_file], slice_size, relative=True)
+        results = list(consume(ring, correlator, purger, timeout=30.0, times=True))
+        producer.join()
+
+    assert producer.exitcode == 0
+    for seq, found, times in results:
+        xs,ys,zs,ct,base = util.get_relative_slice(x, y, z, t, slice_size, seq*slice_size)
+        assert base == t[seq*slice_size]
+        reference = purger.compute(*correlator.compute(xs, ys, zs, ct)[:3])
+        assert all(np.asarray(found) == np.asarray(reference))
+        assert np.array_equal(times, t[seq*slice_size + np.asarray(found, dtype=np.int64)])
@@ -0,0 +1,41 @@
+import csv
+import tempfile
+
+from km3net import scaling
+
+def test_pairs_evaluated():
+    assert scaling.pairs_evaluated(5, 2) == 4 + 3
+    assert scaling.pairs_evaluated(3, 10) == 2 + 1
+
+def test_generate_slices():
+    first, second = scaling.generate_slices(100, 2000.0, 2, seed=3)
+    assert len(first) == 4 and first[0].size == 100
+    assert all((a == b).all() for a, b in zip(scaling.generate_slices(100, 2000.0, 1, seed=4)[0], second))
+
+def test_sweep():
+    rows = scaling.sweep([200], [50], [2000.0], ["qd", "3b"], [1, 2], slices=4, slices_per_worker=2)
+    assert len(rows) == 2*2*2
+    assert [r["slices"] for r in rows if r["mode"] == "weak"] == [2, 4, 2, 4]
+    for row in rows:
+        assert list(row.keys()) == scaling.FIELDS
+        assert row["hits_per_s"] > 0
+        assert row["latency_p50"] <= row["latency_p99"]
+    #every worker count processes the same slices
+    strong = [r for r in rows if r["mode"] == "strong"]
+    assert len(set((r["criterion"], r["edges"]) for r in strong)) == 2
+
+    summary = scaling.summarize(rows)
+    assert len(summary) == len(rows)
+    assert all(s["speedup"] == 1.0 for s in summary if s["workers"] == 1)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scaling.write_csv(rows, tmpdir + "/scaling.csv")
+        with open(tmpdir + "/scaling.csv") as f:
+            assert len(list(csv.DictReader(f))) == len(rows)
+
+def test_peak_memory():
+    #the peak is that of the pipeline on one slice, it does not grow with the number of slices
+    few = scaling.run_point(5000, 100, 2000.0, "qd", 1, 1)
+    many = scaling.run_point(5000, 100, 2000.0, "qd", 2, 8)
+    assert few["peak_memory_mb"] > 0
+    assert abs(many["peak_memory_mb"] - few["peak_memory_mb"]) < 0.25 * few["peak_memory_mb"]
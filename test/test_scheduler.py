@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import subprocess
+import threading
+import numpy as np
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+from .context import SkipTest
+from km3net.scheduler import SliceScheduler, start_local_workers
+from km3net.cpu import QuadraticDifferenceSparse, PurgingSparse
+import km3net.util as util
+
+sample_file = os.path.dirname(os.path.realpath(__file__)) + "/../notebooks/sample.txt"
+
+def _slices(size=1000, count=8):
+    N,x,y,z,ct = util.get_real_input_data(sample_file)
+    return [util.get_slice(x, y, z, ct, size, shift) for shift in range(0, size*count, size)]
+
+def _reference(slices, window=150):
+    results = []
+    for s in slices:
+        col_idx, prefix_sums, degrees, _ = QuadraticDifferenceSparse(len(s[0]), window).compute(*s)
+        results.append(np.asarray(PurgingSparse(len(s[0])).compute(col_idx, prefix_sums, degrees)))
+    return results
+
+def _check(results, slices):
+    assert [seq for seq, _ in results] == list(range(len(slices)))
+    for (seq, found), reference in zip(results, _reference(slices)):
+        assert np.array_equal(found, reference)
+
+def test_local_workers():
+    slices = _slices()
+    with SliceScheduler(authkey=b"test") as scheduler:
+        processes = start_local_workers(scheduler, 2, window=150)
+        results = list(scheduler.run(iter(slices)))
+    for p in processes:
+        p.join(10)
+        assert p.exitcode == 0
+    _check(results, slices)
+    assert scheduler.retries == 0
+
+def test_bad_authkey():
+    slices = _slices(count=2)
+    with SliceScheduler(authkey=b"test") as scheduler:
+        try:
+            Client(scheduler.address, authkey=b"wrong")
+            assert False
+        except AuthenticationError:
+            pass
+        assert scheduler.accept_thread.is_alive()
+        start_local_workers(scheduler, 1, window=150, heartbeat_interval=0.1)
+        results = list(scheduler.run(iter(slices)))
+    _check(results, slices)
+
+def _fake_worker(address, authkey, behaviour, received):
+    conn = Client(address, authkey=authkey)
+    conn.send(("ready", "fake"))
+    received.append(conn.recv()[1])
+    if behaviour == "crash":
+        conn.close()
+    else:
+        #hang without heartbeats until the scheduler gives up on this worker
+        try:
+            while True:
+                conn.recv()
+        except (EOFError, OSError):
+            pass
+
+def _run_with_fake_worker(behaviour, heartbeat_timeout):
+    slices = _slices(count=6)
+    received = []
+    with SliceScheduler(authkey=b"test", heartbeat_timeout=heartbeat_timeout) as scheduler:
+        fake = threading.Thread(target=_fake_worker, args=(scheduler.address, b"test", behaviour, received), daemon=True)
+        fake.start()
+        generator = scheduler.run(iter(slices))
+        first = []
+        #the fake worker is the only worker until it has received a slice
+        while not received:
+            time.sleep(0.01)
+            if not first:
+                first = [None]
+                threading.Thread(target=lambda: first.append(next(generator))).start()
+        start_local_workers(scheduler, 1, window=150, heartbeat_interval=0.1)
+        while len(first) < 2:
+            time.sleep(0.01)
+        results = [first[1]] + list(generator)
+        fake.join(10)
+    _check(results, slices)
+    assert scheduler.retries >= 1
+
+def test_worker_crash():
+    _run_with_fake_worker("crash", heartbeat_timeout=10.0)
+
+def test_heartbeat_timeout():
+    _run_with_fake_worker("hang", heartbeat_timeout=1.0)
+
+def test_only_worker_hangs():
+    slices = _slices(count=2)
+    received = []
+    with SliceScheduler(authkey=b"test", heartbeat_timeout=0.3) as scheduler:
+        fake = threading.Thread(target=_fake_worker, args=(scheduler.address, b"test", "hang", received), daemon=True)
+        fake.start()
+        results = []
+        runner = threading.Thread(target=lambda: results.extend(scheduler.run(iter(slices))), daemon=True)
+        runner.start()
+        while not received:
+            time.sleep(0.01)
+        #without other events the hung worker is dropped, and not added again
+        time.sleep(1.5)
+        assert scheduler.workers == []
+        assert scheduler.retries >= 1
+        start_local_workers(scheduler, 1, window=150, heartbeat_interval=0.1)
+        runner.join(30)
+        fake.join(10)
+    _check(results, slices)
+
+def test_cuda_workers():
+    #the device is checked in another process, the worker processes are forked from this one
+    if subprocess.call([sys.executable, "-c", "import pycuda.autoinit"], stderr=subprocess.DEVNULL) != 0:
+        raise SkipTest("PyCuda not installed or no CUDA device detected")
+    slices = _slices(count=2)
+    with SliceScheduler(authkey=b"test") as scheduler:
+        start_local_workers(scheduler, 1, backend="cuda", window=150)
+        results = list(scheduler.run(iter(slices)))
+    _check(results, slices)
+    assert scheduler.retries == 0
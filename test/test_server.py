@@ -0,0 +1,106 @@
+import os
+import asyncio
+import tempfile
+import numpy as np
+
+from km3net.server import CorrelationServer, replay_client, pack_hits, pack_result, read_hits, read_result
+from km3net.cpu import QuadraticDifferenceSparse, PurgingSparse
+import km3net.util as util
+
+sample_file = os.path.dirname(os.path.realpath(__file__)) + "/../notebooks/sample.txt"
+
+def test_frames():
+    async def roundtrip():
+        x,y,z,ct = [np.arange(5, dtype=np.float32) + i for i in range(4)]
+        reader = asyncio.StreamReader()
+        base = 1 << 40
+        reader.feed_data(pack_hits(3, x, y, z, ct, base) + pack_result(4, [1, 2], base + 1))
+        reader.feed_eof()
+        seq, batch, frame_base = await read_hits(reader)
+        assert seq == 3
+        assert all(batch.ct == ct)
+        assert frame_base == base
+        seq, indices, frame_base = await read_result(reader)
+        assert seq == 4
+        assert list(indices) == [1, 2]
+        assert frame_base == base + 1
+        assert await read_result(reader) is None
+
+        reader = asyncio.StreamReader()
+        reader.feed_data(pack_hits(5, x, y, z, ct))
+        try:
+            await read_hits(reader, max_hits=4)
+            assert False
+        except ValueError:
+            pass
+
+    asyncio.run(roundtrip())
+
+def test_oversized_frame():
+    slice_size = 100
+    server = CorrelationServer(QuadraticDifferenceSparse(slice_size, 50), PurgingSparse(slice_size))
+    x,y,z,ct = [np.arange(slice_size, dtype=np.float32) + i for i in range(4)]
+
+    async def run(path):
+        s = await server.start(path=path)
+        async with s:
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(pack_hits(0, x, y, z, ct))
+            #only the header of a frame with 2**31 hits, the server must not wait for its payload
+            header = pack_hits(1, [], [], [], [])
+            writer.write(header[:8] + (1 << 31).to_bytes(4, "little") + header[12:])
+            await writer.drain()
+            first = await asyncio.wait_for(read_result(reader), 10.0)
+            closed = await asyncio.wait_for(read_result(reader), 10.0)
+            writer.close()
+            return first, closed
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first, closed = asyncio.run(run(tmpdir + "/km3net.sock"))
+    assert first[0] == 0
+    assert closed is None
+
+def test_replay_client():
+    slice_size = 1000
+    correlator = QuadraticDifferenceSparse(slice_size, 150)
+    purger = PurgingSparse(slice_size)
+    server = CorrelationServer(correlator, purger, max_queue=1)
+
+    async def run(path):
+        s = await server.start(path=path)
+        async with s:
+            return await replay_client([sample_file], slice_size, path=path)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = asyncio.run(run(tmpdir + "/km3net.sock"))
+
+    N,x,y,z,ct = util.get_real_input_data(sample_file)
+    assert [seq for seq, _, _ in results] == list(range(int(np.ceil(N/float(slice_size)))))
+    for seq, found, base in results:
+        reference = purger.compute(*correlator.compute(*util.get_slice(x, y, z, ct, slice_size, seq*slice_size))[:3])
+        assert all(found == np.asarray(reference))
+        assert base == 0
+
+def test_replay_client_relative():
+    from km3net.timebase import decode_times
+    slice_size = 1000
+    correlator = QuadraticDifferenceSparse(slice_size, 150)
+    purger = PurgingSparse(slice_size)
+    server = CorrelationServer(correlator, purger)
+
+    async def run(path):
+        s = await server.start(path=path)
+        async with s:
+            return await replay_client([sample_file], slice_size, path=path, relative=True)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = asyncio.run(run(tmpdir + "/km3net.sock"))
+
+    #every result comes back with the base of its batch, which maps the hits back to absolute times
+    N,x,y,z,t = util.get_real_input_data(sample_file, raw_times=True)
+    assert len(results) == int(np.ceil(N/float(slice_size)))
+    for seq, found, base in results:
+        _,_,_,ct,expected_base = util.get_relative_slice(x, y, z, t, slice_size, seq*slice_size)
+        assert base == expected_base
+        times = decode_times(base, ct[found])
+        assert all(times == np.rint(t[seq*slice_size:][found]).astype(np.int64))
@@ -2,14 +2,14 @@ from __future__ import print_function
 
 from scipy.sparse import csr_matrix
 import numpy as np
-import pycuda.driver as drv
-from pycuda.compiler import SourceModule
 
 from .context import skip_if_no_cuda_device
 from km3net.util import get_kernel_path, get_full_matrix, generate_correlations_table, insert_clique
 
 def test_sparse_purging_kernel():
     skip_if_no_cuda_device()
+    import pycuda.driver as drv
+    from pycuda.compiler import SourceModule
 
     prefix = "#define block_size_x 128 \n"
     with open(get_kernel_path()+'remove_nodes.cu', 'r') as f:
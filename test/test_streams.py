@@ -0,0 +1,78 @@
+import numpy as np
+
+from km3net.streams import StreamMerger
+
+def split_modules(ct, modules, frame_length):
+    """ split hits over modules and into frames per module, in a shuffled arrival order """
+    module = np.arange(ct.size) % modules
+    frames = []
+    for m in range(modules):
+        mine = ct[module == m]
+        edges = np.searchsorted(mine, np.arange(0, mine[-1] + frame_length, frame_length))
+        frames.append([mine[a:b] for a, b in zip(edges[:-1], edges[1:]) if b > a] + [mine[edges[-1]:]])
+    return frames
+
+def test_merge():
+    ct = np.sort(np.random.uniform(0, 1e5, 20000)).astype(np.float32)
+    frames = split_modules(ct, 8, 1e3)
+    merger = StreamMerger(range(8), lateness=2e3)
+
+    #deliver the frames round-robin with random skew between the modules
+    rng = np.random.RandomState(0)
+    position = [0] * 8
+    output = []
+    while any(position[m] < len(frames[m]) for m in range(8)):
+        m = rng.randint(8)
+        if position[m] < len(frames[m]):
+            f = frames[m][position[m]]
+            position[m] += 1
+            hits, _ = merger.push(m, f, f, f, f)
+            output.append(hits.ct)
+    output.append(merger.flush()[0].ct)
+    output = np.concatenate(output)
+
+    assert np.all(np.diff(output) >= 0)
+    assert output.size + merger.late_hits == ct.size
+    assert merger.buffered == 0
+
+def test_merge_modules():
+    merger = StreamMerger([3, 5])
+    hits, module = merger.push(3, [0, 1, 2], [0, 1, 2], [0, 1, 2], np.array([1., 4, 9]))
+    assert hits.ct.size == 0
+    hits, module = merger.push(5, [7, 8], [7, 8], [7, 8], np.array([2., 5]))
+    assert list(hits.ct) == [1, 2, 4, 5]
+    assert list(module) == [3, 5, 3, 5]
+    assert list(hits.x) == [0, 7, 1, 8]
+    hits, module = merger.flush()
+    assert list(hits.ct) == [9] and list(module) == [3]
+
+def test_merge_late_and_bounded():
+    merger = StreamMerger([0, 1], max_buffered=4)
+    merger.push(0, [0]*2, [0]*2, [0]*2, np.array([1., 2]))
+    hits, _ = merger.push(1, [0]*2, [0]*2, [0]*2, np.array([3., 4]))
+    assert list(hits.ct) == [1, 2]
+
+    #hits below what was released are late and dropped
+    hits, _ = merger.push(0, [0]*3, [0]*3, [0]*3, np.array([1.5, 5, 6]))
+    assert merger.late_hits == 1
+    assert list(hits.ct) == [3, 4]
+
+    #module 1 is silent, the buffer overflows and the watermark ignores it
+    hits, _ = merger.push(0, [0]*3, [0]*3, [0]*3, np.array([7., 8, 9]))
+    assert list(hits.ct) == [5, 6, 7, 8, 9]
+    assert merger.buffered == 0
+
+def test_pop_keeps_frames_above_cut():
+    merger = StreamMerger([3, 5])
+    first, second = np.array([10., 11]), np.array([12., 13, 14])
+    merger.push(3, first, first, first, first)
+    merger.push(3, second, second, second, second)
+    hits, _ = merger.push(5, [0], [0], [0], np.array([1.]))
+    assert list(hits.ct) == [1]
+    #the frames of module 3 are all above the cut and are left as they were
+    assert len(merger.frames[3]) == 2
+    assert merger.frames[3][0][3] is first and merger.frames[3][1][3] is second
+    hits, module = merger.pop(12.5)
+    assert list(hits.ct) == [10, 11, 12] and list(module) == [3, 3, 3]
+    assert [list(f[3]) for f in merger.frames[3]] == [[13, 14]]
+    assert merger.buffered == 2
@@ -0,0 +1,38 @@
+import numpy as np
+
+from km3net.timebase import encode_times, decode_times, rebase
+from km3net.cpu import speed_of_light
+import km3net.util as util
+
+def test_encode_decode():
+    #nanoseconds since the epoch, far beyond the precision of float32
+    t = np.int64(1700000000) * 10**9 + np.sort(np.random.randint(0, 10**5, 1000)).astype(np.int64)
+    base, ct = encode_times(t)
+    assert base == t[0]
+    assert ct.dtype == np.float32
+    assert np.array_equal(decode_times(base, ct), t)
+
+    #float32 of the absolute times cannot even tell the hits apart, a slice of 100 us can
+    assert np.unique((t * speed_of_light).astype(np.float32)).size < t.size
+    diff = np.diff(ct.astype(np.float64)) - np.diff(t) * speed_of_light
+    assert np.all(np.abs(diff) < 1e-2)
+
+def test_encode_fractional():
+    t = np.array([1e12 + 0.25, 1e12 + 10.75])
+    base, ct = encode_times(t)
+    assert base == 10**12
+    assert np.allclose(ct, [0.25*speed_of_light, 10.75*speed_of_light])
+
+def test_rebase():
+    base, ct = encode_times(np.arange(100, 200, 10, dtype=np.int64) + 10**15)
+    moved = rebase(base, ct, base + 50)
+    assert np.array_equal(decode_times(base + 50, moved), decode_times(base, ct))
+    assert np.allclose(moved, ct - 50*speed_of_light, atol=1e-4)
+
+def test_get_relative_slice():
+    t = np.arange(10, dtype=np.int64) * 1000 + 10**16
+    x = np.arange(10, dtype=np.float32)
+    xs, ys, zs, ct, base = util.get_relative_slice(x, x, x, t, 4, 3)
+    assert list(xs) == [3, 4, 5, 6]
+    assert base == t[3]
+    assert np.allclose(ct, np.arange(4) * 1000 * speed_of_light)
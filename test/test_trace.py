@@ -0,0 +1,60 @@
+import os
+import json
+import tempfile
+import threading
+import numpy as np
+
+from km3net import instrument
+from km3net.trace import Tracer, merge
+from km3net.ringbuffer import HitRingBuffer, consume
+from km3net.cpu import QuadraticDifferenceSparse, PurgingSparse
+import km3net.util as util
+
+def test_tracer_threads():
+    def work(seq):
+        instrument.set_slice(seq)
+        instrument.report("stage", instrument.start(), things=seq)
+
+    with Tracer() as tracer:
+        threads = [threading.Thread(target=work, args=(i,), name="worker-%d" % i) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert instrument.hooks == []
+
+    assert len(tracer.events) == 2
+    assert sorted(e["args"]["slice"] for e in tracer.events) == [0, 1]
+    assert len(set(e["tid"] for e in tracer.events)) == 2
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in tracer.events)
+    names = [e["args"]["name"] for e in tracer.trace_events() if e["name"] == "thread_name"]
+    assert sorted(names) == ["worker-0", "worker-1"]
+
+def test_consume_trace():
+    np.random.seed(0)
+    N = 500
+    ring = HitRingBuffer(slots=2, max_hits=N)
+    try:
+        for _ in range(2):
+            ring.write(*util.generate_input_data(N, 2000.0))
+        ring.close_writer()
+        with Tracer() as tracer:
+            list(consume(ring, QuadraticDifferenceSparse(N, 150), PurgingSparse(N), timeout=1.0))
+    finally:
+        ring.close()
+    instrument.set_slice(None)
+
+    stages = [(e["name"], e["args"]["slice"]) for e in tracer.events]
+    for seq in range(2):
+        for stage in ("read", "correlate", "purge"):
+            assert (stage, seq) in stages
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "trace.json")
+        tracer.write(filename)
+        merged = os.path.join(tmpdir, "merged.json")
+        merge([filename, filename], merged)
+        with open(filename) as f:
+            single = json.load(f)["traceEvents"]
+        with open(merged) as f:
+            assert len(json.load(f)["traceEvents"]) == 2*len(single)
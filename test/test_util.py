@@ -2,6 +2,7 @@ from .context import skip_if_no_cuda_device
 
 import numpy as np
 import os
+from scipy.sparse import csr_matrix
 from km3net.util import *
 
 #this test verifies that we are testing
@@ -0,0 +1,60 @@
+import numpy as np
+
+from km3net.veto import ChannelRateMonitor
+from km3net.cpu import speed_of_light
+
+def batch(rng, t0, noisy_rate=200e3, channels=100, rate=10e3, duration=1e-3):
+    """ hits of one batch, channel 3 is noisy """
+    counts = rng.poisson(rate*duration, channels)
+    counts[3] = rng.poisson(noisy_rate*duration)
+    channel = np.repeat(np.arange(channels), counts)
+    t = t0 + rng.uniform(0, duration*1e9, channel.size)
+    order = np.argsort(t)
+    ct = (t[order] * speed_of_light).astype(np.float32)
+    return ct, ct, ct, ct, channel[order]
+
+def test_veto_noisy_channel():
+    rng = np.random.RandomState(0)
+    monitor = ChannelRateMonitor(100, max_rate=50e3, time_constant=0.01)
+    for k in range(20):
+        x, y, z, ct, channel = batch(rng, k*1e6)
+        hits, kept = monitor.filter(x, y, z, ct, channel, duration=1e-3)
+    assert list(monitor.veto_list) == [3]
+    assert np.count_nonzero(kept == 3) == 0
+    assert kept.size == hits.ct.size == np.count_nonzero(channel != 3)
+    assert abs(monitor.rates[3] - 200e3) < 20e3
+    assert np.all(np.abs(np.delete(monitor.rates, 3) - 10e3) < 10e3)
+
+    #the channel is released once its rate drops below the release rate
+    for k in range(20, 60):
+        x, y, z, ct, channel = batch(rng, k*1e6, noisy_rate=10e3)
+        monitor.filter(x, y, z, ct, channel)
+    assert monitor.veto_list.size == 0
+
+def test_downsample():
+    rng = np.random.RandomState(1)
+    monitor = ChannelRateMonitor(100, max_rate=50e3, time_constant=0.01, mode="downsample", seed=0)
+    kept_noisy = 0
+    for k in range(40):
+        x, y, z, ct, channel = batch(rng, k*1e6)
+        hits, kept = monitor.filter(x, y, z, ct, channel, duration=1e-3)
+        if k >= 20:
+            kept_noisy += np.count_nonzero(kept == 3)
+    #about max_rate hits per second remain on the noisy channel
+    assert 0.7*50 < kept_noisy / 20.0 < 1.3*50
+
+def test_unknown_mode():
+    try:
+        ChannelRateMonitor(10, mode="drop")
+        assert False
+    except ValueError:
+        pass
+
+def test_unknown_channel():
+    monitor = ChannelRateMonitor(10)
+    try:
+        monitor.update(np.array([1, 12, 3]), 1e-3)
+        assert False
+    except ValueError as e:
+        assert "12" in str(e)
+    assert np.all(monitor.rates == 0)